@@ -38,10 +38,6 @@ class UserLogin(forms.Form):
             elif not self.user_cache.is_active:
                 raise forms.ValidationError(_("This user is currently disabled. Please contact the administrator."))
 
-        if self.request:
-            if not self.request.session.test_cookie_worked():
-                raise forms.ValidationError(_("You must activate your browser cookies."))
-
         return self.cleaned_data
 
     def get_user_id(self):
@@ -0,0 +1,52 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import datetime
+from optparse import make_option
+
+from django.contrib.sessions.models import Session
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+class Command(NoArgsCommand):
+    help = ("Deletes expired sessions a chunk at a time, with a short transaction "
+            "per chunk, instead of one long DELETE locking the session table.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option("--chunk-size", dest="chunk_size", type="int", default=1000,
+            help="Number of sessions deleted per transaction."),
+    )
+
+    def handle_noargs(self, **options):
+        chunk_size = options["chunk_size"]
+        verbosity = int(options.get("verbosity", 1))
+
+        now = datetime.datetime.now()
+        total = 0
+        while True:
+            deleted = self.purge(now, chunk_size)
+            total += deleted
+            if deleted < chunk_size:
+                break
+
+        if verbosity > 0:
+            print "Deleted %d expired sessions." % total
+
+    @transaction.commit_on_success
+    def purge(self, now, chunk_size):
+        keys = list(Session.objects.filter(expire_date__lt=now).values_list("session_key", flat=True)[:chunk_size])
+        if keys:
+            Session.objects.filter(session_key__in=keys).delete()
+        return len(keys)
@@ -0,0 +1,36 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+
+class LoginTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("admin", "admin@example.com", "pw")
+
+    def test_login_without_test_cookie(self):
+        response = self.client.post("/login/", {"username": "admin", "password": "pw"})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.client.session["_auth_user_id"], self.user.id)
+
+    def test_wrong_password(self):
+        response = self.client.post("/login/", {"username": "admin", "password": "nope"})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse("_auth_user_id" in self.client.session)
+
+    def test_login_page_sets_no_session(self):
+        self.client.get("/login/")
+        self.assertFalse(self.client.cookies.get("sessionid"))
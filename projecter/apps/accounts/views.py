@@ -36,15 +36,10 @@ def accounts_login(request, template="templates/accounts/login.html"):
         if form.is_valid():
             login(request, form.get_user())
 
-            if request.session.test_cookie_worked():
-              request.session.delete_test_cookie()
-
             return http.HttpResponseRedirect(redirect_to)
     else:
        form = UserLogin(request)
 
-    request.session.set_test_cookie()
-
     return render_to_response(template, RequestContext(request, {
         "form": form
     }))
@@ -0,0 +1,130 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import logging
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import EmailMessage, get_connection
+from django.db import models, transaction
+from django.db.models import Count, Min
+from django.template.loader import render_to_string
+
+from projecter.apps.events.models import PendingNotification, MEDIUM_EMAIL
+
+DIGEST_INTERVAL = getattr(settings, "EVENTS_DIGEST_INTERVAL", 60 * 15)
+DIGEST_MAX_ITEMS = getattr(settings, "EVENTS_DIGEST_MAX_ITEMS", 50)
+DIGEST_BATCH_SIZE = getattr(settings, "EVENTS_DIGEST_BATCH_SIZE", 100)
+BASE_URL = getattr(settings, "PROJECTER_BASE_URL", "")
+
+class Digester(object):
+    """
+    Sends the buffered PendingNotification rows as one email per user.
+
+    A user's digest is due once their oldest pending notification is
+    DIGEST_INTERVAL seconds old or once they have DIGEST_MAX_ITEMS of them.
+    All the messages of a flush go through a single SMTP connection.
+    """
+    def __init__(self, interval=DIGEST_INTERVAL, max_items=DIGEST_MAX_ITEMS,
+                 batch_size=DIGEST_BATCH_SIZE, connection=None):
+        self.interval = interval
+        self.max_items = max_items
+        self.batch_size = batch_size
+        self.connection = connection
+
+    def due_users(self, force=False):
+        pending = PendingNotification.objects.filter(medium=MEDIUM_EMAIL).values("user")
+        if force:
+            return list(set(row["user"] for row in pending))
+
+        cutoff = datetime.datetime.now() - datetime.timedelta(seconds=self.interval)
+        old = pending.annotate(oldest=Min("first_at")).filter(oldest__lte=cutoff)
+        full = pending.annotate(items=Count("id")).filter(items__gte=self.max_items)
+
+        return list(set(row["user"] for row in old) | set(row["user"] for row in full))
+
+    def flush(self, force=False):
+        """
+        Sends every due digest and returns a report of what was done.
+        """
+        started = time.time()
+        report = {"users": 0, "notifications": 0, "messages": 0}
+
+        users = self.due_users(force)
+        if users:
+            connection = self.connection or get_connection()
+            connection.open()
+            try:
+                for start in xrange(0, len(users), self.batch_size):
+                    self.send_batch(connection, users[start:start + self.batch_size], report)
+            finally:
+                connection.close()
+
+        report["seconds"] = time.time() - started
+        report["per_second"] = report["seconds"] and report["notifications"] / report["seconds"] or 0.0
+        report["queue_depth"] = PendingNotification.objects.count()
+
+        logging.info("digests: %(messages)d messages, %(notifications)d notifications in %(seconds).2fs "
+                     "(%(per_second).1f/s), %(queue_depth)d pending" % report)
+        return report
+
+    @transaction.commit_on_success
+    def send_batch(self, connection, user_ids, report):
+        flushed_at = datetime.datetime.now()
+        pending = list(PendingNotification.objects.filter(user__in=user_ids, medium=MEDIUM_EMAIL)
+            .order_by("user", "last_at"))
+        users = User.objects.in_bulk(user_ids)
+
+        by_user = {}
+        for notification in pending:
+            by_user.setdefault(notification.user_id, []).append(notification)
+
+        messages = []
+        for user_id, notifications in by_user.items():
+            user = users.get(user_id)
+            if user is None or not user.email or not user.is_active:
+                continue
+            messages.append(self.build_message(user, notifications))
+
+        if messages:
+            connection.send_messages(messages)
+
+        # Rows bumped by the worker after we read them stay for the next
+        # digest instead of being lost, less the changes just sent.
+        ids = [notification.id for notification in pending]
+        PendingNotification.objects.filter(id__in=ids, last_at__lte=flushed_at).delete()
+
+        left = set(PendingNotification.objects.filter(id__in=ids).values_list("id", flat=True))
+        sent = {}
+        for notification in pending:
+            if notification.id in left:
+                sent.setdefault(notification.count, []).append(notification.id)
+        for count, ids in sent.items():
+            PendingNotification.objects.filter(id__in=ids).update(
+                count=models.F("count") - count, first_at=flushed_at)
+
+        report["users"] += len(by_user)
+        report["notifications"] += len(pending)
+        report["messages"] += len(messages)
+
+    def build_message(self, user, notifications):
+        subject = "[Projecter] %d update%s" % (len(notifications), len(notifications) != 1 and "s" or "")
+        body = render_to_string("templates/events/digest.txt", {
+            "user": user,
+            "notifications": notifications,
+            "base_url": BASE_URL,
+        })
+        return EmailMessage(subject, body, settings.DEFAULT_FROM_EMAIL, [user.email])
@@ -0,0 +1,49 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from projecter.apps.events.queue import DatabaseQueue
+from projecter.apps.events.worker import Worker
+
+class Command(NoArgsCommand):
+    help = "Writes the recipients of pending events. Runs until killed unless --once is given."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option("--once", action="store_true", dest="once", default=False,
+            help="Dispatch the pending events and exit."),
+        make_option("--batch-size", dest="batch_size", type="int", default=500,
+            help="Number of events dispatched per transaction."),
+        make_option("--interval", dest="interval", type="float", default=1.0,
+            help="Seconds to wait when there is nothing to do."),
+    )
+
+    def handle_noargs(self, **options):
+        worker = Worker(DatabaseQueue(), options["batch_size"], options["interval"])
+
+        if not options["once"]:
+            worker.run()
+            return
+
+        total = 0
+        while True:
+            done = worker.run_once()
+            if not done:
+                break
+            total += done
+
+        if int(options.get("verbosity", 1)) > 0:
+            print "Dispatched %d events." % total
@@ -0,0 +1,44 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from projecter.apps.events.digest import Digester
+
+class Command(NoArgsCommand):
+    help = "Emails the pending notification digests that are due."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option("--force", action="store_true", dest="force", default=False,
+            help="Send every pending digest, due or not."),
+        make_option("--loop", dest="loop", type="int", default=0,
+            help="Keep running, checking every LOOP seconds."),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get("verbosity", 1))
+        digester = Digester()
+
+        while True:
+            report = digester.flush(options["force"])
+            if verbosity > 0:
+                print ("%(messages)d messages, %(notifications)d notifications in %(seconds).2fs "
+                       "(%(per_second).1f/s), %(queue_depth)d pending" % report)
+
+            if not options["loop"]:
+                break
+            time.sleep(options["loop"])
@@ -12,29 +12,124 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import datetime
+
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import User
 from django.contrib.contenttypes import generic
 from django.contrib.contenttypes.models import ContentType
 from django.utils.translation import ugettext as _
 
+from projecter.apps.events import queue
+from projecter.apps.projects import signals
+from projecter.apps.projects.bulk import bulk_insert
+
+class EventTypeManager(models.Manager):
+    _ids = {}
+
+    def id_for(self, name):
+        """
+        Returns the id of the EventType with the given name, creating it if
+        needed. Ids are kept in memory after the first lookup, so emitting
+        an event doesn't query event_type.
+        """
+        if name not in self._ids:
+            self._ids[name] = self.get_or_create(name=name)[0].id
+        return self._ids[name]
+
 class EventType(models.Model):
-    name = models.CharField(max_length=255)
+    name = models.CharField(max_length=255, unique=True)
+
+    objects = EventTypeManager()
 
     class Meta:
         db_table = "event_type"
-    
+
+    def __unicode__(self):
+        return u'%s' % self.name
+
+TIMELINE_LENGTH = getattr(settings, "EVENTS_TIMELINE_LENGTH", 500)
+TIMELINE_LABEL_LENGTH = 100
+
+MEDIUM_EMAIL = 1
+
+MEDIUMS = (
+    (MEDIUM_EMAIL, "email"),
+)
+
+STATUS_NEW = 1
+STATUS_UPDATE = 2
+STATUS_DELETE = 3
+
+TARGET_STATUS = (
+    (STATUS_NEW, "new"),
+    (STATUS_UPDATE, "update"),
+    (STATUS_DELETE, "delete"),
+)
+
+class EventManager(models.Manager):
+    def emit(self, user, instance, status=STATUS_UPDATE):
+        """
+        Records that user created, changed or deleted instance and queues
+        the event for the worker. This is all the request pays: one INSERT,
+        recipients are written later by the worker.
+        """
+        name = "%s.%s" % (instance._meta.object_name.lower(), dict(TARGET_STATUS)[status])
+        event = self.create(
+            user=user,
+            event_type_id=EventType.objects.id_for(name),
+            target_status=status,
+            target_content_type=ContentType.objects.get_for_model(instance),
+            target_object_id=instance.pk
+        )
+        queue.get_queue().put(event.id)
+
+        return event
+
+    def emit_many(self, user, instances, status=STATUS_UPDATE):
+        """
+        Same as emit() for many instances of one model, with a multi-row
+        INSERT.
+        """
+        instances = list(instances)
+        if not instances:
+            return 0
+
+        name = "%s.%s" % (instances[0]._meta.object_name.lower(), dict(TARGET_STATUS)[status])
+        event_type_id = EventType.objects.id_for(name)
+        content_type = ContentType.objects.get_for_model(instances[0])
+        created_at = datetime.datetime.now()
+
+        bulk_insert(Event, [Event(
+            user=user,
+            event_type_id=event_type_id,
+            target_status=status,
+            target_content_type=content_type,
+            target_object_id=instance.pk,
+            created_at=created_at
+        ) for instance in instances])
+
+        queue.get_queue().wake()
+
+        return len(instances)
+
 class Event(models.Model):
     user = models.ForeignKey(User, related_name="event_actor")
     recipients = models.ManyToManyField(User, related_name="event_recipients", through='EventRecipient')
+    event_type = models.ForeignKey(EventType, blank=True, null=True)
 
-    target_status = model.PositiveIntegerField(choices=((1, "new"),(2, "update"),(3, ("delete"),), default=1)
+    target_status = models.PositiveIntegerField(choices=TARGET_STATUS, default=STATUS_NEW)
 
     target_content_type = models.ForeignKey(ContentType, related_name="target", blank=True, null=True)
     target_object_id = models.PositiveIntegerField(blank=True, null=True)
     target = generic.GenericForeignKey('target_content_type', 'target_object_id')
 
     created_at = models.DateTimeField(auto_now_add=True)
+    # Set by the worker once the recipients have been written.
+    dispatched = models.BooleanField(default=False, db_index=True)
+
+    objects = EventManager()
 
     class Meta:
         db_table = "event"
@@ -51,12 +146,131 @@ class EventRecipient(models.Model):
 class SignalSettings(models.Model):
     user = models.ForeignKey(User)
     event_type = models.ForeignKey(EventType)
-    medium = models.PositiveIntegerField(choices=((1, "email"),), default=1)
+    medium = models.PositiveIntegerField(choices=MEDIUMS, default=MEDIUM_EMAIL)
     send = models.BooleanField(default=True)
 
     class Meta:
         db_table = "signal_settings"
     
+class TimelineEntryManager(models.Manager):
+    def page(self, user, before=None, limit=50):
+        """
+        Returns up to limit entries of the user's timeline, newest first,
+        older than the entry id given in before.
+        """
+        entries = self.filter(user=user).order_by("-id")
+        if before:
+            entries = entries.filter(id__lt=before)
+        return list(entries[:limit])
+
+    def trim(self, user_ids, length=None):
+        """
+        Drops all but the newest length entries of each user.
+        """
+        length = length or TIMELINE_LENGTH
+        for user_id in user_ids:
+            ids = self.filter(user=user_id).order_by("-id").values_list("id", flat=True)[length:length + 1]
+            if ids:
+                self.filter(user=user_id, id__lte=ids[0]).delete()
+
+class TimelineEntry(models.Model):
+    """
+    One line of a user's activity page. Everything needed to render it is
+    copied here when the worker dispatches the event, so reading a page
+    never touches event, content types or the targets.
+    """
+    user = models.ForeignKey(User)
+    event = models.ForeignKey(Event)
+
+    actor = models.CharField(max_length=30)
+    verb = models.CharField(max_length=20)
+    target_type = models.CharField(max_length=50)
+    target_label = models.CharField(max_length=TIMELINE_LABEL_LENGTH)
+    target_url = models.CharField(max_length=200)
+
+    created_at = models.DateTimeField()
+
+    objects = TimelineEntryManager()
+
+    class Meta:
+        db_table = "timeline_entry"
+
+    def __unicode__(self):
+        return u"%s %s %s" % (self.actor, self.verb, self.target_label)
+
+class PendingNotificationManager(models.Manager):
+    def add(self, notifications):
+        """
+        Buffers (user_id, medium, event, target, actor) tuples until the
+        next digest. Notifications about a target that is already waiting
+        for the same user and medium only bump its count, so ten edits of
+        a task make one line in the digest, not ten.
+        """
+        if not notifications:
+            return
+
+        grouped = {}
+        for user_id, medium, event, target, actor in notifications:
+            key = (user_id, medium, event.target_content_type_id, event.target_object_id)
+            if key in grouped:
+                grouped[key]["count"] += 1
+                grouped[key]["last_at"] = max(grouped[key]["last_at"], event.created_at)
+                grouped[key]["last_actor"] = actor.username
+            else:
+                grouped[key] = {
+                    "target_label": unicode(target)[:TIMELINE_LABEL_LENGTH],
+                    "target_url": target.get_absolute_url(),
+                    "last_actor": actor.username,
+                    "count": 1,
+                    "first_at": event.created_at,
+                    "last_at": event.created_at,
+                }
+
+        rows = self.filter(
+            user__in=set(key[0] for key in grouped),
+            target_object_id__in=set(key[3] for key in grouped)
+        ).values_list("id", "user", "medium", "target_content_type", "target_object_id")
+
+        # Existing rows are bumped with one UPDATE per distinct increment.
+        increments = {}
+        for row in rows:
+            key = tuple(row[1:])
+            if key in grouped:
+                increments.setdefault(grouped.pop(key)["count"], []).append(row[0])
+
+        now = datetime.datetime.now()
+        for count, ids in increments.items():
+            self.filter(id__in=ids).update(count=models.F("count") + count, last_at=now)
+
+        bulk_insert(PendingNotification, [
+            PendingNotification(user_id=user_id, medium=medium,
+                target_content_type_id=content_type_id, target_object_id=object_id, **values)
+            for (user_id, medium, content_type_id, object_id), values in grouped.items()
+        ])
+
+class PendingNotification(models.Model):
+    """
+    A target a user has to be told about in the next digest.
+    """
+    user = models.ForeignKey(User)
+    medium = models.PositiveIntegerField(choices=MEDIUMS, default=MEDIUM_EMAIL)
+
+    target_content_type = models.ForeignKey(ContentType)
+    target_object_id = models.PositiveIntegerField()
+    target_label = models.CharField(max_length=TIMELINE_LABEL_LENGTH)
+    target_url = models.CharField(max_length=200)
+
+    last_actor = models.CharField(max_length=30)
+    count = models.PositiveIntegerField(default=1)
+    first_at = models.DateTimeField(db_index=True)
+    last_at = models.DateTimeField()
+
+    objects = PendingNotificationManager()
+
+    class Meta:
+        db_table = "pending_notification"
+        unique_together = (("user", "medium", "target_content_type", "target_object_id"),)
+
 class Status(models.Model):
     user = models.ForeignKey(User)
     text = models.TextField()
@@ -69,3 +283,14 @@ class Status(models.Model):
     
     def __unicode__(self):
         return u'%s' % self.text
+
+##### Signals
+
+def object_changed(sender, user, instance, created, **kwargs):
+    Event.objects.emit(user, instance, STATUS_NEW if created else STATUS_UPDATE)
+
+def objects_changed(sender, user, instances, **kwargs):
+    Event.objects.emit_many(user, instances, STATUS_UPDATE)
+
+signals.changed.connect(object_changed)
+signals.bulk_changed.connect(objects_changed)
@@ -0,0 +1,99 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import Queue
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import get_model
+
+class DatabaseQueue(object):
+    """
+    The queue is the event table itself: an event is pending until the
+    worker sets its dispatched flag, so enqueueing costs nothing beyond
+    the INSERT of the event.
+    """
+    def put(self, event_id):
+        pass
+
+    def wake(self):
+        pass
+
+    def get_batch(self, size, timeout=None):
+        Event = get_model("events", "Event")
+        return list(Event.objects.filter(dispatched=False).order_by("id").values_list("id", flat=True)[:size])
+
+class LocalQueue(object):
+    """
+    In-process stand-in for development and tests. A daemon thread in the
+    same process dispatches the events; pending events left in the table
+    when the process dies are picked up by the database worker.
+
+    Events are put from inside the transaction that writes them, so the
+    thread, on its own connection, may wake up before they are committed.
+    A put only wakes it up: the batch is read from the table like
+    DatabaseQueue does, and whatever was not committed yet is found on
+    the next wake up or poll.
+    """
+    def __init__(self, start_worker=True):
+        self.queue = Queue.Queue()
+        self.start_worker = start_worker
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def put(self, event_id):
+        self.wake()
+
+    def wake(self):
+        self.queue.put(None)
+        if self.start_worker and self._thread is None:
+            self._start()
+
+    def get_batch(self, size, timeout=None):
+        try:
+            self.queue.get(timeout is not None, timeout)
+            while True:
+                self.queue.get_nowait()
+        except Queue.Empty:
+            pass
+        return DatabaseQueue().get_batch(size)
+
+    def _start(self):
+        from projecter.apps.events.worker import Worker
+
+        self._lock.acquire()
+        try:
+            if self._thread is None:
+                self._thread = threading.Thread(target=Worker(self).run)
+                self._thread.setDaemon(True)
+                self._thread.start()
+        finally:
+            self._lock.release()
+
+BACKENDS = {
+    "database": DatabaseQueue,
+    "local": LocalQueue,
+}
+
+_queue = None
+
+def get_queue():
+    global _queue
+    if _queue is None:
+        backend = getattr(settings, "EVENTS_QUEUE_BACKEND", "database")
+        if backend not in BACKENDS:
+            raise ImproperlyConfigured("Unknown EVENTS_QUEUE_BACKEND %r" % backend)
+        _queue = BACKENDS[backend]()
+    return _queue
@@ -0,0 +1,2 @@
+-- Timeline pages are read newest first for one user.
+CREATE INDEX timeline_entry_user_id ON timeline_entry (user_id, id);
@@ -0,0 +1,215 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.db import models
+from django.test import TestCase
+
+from projecter.apps.events import queue
+from projecter.apps.events.digest import Digester
+from projecter.apps.events import models as event_models
+from projecter.apps.events.models import Event, EventRecipient, EventType, PendingNotification, SignalSettings, TimelineEntry
+from projecter.apps.events.models import STATUS_NEW, STATUS_UPDATE
+from projecter.apps.events.worker import Worker
+from projecter.apps.projects.models import Task
+from projecter.apps.projects.tests import ProjectFixture
+
+class EventFixture(ProjectFixture):
+    """
+    The project of ProjectFixture with a second member, and a worker on
+    the database queue.
+    """
+    def setUp(self):
+        super(EventFixture, self).setUp()
+        EventType.objects._ids.clear()
+
+        self.member = User.objects.create_user("member", "member@example.com", "pw")
+        self.project.people.add(self.member)
+        self.worker = Worker(queue.DatabaseQueue())
+
+    def recipients(self, event):
+        return set(EventRecipient.objects.filter(event=event).values_list("user", flat=True))
+
+class EventTest(EventFixture, TestCase):
+    def test_emit_from_views(self):
+        self.login()
+        response = self.client.post("/projects/%d/add_task/" % self.project.id, {"name": "added",
+            "description": "added here", "type": "bug", "priority": "normal", "status": "new",
+            "milestone": self.milestone.id, "duration": 1, "users": [self.user.id]})
+        self.assertEqual(response.status_code, 302)
+
+        task = Task.objects.get(name="added")
+        event = Event.objects.get()
+        self.assertEqual((event.user, event.target, event.target_status, event.event_type.name),
+            (self.user, task, STATUS_NEW, "task.new"))
+        self.assertFalse(event.dispatched)
+
+    def test_dispatch(self):
+        assignee = User.objects.create_user("assignee", "assignee@example.com", "pw")
+        task = self.task()
+        task.users.add(assignee)
+
+        events = [Event.objects.emit(self.user, task), Event.objects.emit(self.member, self.project)]
+        self.assertEqual(queue.DatabaseQueue().get_batch(10), [event.id for event in events])
+
+        self.assertEqual(self.worker.run_once(), 2)
+        self.assertEqual(self.recipients(events[0]), set([self.member.id, assignee.id]))
+        self.assertEqual(self.recipients(events[1]), set([self.user.id]))
+        self.assertEqual(Event.objects.filter(dispatched=False).count(), 0)
+
+        # A dispatched event is not sent twice.
+        self.assertEqual(self.worker.run_once(), 0)
+        self.assertEqual(self.worker.dispatch([event.id for event in events]), 0)
+        self.assertEqual(EventRecipient.objects.count(), 3)
+
+    def test_muted(self):
+        task = self.task()
+        event = Event.objects.emit(self.user, task)
+        SignalSettings.objects.create(user=self.member, event_type=event.event_type, send=False)
+        other = Event.objects.emit(self.user, task, STATUS_NEW)
+
+        self.worker.run_once()
+        self.assertEqual(self.recipients(event), set())
+        self.assertEqual(self.recipients(other), set([self.member.id]))
+
+    def test_emit_many(self):
+        tasks = [self.task(), self.task()]
+        self.assertEqual(Event.objects.emit_many(self.user, tasks), 2)
+        self.assertEqual(Event.objects.emit_many(self.user, []), 0)
+
+        events = Event.objects.order_by("id")
+        self.assertEqual([(event.target_object_id, event.target_status) for event in events],
+            [(tasks[0].id, STATUS_UPDATE), (tasks[1].id, STATUS_UPDATE)])
+
+        self.worker.run_once()
+        self.assertEqual([self.recipients(event) for event in events], [set([self.member.id])] * 2)
+
+    def test_bulk_change(self):
+        tasks = [self.task(), self.task()]
+        Task.objects.bulk_change(self.project.id, [task.id for task in tasks], self.user, {"priority": "high"})
+        self.assertEqual(sorted(Event.objects.values_list("target_object_id", flat=True)),
+            [task.id for task in tasks])
+
+class TimelineTest(EventFixture, TestCase):
+    def test_written_by_the_worker(self):
+        task = self.task(name="x" * 150)
+        SignalSettings.objects.create(user=self.member, event_type_id=EventType.objects.id_for("task.update"),
+            send=False)
+        event = Event.objects.emit(self.user, task)
+        self.worker.run_once()
+
+        entries = TimelineEntry.objects.order_by("user")
+        self.assertEqual([entry.user for entry in entries], [self.user, self.member])
+        entry = entries[0]
+        self.assertEqual((entry.event, entry.actor, entry.verb, entry.target_url),
+            (event, "admin", "update", "/tasks/%d/" % task.id))
+        self.assertEqual(entry.target_label, "x" * event_models.TIMELINE_LABEL_LENGTH)
+
+    def test_page_and_trim(self):
+        task = self.task()
+        for i in range(5):
+            Event.objects.emit(self.member, task)
+        self.worker.run_once()
+
+        entries = TimelineEntry.objects.page(self.user, limit=2)
+        ids = list(TimelineEntry.objects.filter(user=self.user).order_by("-id").values_list("id", flat=True))
+        self.assertEqual([entry.id for entry in entries], ids[:2])
+        self.assertEqual([entry.id for entry in TimelineEntry.objects.page(self.user, entries[-1].id, 2)], ids[2:4])
+
+        TimelineEntry.objects.trim([self.user.id], 3)
+        self.assertEqual(list(TimelineEntry.objects.filter(user=self.user).order_by("-id").values_list("id", flat=True)),
+            ids[:3])
+        self.assertEqual(TimelineEntry.objects.filter(user=self.member).count(), 5)
+
+    def test_activity_page(self):
+        task = self.task(name="visible")
+        Event.objects.emit(self.member, task)
+        self.worker.run_once()
+
+        self.login()
+        response = self.client.get("/activity/")
+        self.assertContains(response, "visible")
+        self.assertEqual(len(response.context["entries"]), 1)
+        self.assertEqual(response.context["next_before"], None)
+
+class BumpingConnection(object):
+    """
+    Stands in for the SMTP connection, and has the worker bump the pending
+    notifications while the digest is being sent.
+    """
+    def __init__(self):
+        self.messages = []
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def send_messages(self, messages):
+        self.messages.extend(messages)
+        PendingNotification.objects.update(count=models.F("count") + 2,
+            last_at=datetime.datetime.now() + datetime.timedelta(seconds=1))
+
+class DigestTest(EventFixture, TestCase):
+    def setUp(self):
+        super(DigestTest, self).setUp()
+        self.tasks = [self.task(name="first"), self.task(name="second")]
+
+    def notify(self, *tasks):
+        for task in tasks:
+            Event.objects.emit(self.user, task)
+        self.worker.run_once()
+
+    def test_coalesced(self):
+        self.notify(self.tasks[0], self.tasks[0], self.tasks[1])
+        self.notify(self.tasks[0])
+
+        pending = PendingNotification.objects.filter(user=self.member).order_by("target_object_id")
+        self.assertEqual([(row.target_label, row.count) for row in pending], [("first", 3), ("second", 1)])
+
+    def test_due(self):
+        self.notify(*self.tasks)
+        self.assertEqual(Digester(interval=60, max_items=3).due_users(), [])
+        self.assertEqual(Digester(interval=60, max_items=2).due_users(), [self.member.id])
+        self.assertEqual(Digester(interval=60, max_items=3).due_users(force=True), [self.member.id])
+
+        PendingNotification.objects.update(first_at=datetime.datetime.now() - datetime.timedelta(seconds=120))
+        self.assertEqual(Digester(interval=60, max_items=3).due_users(), [self.member.id])
+
+    def test_flush(self):
+        self.notify(self.tasks[0], self.tasks[0], self.tasks[1])
+        self.assertEqual(Digester(interval=60).flush()["messages"], 0)
+
+        report = Digester(interval=60).flush(force=True)
+        self.assertEqual((report["users"], report["notifications"], report["messages"], report["queue_depth"]),
+            (1, 2, 1, 0))
+
+        message = mail.outbox[0]
+        self.assertEqual((message.to, message.subject), (["member@example.com"], "[Projecter] 2 updates"))
+        self.assertTrue("first (2 changes), last by admin" in message.body)
+        self.assertTrue("/tasks/%d/" % self.tasks[1].id in message.body)
+
+    def test_bumped_while_sending(self):
+        self.notify(self.tasks[0], self.tasks[0])
+        connection = BumpingConnection()
+        Digester(connection=connection).flush(force=True)
+
+        self.assertEqual(len(connection.messages), 1)
+        pending = PendingNotification.objects.get()
+        self.assertEqual(pending.count, 2)
+        self.assertTrue(pending.first_at <= datetime.datetime.now())
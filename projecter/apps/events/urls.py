@@ -0,0 +1,5 @@
+from django.conf.urls.defaults import *
+
+urlpatterns = patterns('projecter.apps.events.views',
+    (r'^activity/$', 'events_activity'),
+)
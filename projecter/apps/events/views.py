@@ -0,0 +1,38 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django import http
+from django.conf import settings
+from django.template import RequestContext
+
+from django.shortcuts import render_to_response
+from django.contrib.auth.decorators import login_required
+
+from projecter.apps.events.models import TimelineEntry
+
+ACTIVITY_PER_PAGE = getattr(settings, "EVENTS_ACTIVITY_PER_PAGE", 50)
+
+@login_required
+def events_activity(request, template="templates/events/activity.html"):
+    try:
+        before = int(request.GET.get("before", 0))
+    except ValueError, err:
+        raise http.Http404()
+
+    entries = TimelineEntry.objects.page(request.user, before, ACTIVITY_PER_PAGE)
+
+    return render_to_response(template, RequestContext(request, {
+        "entries": entries,
+        "next_before": len(entries) == ACTIVITY_PER_PAGE and entries[-1].id or None
+    }))
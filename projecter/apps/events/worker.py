@@ -0,0 +1,177 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import time
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+
+from projecter.apps.events.models import Event, EventRecipient, PendingNotification, SignalSettings, TimelineEntry
+from projecter.apps.events.models import MEDIUM_EMAIL, TIMELINE_LABEL_LENGTH
+from projecter.apps.projects.bulk import bulk_insert
+from projecter.apps.projects.models import Project, Milestone, Task
+
+class Worker(object):
+    """
+    Expands pending events into EventRecipient rows.
+
+    Recipients are the people and managers of the event's project, plus
+    the users assigned when the target is a task, minus the actor and the
+    users whose SignalSettings turn that event type off. A batch is
+    resolved with a fixed number of queries whatever its size, apart from
+    trimming the timelines it wrote to.
+    """
+    def __init__(self, queue, batch_size=500, interval=1.0):
+        self.queue = queue
+        self.batch_size = batch_size
+        self.interval = interval
+
+    def run(self):
+        while True:
+            try:
+                if not self.run_once(timeout=self.interval):
+                    time.sleep(self.interval)
+            except Exception, err:
+                logging.exception("events worker failed")
+                time.sleep(self.interval)
+            finally:
+                connection.close()
+
+    def run_once(self, timeout=None):
+        ids = self.queue.get_batch(self.batch_size, timeout)
+        if ids:
+            self.dispatch(ids)
+        return len(ids)
+
+    @transaction.commit_on_success
+    def dispatch(self, ids):
+        events = list(Event.objects.filter(id__in=ids, dispatched=False))
+        if not events:
+            return 0
+
+        targets = self.load_targets(events)
+
+        # Project of every target, and the tasks whose assignees count too.
+        project_ids = {}
+        task_ids = set()
+        for key, target in targets.items():
+            if isinstance(target, Project):
+                project_ids[key] = target.id
+            elif isinstance(target, Task):
+                project_ids[key] = target.project_id
+                task_ids.add(target.id)
+            elif isinstance(target, Milestone):
+                project_ids[key] = target.project_id
+
+        members = {}
+        for through in (Project.people.through, Project.managers.through):
+            rows = through.objects.filter(project__in=set(project_ids.values())).values_list("project", "user")
+            for project_id, user_id in rows:
+                members.setdefault(project_id, set()).add(user_id)
+
+        assigned = {}
+        rows = Task.users.through.objects.filter(task__in=task_ids).values_list("task", "user")
+        for task_id, user_id in rows:
+            assigned.setdefault(task_id, set()).add(user_id)
+
+        candidates = {}
+        for event in events:
+            key = (event.target_content_type_id, event.target_object_id)
+            users = set(members.get(project_ids.get(key), ()))
+            if isinstance(targets.get(key), Task):
+                users |= assigned.get(event.target_object_id, set())
+            users.discard(event.user_id)
+            candidates[event.id] = users
+
+        everyone = set()
+        for users in candidates.values():
+            everyone |= users
+        muted = set()
+        mediums = {}
+        rows = SignalSettings.objects.filter(user__in=everyone,
+            event_type__in=set(event.event_type_id for event in events)).values_list("user", "event_type", "medium", "send")
+        for user_id, event_type_id, medium, send in rows:
+            if send:
+                mediums.setdefault((user_id, event_type_id), set()).add(medium)
+            else:
+                muted.add((user_id, event_type_id))
+
+        actors = User.objects.in_bulk(list(set(event.user_id for event in events)))
+
+        recipients = []
+        notifications = []
+        for event in events:
+            target = targets.get((event.target_content_type_id, event.target_object_id))
+            for user_id in candidates[event.id]:
+                if (user_id, event.event_type_id) in muted:
+                    continue
+                recipients.append(EventRecipient(event_id=event.id, user_id=user_id))
+
+                if target is not None:
+                    for medium in mediums.get((user_id, event.event_type_id), (MEDIUM_EMAIL,)):
+                        notifications.append((user_id, medium, event, target, actors[event.user_id]))
+
+        bulk_insert(EventRecipient, recipients)
+        PendingNotification.objects.add(notifications)
+        self.write_timelines(events, targets, candidates, actors)
+        Event.objects.filter(id__in=[event.id for event in events]).update(dispatched=True)
+
+        return len(recipients)
+
+    def write_timelines(self, events, targets, candidates, actors):
+        """
+        Copies every event into the timeline of the actor and of everyone
+        in the project, whatever their notification settings.
+        """
+        entries = []
+        users = set()
+        for event in events:
+            target = targets.get((event.target_content_type_id, event.target_object_id))
+            if target is None:
+                continue
+
+            for user_id in candidates[event.id] | set([event.user_id]):
+                entries.append(TimelineEntry(
+                    user_id=user_id,
+                    event_id=event.id,
+                    actor=actors[event.user_id].username,
+                    verb=event.get_target_status_display(),
+                    target_type=target._meta.verbose_name,
+                    target_label=unicode(target)[:TIMELINE_LABEL_LENGTH],
+                    target_url=target.get_absolute_url(),
+                    created_at=event.created_at
+                ))
+                users.add(user_id)
+
+        bulk_insert(TimelineEntry, entries)
+        TimelineEntry.objects.trim(users)
+
+    def load_targets(self, events):
+        """
+        Loads the targets of the events with one query per content type,
+        instead of resolving each GenericForeignKey on its own.
+        """
+        wanted = {}
+        for event in events:
+            if event.target_content_type_id:
+                wanted.setdefault(event.target_content_type_id, set()).add(event.target_object_id)
+
+        targets = {}
+        for content_type_id, object_ids in wanted.items():
+            model = ContentType.objects.get_for_id(content_type_id).model_class()
+            for object_id, target in model._default_manager.in_bulk(list(object_ids)).items():
+                targets[(content_type_id, object_id)] = target
+        return targets
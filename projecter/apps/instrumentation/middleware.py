@@ -0,0 +1,90 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from projecter.apps.instrumentation import recorder
+
+log = logging.getLogger("projecter.instrumentation")
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+class InstrumentationMiddleware(object):
+    """
+    Records query count, SQL and render time and the largest result set of
+    every request under the name of its view, and checks them against
+    INSTRUMENTATION_BUDGETS: {"module.view" or "module.view:METHOD": max
+    queries}. Going over budget, or running one statement
+    INSTRUMENTATION_N_PLUS_ONE times, logs a warning. With
+    INSTRUMENTATION_STRICT, as in test runs, going over budget raises
+    QueryBudgetExceeded instead.
+
+    Put it first in MIDDLEWARE_CLASSES so the session and user lookups
+    count too.
+
+    Responses built from an iterator, like the history export, run most
+    of their queries while the server sends the body, after this
+    middleware is done with them, so they are left out of the budgets and
+    the stats rather than recorded as nearly free.
+    """
+    def __init__(self):
+        if not getattr(settings, "INSTRUMENTATION_ENABLED", True):
+            raise MiddlewareNotUsed()
+        recorder.install()
+
+        self.budgets = getattr(settings, "INSTRUMENTATION_BUDGETS", {})
+        self.n_plus_one = getattr(settings, "INSTRUMENTATION_N_PLUS_ONE", 5)
+        self.strict = getattr(settings, "INSTRUMENTATION_STRICT", False)
+
+    def process_request(self, request):
+        recorder.start()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        stats = recorder.current()
+        if stats is not None:
+            stats.view = "%s.%s" % (view_func.__module__, getattr(view_func, "__name__", view_func.__class__.__name__))
+
+    def process_response(self, request, response):
+        stats = recorder.finish()
+        if stats is None or stats.view is None or not response._is_string:
+            return response
+
+        elapsed = stats.elapsed()
+        repeated = stats.repeated(self.n_plus_one)
+        budget = self.budgets.get("%s:%s" % (stats.view, request.method), self.budgets.get(stats.view))
+        over_budget = budget is not None and stats.queries > budget
+
+        recorder.record(stats, elapsed, repeated, over_budget)
+
+        if repeated:
+            log.warning("%s %s repeated %s", request.method, request.path,
+                "; ".join(["%dx %s" % (count, sql[:200]) for sql, count in repeated.items()]))
+
+        if over_budget:
+            message = "%s %s (%s) ran %d queries, budget is %d" % (
+                request.method, request.path, stats.view, stats.queries, budget)
+            if self.strict:
+                raise QueryBudgetExceeded(message)
+            log.warning(message)
+
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("%s %s %s %.1fms queries=%d sql=%.1fms render=%.1fms rows=%d", request.method, request.path,
+                stats.view, elapsed * 1000, stats.queries, stats.sql_time * 1000, stats.render_time * 1000,
+                stats.peak_rows)
+
+        return response
@@ -0,0 +1,232 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Per-request counters for SQL queries and template rendering, and their
+per-view aggregates for the life of the process.
+
+install() wraps BaseDatabaseWrapper.cursor() and Template.render() once.
+Outside an instrumented request the wrappers cost a thread local lookup;
+inside one, a couple of time.time() calls per query or fetch.
+"""
+
+import threading
+import time
+
+from django.db.backends import BaseDatabaseWrapper
+from django.template import Template
+
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+_local = threading.local()
+_installed = False
+
+class RequestStats(object):
+    def __init__(self):
+        self.started = time.time()
+        self.view = None
+        self.queries = 0
+        self.sql_time = 0.0
+        self.render_time = 0.0
+        self.rendering = False
+        self.peak_rows = 0
+        self.statements = {}
+
+    def query(self, sql, elapsed):
+        self.queries += 1
+        self.sql_time += elapsed
+        self.statements[sql] = self.statements.get(sql, 0) + 1
+
+    def repeated(self, threshold):
+        """
+        Returns {sql: count} for the statements run at least threshold
+        times, which usually means a query in a loop (N+1).
+        """
+        return dict((sql, count) for sql, count in self.statements.items() if count >= threshold)
+
+    def elapsed(self):
+        return time.time() - self.started
+
+class InstrumentedCursor(object):
+    def __init__(self, cursor, stats):
+        self.cursor = cursor
+        self.stats = stats
+        self.rows = 0
+
+    def execute(self, sql, params=()):
+        self.rows = 0
+        started = time.time()
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            self.stats.query(sql, time.time() - started)
+
+    def executemany(self, sql, param_list):
+        self.rows = 0
+        started = time.time()
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            self.stats.query(sql, time.time() - started)
+
+    def fetched(self, count):
+        self.rows += count
+        if self.rows > self.stats.peak_rows:
+            self.stats.peak_rows = self.rows
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        if row is not None:
+            self.fetched(1)
+        return row
+
+    def fetchmany(self, *args):
+        rows = self.cursor.fetchmany(*args)
+        self.fetched(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self.cursor.fetchall()
+        self.fetched(len(rows))
+        return rows
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        for row in self.cursor:
+            self.fetched(1)
+            yield row
+
+def install():
+    global _installed
+    if _installed:
+        return
+    _installed = True
+
+    cursor = BaseDatabaseWrapper.cursor
+    def instrumented_cursor(self):
+        stats = current()
+        if stats is None:
+            return cursor(self)
+        return InstrumentedCursor(cursor(self), stats)
+    BaseDatabaseWrapper.cursor = instrumented_cursor
+
+    # Included templates render inside their parent: only the outermost
+    # render is timed.
+    render = Template.render
+    def instrumented_render(self, context):
+        stats = current()
+        if stats is None or stats.rendering:
+            return render(self, context)
+        stats.rendering = True
+        started = time.time()
+        try:
+            return render(self, context)
+        finally:
+            stats.rendering = False
+            stats.render_time += time.time() - started
+    Template.render = instrumented_render
+
+def start():
+    _local.stats = RequestStats()
+    return _local.stats
+
+def current():
+    return getattr(_local, "stats", None)
+
+def finish():
+    stats = current()
+    _local.stats = None
+    return stats
+
+##### Aggregates
+
+class Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+
+    def add(self, value):
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[position] += 1
+                return
+        self.counts[-1] += 1
+
+    def as_dict(self):
+        labels = ["<=%s" % bound for bound in self.buckets] + [">%s" % self.buckets[-1]]
+        return dict(zip(labels, self.counts))
+
+class ViewStats(object):
+    def __init__(self):
+        self.requests = 0
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.max_queries = 0
+        self.total_queries = 0
+        self.sql_ms = 0.0
+        self.render_ms = 0.0
+        self.peak_rows = 0
+        self.n_plus_one = 0
+        self.over_budget = 0
+
+    def add(self, stats, elapsed, repeated, over_budget):
+        self.requests += 1
+        self.latency.add(elapsed * 1000)
+        self.queries.add(stats.queries)
+        self.max_queries = max(self.max_queries, stats.queries)
+        self.total_queries += stats.queries
+        self.sql_ms += stats.sql_time * 1000
+        self.render_ms += stats.render_time * 1000
+        self.peak_rows = max(self.peak_rows, stats.peak_rows)
+        self.n_plus_one += bool(repeated)
+        self.over_budget += bool(over_budget)
+
+    def as_dict(self):
+        return {
+            "requests": self.requests,
+            "latency_ms": self.latency.as_dict(),
+            "queries": self.queries.as_dict(),
+            "max_queries": self.max_queries,
+            "mean_queries": self.requests and round(float(self.total_queries) / self.requests, 2),
+            "mean_sql_ms": self.requests and round(self.sql_ms / self.requests, 2),
+            "mean_render_ms": self.requests and round(self.render_ms / self.requests, 2),
+            "peak_rows": self.peak_rows,
+            "n_plus_one": self.n_plus_one,
+            "over_budget": self.over_budget,
+        }
+
+_views = {}
+_lock = threading.Lock()
+
+def record(stats, elapsed, repeated, over_budget):
+    _lock.acquire()
+    try:
+        if stats.view not in _views:
+            _views[stats.view] = ViewStats()
+        _views[stats.view].add(stats, elapsed, repeated, over_budget)
+    finally:
+        _lock.release()
+
+def snapshot(reset=False):
+    _lock.acquire()
+    try:
+        views = dict((view, view_stats.as_dict()) for view, view_stats in _views.items())
+        if reset:
+            _views.clear()
+        return views
+    finally:
+        _lock.release()
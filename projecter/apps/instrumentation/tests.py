@@ -0,0 +1,92 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.conf import settings
+from django.test import TestCase
+from django.utils import simplejson
+
+from projecter.apps.instrumentation import recorder
+from projecter.apps.instrumentation.middleware import QueryBudgetExceeded
+from projecter.apps.projects.tests import ProjectFixture
+
+PROJECT_VIEW = "projecter.apps.projects.views.projects_project"
+TASK_VIEW = "projecter.apps.projects.views.projects_task"
+
+class RecorderTest(TestCase):
+    def test_histogram(self):
+        histogram = recorder.Histogram((1, 10))
+        for value in (0, 1, 2, 10, 11, 500):
+            histogram.add(value)
+        self.assertEqual(histogram.as_dict(), {"<=1": 2, "<=10": 2, ">10": 2})
+
+    def test_repeated(self):
+        stats = recorder.RequestStats()
+        for sql in ("a", "b", "a", "a"):
+            stats.query(sql, 0.001)
+        self.assertEqual(stats.queries, 4)
+        self.assertEqual(stats.repeated(3), {"a": 3})
+        self.assertEqual(stats.repeated(4), {})
+
+class MiddlewareTest(ProjectFixture, TestCase):
+    def setUp(self):
+        super(MiddlewareTest, self).setUp()
+        self.budgets = settings.INSTRUMENTATION_BUDGETS
+        self.task_id = self.task().id
+        recorder.snapshot(reset=True)
+        self.login()
+
+    def tearDown(self):
+        settings.INSTRUMENTATION_BUDGETS = self.budgets
+        settings.INSTRUMENTATION_STRICT = False
+
+    def test_records_views(self):
+        self.client.get("/projects/%d/" % self.project.id)
+        self.client.get("/projects/%d/" % self.project.id)
+
+        stats = recorder.snapshot(reset=True)[PROJECT_VIEW]
+        self.assertEqual(stats["requests"], 2)
+        self.assertTrue(stats["max_queries"] > 0)
+        self.assertEqual(sum(stats["queries"].values()), 2)
+        self.assertEqual(stats["over_budget"], 0)
+        self.assertEqual(recorder.snapshot(), {})
+
+    def test_strict_budgets(self):
+        settings.INSTRUMENTATION_BUDGETS = {TASK_VIEW: 0, TASK_VIEW + ":POST": 1000}
+        settings.INSTRUMENTATION_STRICT = True
+        self.client.handler.load_middleware()
+
+        self.assertRaises(QueryBudgetExceeded, self.client.get, "/tasks/%d/" % self.task_id)
+        response = self.client.post("/tasks/%d/" % self.task_id, {"name": "renamed", "type": "bug",
+            "priority": "normal", "status": "new", "milestone": self.milestone.id, "duration": 1,
+            "users": [self.user.id], "comment": "rename"})
+        self.assertEqual(response.status_code, 302)
+
+    def test_streamed_responses_are_left_out(self):
+        settings.INSTRUMENTATION_BUDGETS = {"projecter.apps.projects.views.projects_history_export": 0}
+        settings.INSTRUMENTATION_STRICT = True
+        self.client.handler.load_middleware()
+
+        response = self.client.get("/projects/%d/history/" % self.project.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(recorder.snapshot(), {})
+
+    def test_stats_page(self):
+        self.client.get("/projects/%d/" % self.project.id)
+        self.assertEqual(self.client.get("/stats/").status_code, 302)
+
+        self.user.is_superuser = True
+        self.user.save()
+        views = simplejson.loads(self.client.get("/stats/", {"reset": "1"}).content)
+        self.assertEqual(views[PROJECT_VIEW]["requests"], 1)
+        self.assertEqual(recorder.snapshot().keys(), ["projecter.apps.instrumentation.views.instrumentation_stats"])
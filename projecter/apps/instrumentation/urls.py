@@ -0,0 +1,5 @@
+from django.conf.urls.defaults import *
+
+urlpatterns = patterns('projecter.apps.instrumentation.views',
+    (r'^stats/$', 'instrumentation_stats'),
+)
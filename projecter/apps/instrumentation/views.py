@@ -0,0 +1,28 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django import http
+from django.contrib.auth.decorators import user_passes_test
+from django.utils import simplejson
+
+from projecter.apps.instrumentation import recorder
+
+@user_passes_test(lambda user: user.is_superuser)
+def instrumentation_stats(request):
+    """
+    Per-view aggregates of this process since it started or since the
+    last ?reset=1.
+    """
+    views = recorder.snapshot(reset=request.GET.get("reset") == "1")
+    return http.HttpResponse(simplejson.dumps(views, indent=2, sort_keys=True), mimetype="application/json")
@@ -0,0 +1,430 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Read-only JSON views for polling clients.
+
+Every view computes its ETag from the cached Project or Task version
+before doing anything else, and django's condition() answers a matching
+If-None-Match with 304 Not Modified right there, so an unchanged poll
+costs a few cache lookups and no queries. ?fields=a,b,c limits the
+output, and the queries, to the listed fields. Only superusers and the
+people and managers of a project can read it.
+"""
+
+import datetime
+import hashlib
+import time
+
+from django import http
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.shortcuts import get_object_or_404
+from django.utils import simplejson
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+from projecter.apps.projects import notify
+from projecter.apps.projects.models import Project, Milestone, MilestoneCounter, Task, TaskChangeSet
+from projecter.apps.projects.models import DeletedTask, MilestoneSnapshot, SyncVersion
+from projecter.apps.projects.filters import TaskFilterForm
+from projecter.apps.projects.permissions import project_permission_required, milestone_project
+from projecter.apps.projects.pagination import TaskKeysetPaginator, InvalidCursor
+
+API_TASKS_PER_PAGE = getattr(settings, "PROJECTER_API_TASKS_PER_PAGE", 100)
+API_CHANGESETS_PER_PAGE = getattr(settings, "PROJECTER_API_CHANGESETS_PER_PAGE", 100)
+API_SYNC_BATCH = getattr(settings, "PROJECTER_API_SYNC_BATCH", 500)
+API_WAIT_TIMEOUT = getattr(settings, "PROJECTER_API_WAIT_TIMEOUT", 30)
+API_WAIT_POLL_INTERVAL = getattr(settings, "PROJECTER_API_WAIT_POLL_INTERVAL", 1.0)
+API_SERIES_DAYS = getattr(settings, "PROJECTER_API_SERIES_DAYS", 30)
+API_SERIES_MAX_DAYS = getattr(settings, "PROJECTER_API_SERIES_MAX_DAYS", 730)
+
+PROJECT_FIELDS = ("id", "name", "description", "company", "managers", "people", "progress")
+MILESTONE_FIELDS = ("id", "name", "description", "project", "progress")
+TASK_FIELDS = ("id", "name", "description", "type", "priority", "status", "is_open", "milestone", "project",
+    "created_at", "changed_at", "duration", "users")
+CHANGESET_FIELDS = ("id", "user", "created_at", "comment", "changes")
+
+# Fields that are not columns of the model and cost extra queries.
+COMPUTED_FIELDS = ("managers", "people", "progress", "users", "changes")
+
+def requested_fields(request, available):
+    """
+    Returns the fields listed in ?fields=, in the order of available, or
+    all of them. Unknown names are ignored.
+    """
+    if not request.GET.get("fields"):
+        return available
+    wanted = set(request.GET["fields"].split(","))
+    return tuple([field for field in available if field in wanted]) or ("id",)
+
+def columns(fields):
+    return [field for field in fields if field not in COMPUTED_FIELDS]
+
+def etag(request, *parts):
+    """
+    Builds an ETag from the given versions plus everything else the
+    response depends on: the user and the query string.
+    """
+    key = "%s:%s:%s" % (request.user.id, request.META.get("QUERY_STRING", ""), ":".join([str(part) for part in parts]))
+    return hashlib.md5(key).hexdigest()
+
+def json_response(data):
+    response = http.HttpResponse(simplejson.dumps(data, cls=DjangoJSONEncoder), mimetype="application/json")
+    patch_cache_control(response, private=True, max_age=0, must_revalidate=True)
+    patch_vary_headers(response, ("Cookie",))
+    return response
+
+def progress_dict(progress):
+    return {
+        "total": progress.total,
+        "completed": progress.completed,
+        "duration": progress.duration,
+        "open_duration": progress.open_duration,
+        "by_status": dict((status, count) for status, count in progress.counts.items()),
+    }
+
+def usernames(through, source, ids):
+    """
+    Returns {id: [username]} for a many to many table, in one query.
+    """
+    names = dict((id, []) for id in ids)
+    rows = through.objects.filter(**{"%s__in" % source: ids}).values_list(source, "user__username")
+    for id, username in rows:
+        names[id].append(username)
+    return names
+
+def parse_day(value, default):
+    if not value:
+        return default
+    try:
+        return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError, err:
+        raise http.Http404()
+
+def parse_token(token):
+    """
+    Reads a sync token: "<version>" when everything up to that version
+    was sent, "<version>-<task id>" when a batch stopped in the middle of
+    the tasks sharing a version.
+    """
+    try:
+        if "-" in token:
+            version, task_id = token.split("-", 1)
+            return int(version), int(task_id)
+        return int(token), None
+    except ValueError, err:
+        raise http.Http404()
+
+##### ETags
+
+def project_etag(request, project_id, *args, **kwargs):
+    return etag(request, "project", project_id, Project.objects.version(project_id))
+
+def milestone_etag(request, milestone_id, *args, **kwargs):
+    project_id = milestone_project(int(milestone_id))
+    if project_id is None:
+        return None
+    return etag(request, "milestone", milestone_id, Project.objects.version(project_id))
+
+def milestone_series_etag(request, milestone_id, *args, **kwargs):
+    project_id = milestone_project(int(milestone_id))
+    if project_id is None:
+        return None
+    # The default range ends today, so the day is part of the tag too.
+    return etag(request, "series", milestone_id, Project.objects.version(project_id), datetime.date.today())
+
+def task_etag(request, task_id, *args, **kwargs):
+    return etag(request, "task", task_id, Task.objects.version(task_id))
+
+##### Views
+
+@login_required
+@project_permission_required("view")
+@condition(etag_func=project_etag)
+def api_project(request, project_id):
+    fields = requested_fields(request, PROJECT_FIELDS)
+    project = get_object_or_404(Project.objects.values(*columns(fields) + ["id"]), id=project_id)
+
+    if "managers" in fields:
+        project["managers"] = usernames(Project.managers.through, "project", [project["id"]])[project["id"]]
+    if "people" in fields:
+        project["people"] = usernames(Project.people.through, "project", [project["id"]])[project["id"]]
+    if "progress" in fields:
+        project["progress"] = progress_dict(MilestoneCounter.objects.project_progress([project["id"]])[project["id"]])
+
+    milestones = list(Milestone.objects.filter(project=project_id).values("id", "name"))
+
+    data = dict((field, project[field]) for field in fields)
+    data["milestones"] = milestones
+    return json_response(data)
+
+@login_required
+@project_permission_required("view")
+@condition(etag_func=milestone_etag)
+def api_milestone(request, milestone_id):
+    fields = requested_fields(request, MILESTONE_FIELDS)
+    milestone = get_object_or_404(Milestone.objects.values(*columns(fields) + ["id"]), id=milestone_id)
+
+    if "progress" in fields:
+        milestone["progress"] = progress_dict(MilestoneCounter.objects.progress([milestone["id"]])[milestone["id"]])
+
+    return json_response(dict((field, milestone[field]) for field in fields))
+
+@login_required
+@project_permission_required("view")
+@condition(etag_func=milestone_series_etag)
+def api_milestone_series(request, milestone_id):
+    """
+    Burndown and cumulative flow data of a milestone, one entry a day
+    between ?start= and ?end= (YYYY-MM-DD, the last API_SERIES_DAYS days
+    by default), read from the daily snapshots.
+    """
+    milestone = get_object_or_404(Milestone.objects.values("id"), id=milestone_id)
+
+    end = parse_day(request.GET.get("end"), datetime.date.today())
+    start = parse_day(request.GET.get("start"), end - datetime.timedelta(days=API_SERIES_DAYS - 1))
+    if start > end or (end - start).days >= API_SERIES_MAX_DAYS:
+        raise http.Http404()
+
+    return json_response(MilestoneSnapshot.objects.series(milestone["id"], start, end))
+
+@login_required
+@project_permission_required("view")
+@condition(etag_func=project_etag)
+def api_project_tasks(request, project_id):
+    """
+    Lists the project's tasks, filtered with the same parameters as the
+    project page and paged with the ?after= / ?before= cursors. Rows are
+    read with values(), so no Task instances are built.
+    """
+    project = get_object_or_404(Project, id=project_id)
+    fields = requested_fields(request, TASK_FIELDS)
+
+    filter_form = TaskFilterForm(request.GET, request.user,
+        project.people.all(), Milestone.objects.filter(project=project))
+    tasks = filter_form.apply(Task.objects.filter(project=project))
+
+    # The paginator needs the ordering columns whatever was asked for.
+    keys = [field for field, descending in TaskKeysetPaginator.keys]
+    paginator = TaskKeysetPaginator(tasks.values(*set(columns(fields) + keys)), per_page=API_TASKS_PER_PAGE)
+    try:
+        page = paginator.page(after=request.GET.get("after"), before=request.GET.get("before"))
+    except InvalidCursor, err:
+        raise http.Http404()
+
+    if "users" in fields:
+        users = usernames(Task.users.through, "task", [task["id"] for task in page])
+        for task in page:
+            task["users"] = users[task["id"]]
+
+    rows = [dict((field, task[field]) for field in fields) for task in page]
+
+    return json_response({
+        "tasks": rows,
+        "next": page.next_cursor,
+        "previous": page.prev_cursor
+    })
+
+@login_required
+@project_permission_required("view")
+@condition(etag_func=task_etag)
+def api_task(request, task_id):
+    fields = requested_fields(request, TASK_FIELDS)
+    task = get_object_or_404(Task.objects.values(*columns(fields) + ["id"]), id=task_id)
+
+    if "users" in fields:
+        task["users"] = usernames(Task.users.through, "task", [task["id"]])[task["id"]]
+
+    return json_response(dict((field, task[field]) for field in fields))
+
+@login_required
+@project_permission_required("view")
+@condition(etag_func=task_etag)
+def api_task_changes(request, task_id):
+    """
+    Lists the task's changesets oldest first, API_CHANGESETS_PER_PAGE at a
+    time, starting after the changeset id given in ?after=.
+    """
+    task = get_object_or_404(Task.objects.values("id"), id=task_id)
+    fields = requested_fields(request, CHANGESET_FIELDS)
+
+    try:
+        after = int(request.GET.get("after", 0))
+    except ValueError, err:
+        raise http.Http404()
+
+    changesets = list(TaskChangeSet.objects.filter(task=task["id"], id__gt=after).select_related("user").order_by(
+        "id")[:API_CHANGESETS_PER_PAGE])
+    if "changes" in fields:
+        TaskChangeSet.objects.attach_changes(changesets)
+
+    rows = []
+    for changeset in changesets:
+        row = {}
+        for field in fields:
+            if field == "user":
+                row["user"] = changeset.user.username
+            elif field == "changes":
+                row["changes"] = [{"field": change.field, "old_value": change.old_value, "new_value": change.new_value}
+                    for change in changeset.fields]
+            else:
+                row[field] = getattr(changeset, field)
+        rows.append(row)
+
+    return json_response({
+        "changes": rows,
+        "next": len(changesets) == API_CHANGESETS_PER_PAGE and changesets[-1].id or None
+    })
+
+def sync_data(project_id, version, task_id, fields, limit, task=None):
+    """
+    Builds the sync feed payload for the tasks of a project, or for one of
+    its tasks, written after the (version, task_id) token.
+    """
+    settled = SyncVersion.objects.settled()
+
+    tasks = Task.objects.filter(project=project_id)
+    deleted = DeletedTask.objects.filter(project=project_id)
+    if task is not None:
+        tasks = tasks.filter(id=task)
+        deleted = deleted.filter(task_id=task)
+
+    since = Q(version__gt=version)
+    if task_id is not None:
+        since |= Q(version=version, id__gt=task_id)
+    rows = list(tasks.filter(since, version__lte=settled).order_by("version", "id").values(
+        *set(columns(fields) + ["id", "version"]))[:limit + 1])
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if more:
+        upto = rows[-1]["version"]
+        next_token = "%d-%d" % (upto, rows[-1]["id"])
+    else:
+        upto = settled
+        next_token = str(max(settled, version))
+
+    ids = [row["id"] for row in rows]
+    if "users" in fields:
+        users = usernames(Task.users.through, "task", ids)
+        for row in rows:
+            row["users"] = users[row["id"]]
+
+    since = Q(version__gt=version)
+    if task_id is not None:
+        since |= Q(version=version, task__gt=task_id)
+    changesets = list(TaskChangeSet.objects.filter(since, task__in=ids, version__lte=upto).select_related(
+        "user").order_by("id"))
+    TaskChangeSet.objects.attach_changes(changesets)
+
+    return {
+        "tasks": [dict((field, row[field]) for field in fields) for row in rows],
+        "changes": [{
+            "id": changeset.id,
+            "task": changeset.task_id,
+            "user": changeset.user.username,
+            "created_at": changeset.created_at,
+            "comment": changeset.comment,
+            "changes": [{"field": change.field, "old_value": change.old_value, "new_value": change.new_value}
+                for change in changeset.fields]
+        } for changeset in changesets],
+        "deleted": list(deleted.filter(version__gt=version, version__lte=upto).values_list("task_id", flat=True)),
+        "next": next_token,
+        "more": more
+    }
+
+def unsettled(project_id, task=None):
+    """
+    Tells if the project has writes the sync feed does not hand out yet.
+    """
+    settled = SyncVersion.objects.settled()
+    tasks = Task.objects.filter(project=project_id, version__gt=settled)
+    deleted = DeletedTask.objects.filter(project=project_id, version__gt=settled)
+    if task is not None:
+        tasks = tasks.filter(id=task)
+        deleted = deleted.filter(task_id=task)
+    return tasks.exists() or deleted.exists()
+
+def sync_parameters(request):
+    version, task_id = parse_token(request.GET.get("since", "0"))
+    try:
+        limit = min(int(request.GET.get("limit", API_SYNC_BATCH)), API_SYNC_BATCH)
+        task = request.GET.get("task") and int(request.GET["task"]) or None
+    except ValueError, err:
+        raise http.Http404()
+    if limit < 1:
+        raise http.Http404()
+    return version, task_id, requested_fields(request, TASK_FIELDS), limit, task
+
+@login_required
+@project_permission_required("view")
+def api_project_sync(request, project_id):
+    """
+    Returns what changed in the project's tasks after ?since=<token>, for
+    clients that keep a local copy: the current state of every task
+    written since, the changesets they got, and the ids of deleted tasks.
+    ?task=<id> narrows it to one task. At most API_SYNC_BATCH tasks are
+    returned; "next" is the token for the following call, and "more"
+    tells if it has anything yet.
+
+    Tasks are read with a range scan over (project, version, id). Versions
+    are only handed out once settled, so a client never jumps past a write
+    that was still committing.
+    """
+    project = get_object_or_404(Project.objects.values("id"), id=project_id)
+    return json_response(sync_data(project["id"], *sync_parameters(request)))
+
+@login_required
+@project_permission_required("view")
+def api_project_wait(request, project_id):
+    """
+    Long-polling version of api_project_sync: when nothing changed after
+    ?since=, holds the request until something does or API_WAIT_TIMEOUT
+    seconds pass, then answers like the sync feed.
+
+    Waiting costs no queries: the notifier wakes the request up when a
+    task of the project is written. Writes that are not settled yet are
+    checked for every API_WAIT_POLL_INTERVAL seconds until they are.
+    """
+    project = get_object_or_404(Project.objects.values("id"), id=project_id)
+    parameters = sync_parameters(request)
+    task = parameters[-1]
+
+    try:
+        timeout = min(float(request.GET.get("timeout", API_WAIT_TIMEOUT)), API_WAIT_TIMEOUT)
+    except ValueError, err:
+        raise http.Http404()
+    deadline = time.time() + timeout
+
+    notifier = notify.get_notifier()
+    while True:
+        seen = notifier.version(project["id"])
+        data = sync_data(project["id"], *parameters)
+        pending = not (data["tasks"] or data["deleted"]) and unsettled(project["id"], task)
+
+        # Ends the read transaction, so the next round sees new commits.
+        transaction.rollback_unless_managed()
+
+        remaining = deadline - time.time()
+        if data["tasks"] or data["deleted"] or remaining <= 0:
+            return json_response(data)
+
+        if pending:
+            time.sleep(min(API_WAIT_POLL_INTERVAL, remaining))
+        else:
+            notifier.wait(project["id"], seen, remaining)
@@ -0,0 +1,142 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Drives the projects views through the test client and measures them.
+
+Each scenario is requested once right after the cache is cleared (the
+cold time) and then repeat times more; the report gives latency
+percentiles over the warm runs and the query count of every run.
+"""
+
+import math
+import random
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count
+from django.test.client import Client
+
+from projecter.apps.projects import workflow
+from projecter.apps.projects.filters import LEGACY_FILTERS
+from projecter.apps.projects.models import Project, Milestone, Task
+
+def percentile(values, fraction):
+    """
+    Nearest rank percentile of a list of numbers.
+    """
+    values = sorted(values)
+    if not values:
+        return None
+    return values[max(0, int(math.ceil(fraction * len(values))) - 1)]
+
+class Benchmark(object):
+    def __init__(self, repeat=20, seed=0):
+        self.repeat = repeat
+        self.rng = random.Random(seed)
+
+    def login(self):
+        if not User.objects.filter(username="benchmark").exists():
+            User.objects.create_superuser("benchmark", "benchmark@example.com", "benchmark")
+        self.client = Client()
+        self.client.login(username="benchmark", password="benchmark")
+
+    def scenarios(self):
+        """
+        Yields (name, method, url, data) for the views being measured, on
+        the project with the most tasks.
+        """
+        project = Project.objects.get(id=Task.objects.order_by().values("project").annotate(
+            num=Count("id")).order_by("-num")[0]["project"])
+        milestone = Milestone.objects.filter(project=project)[0]
+        person = project.people.all()[0]
+        tasks = list(Task.objects.filter(project=project).values_list("id", flat=True))
+
+        yield "projects_index", "get", "/projects/", {}
+        yield "projects_project", "get", "/projects/%d/" % project.id, {}
+        for name in sorted(LEGACY_FILTERS):
+            target = {"by_milestone": milestone.id, "assigned_to": person.id}.get(name, "")
+            yield "projects_project:%s" % name, "get", "/projects/%d/" % project.id, {"filter": name, "target": target}
+        yield "projects_project:status+priority", "get", "/projects/%d/" % project.id, {
+            "status": ["open", "review"], "priority": ["urgent", "high"]}
+        yield "projects_milestone", "get", "/milestones/%d/" % milestone.id, {}
+
+        task = Task.objects.get(id=self.rng.choice(tasks))
+        yield "projects_task", "get", "/tasks/%d/" % task.id, {}
+        yield "projects_task:post", "post", "/tasks/%d/" % task.id, lambda run: {
+            "name": task.name, "type": task.type, "priority": task.priority, "duration": task.duration,
+            "status": self.next_status(task.id, run), "milestone": task.milestone_id,
+            "users": [person.id], "comment": "Benchmark edit %d." % run}
+
+        yield "projects_task_add", "post", "/projects/%d/add_task/" % project.id, lambda run: {
+            "name": "Benchmark task %d" % run, "description": "Added by the benchmark.", "type": "bug", "priority": "normal",
+            "status": "new", "milestone": milestone.id, "users": [person.id], "duration": 1}
+
+    def next_status(self, task_id, run):
+        """
+        Returns a status the task can move to from the one it has now, so
+        every edit is a legal transition.
+        """
+        type, status = Task.objects.filter(id=task_id).values_list("type", "status")[0]
+        choices = [value for value, label in workflow.status_choices(type, status) if value != status]
+        return choices[run % len(choices)]
+
+    def measure(self, method, url, data, run):
+        if callable(data):
+            data = data(run)
+        connection.queries = []
+        started = time.time()
+        response = getattr(self.client, method)(url, data)
+        elapsed = (time.time() - started) * 1000
+        return response.status_code, elapsed, len(connection.queries)
+
+    def run(self):
+        """
+        Returns {scenario name: stats} for every scenario.
+        """
+        debug, settings.DEBUG = settings.DEBUG, True
+        try:
+            self.login()
+            results = {}
+            for name, method, url, data in self.scenarios():
+                cache.clear()
+                status, cold, cold_queries = self.measure(method, url, data, 0)
+
+                timings, queries, statuses = [], [], set([status])
+                for run in xrange(1, self.repeat + 1):
+                    status, elapsed, count = self.measure(method, url, data, run)
+                    timings.append(elapsed)
+                    queries.append(count)
+                    statuses.add(status)
+
+                results[name] = {
+                    "url": url,
+                    "method": method.upper(),
+                    "status": sorted(statuses),
+                    "requests": len(timings),
+                    "cold_ms": round(cold, 2),
+                    "cold_queries": cold_queries,
+                    "p50_ms": round(percentile(timings, 0.5), 2),
+                    "p90_ms": round(percentile(timings, 0.9), 2),
+                    "p99_ms": round(percentile(timings, 0.99), 2),
+                    "max_ms": round(max(timings), 2),
+                    "queries_p50": percentile(queries, 0.5),
+                    "queries_max": max(queries),
+                }
+            return results
+        finally:
+            settings.DEBUG = debug
@@ -0,0 +1,77 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.db import connection, models, transaction
+
+CHUNK_SIZE = 500
+
+def bulk_insert(model, objects, chunk_size=CHUNK_SIZE):
+    """
+    Inserts unsaved model instances with multi-row INSERT statements, one
+    per chunk_size objects, instead of one round trip per object.
+
+    Model.save() is not called, so no signals are sent and primary keys
+    are not set on the instances. Values already set on the instances win
+    over auto_now/auto_now_add, so a batch can share one timestamp.
+    """
+    objects = list(objects)
+    if not objects:
+        return 0
+
+    qn = connection.ops.quote_name
+    fields = [f for f in model._meta.local_fields if not isinstance(f, models.AutoField)]
+    columns = ", ".join([qn(f.column) for f in fields])
+    row = "(%s)" % ", ".join(["%s"] * len(fields))
+
+    cursor = connection.cursor()
+    for start in xrange(0, len(objects), chunk_size):
+        chunk = objects[start:start + chunk_size]
+        params = []
+        for obj in chunk:
+            for f in fields:
+                value = getattr(obj, f.attname)
+                if value is None:
+                    value = f.pre_save(obj, True)
+                params.append(f.get_db_prep_save(value, connection=connection))
+
+        sql = "INSERT INTO %s (%s) VALUES %s" % (
+            qn(model._meta.db_table), columns, ", ".join([row] * len(chunk)))
+        cursor.execute(sql, params)
+
+    transaction.commit_unless_managed()
+
+    return len(objects)
+
+def bulk_delete(queryset):
+    """
+    Deletes the rows of a queryset with a single DELETE statement, where
+    QuerySet.delete() loads every row to collect related objects and send
+    signals. Nothing is collected here, so it is meant for tables no
+    other table points to, and the filters may not span relations.
+    """
+    query = queryset.query
+    if len([alias for alias in query.tables if query.alias_refcount[alias]]) > 1:
+        raise ValueError("bulk_delete can't follow relations")
+
+    compiler = query.get_compiler(queryset.db)
+    where, params = query.where.as_sql(qn=compiler.quote_name_unless_alias, connection=connection)
+    sql = "DELETE FROM %s" % connection.ops.quote_name(queryset.model._meta.db_table)
+    if where:
+        sql += " WHERE %s" % where
+
+    cursor = connection.cursor()
+    cursor.execute(sql, params)
+    transaction.commit_unless_managed()
+
+    return cursor.rowcount
@@ -0,0 +1,184 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Synthetic companies for benchmarks and local testing.
+
+Dataset.records() yields rows in the export_projects format, so they are
+loaded with the same chunked bulk inserts as import_projects. Everything
+comes from a seeded random generator: the same parameters and seed give
+the same data. Histories are derived from a generator seeded per task, so
+they are rebuilt rather than held in memory between the task pass and the
+changeset and change passes.
+"""
+
+import datetime
+import random
+
+from projecter.apps.projects import workflow
+
+PRIORITIES = [priority for priority, label in workflow.TASK_PRIORITY]
+TYPES = [type for type, label in workflow.TASK_TYPE]
+
+WORDS = ("login", "report", "export", "search", "invoice", "dashboard", "upload", "profile", "email",
+    "billing", "cache", "timeout", "layout", "import", "calendar", "permissions", "mobile", "api")
+VERBS = ("Fix", "Add", "Improve", "Remove", "Refactor", "Document", "Speed up", "Review")
+COMMENTS = ("Looking into it.", "Can't reproduce here, more details?", "Fixed on the branch, please review.",
+    "Moved to the next milestone.", "Blocked on the API change.", "Done, closing.", "Reopened, still happens.",
+    "Customer is asking about this one.")
+
+# companies, projects per company, milestones per project, tasks per
+# milestone, users, average changesets per task
+SIZES = {
+    "tiny": (1, 1, 2, 10, 5, 2),
+    "small": (1, 3, 3, 30, 10, 3),
+    "medium": (2, 5, 5, 100, 50, 4),
+    "large": (4, 10, 10, 250, 200, 5),
+}
+
+class Dataset(object):
+    def __init__(self, companies=1, projects=3, milestones=3, tasks=30, users=10, changesets=3,
+            seed=0, days=365, now=None):
+        self.companies = companies
+        self.projects = projects
+        self.milestones = milestones
+        self.tasks = tasks
+        self.users = users
+        self.changesets = changesets
+        self.seed = seed
+        self.days = days
+        self.now = now or datetime.datetime(2010, 6, 1)
+
+    @classmethod
+    def of_size(cls, size, **kwargs):
+        companies, projects, milestones, tasks, users, changesets = SIZES[size]
+        return cls(companies, projects, milestones, tasks, users, changesets, **kwargs)
+
+    def plan(self):
+        """
+        Lays out the rows every pass agrees on: the usernames, and for each
+        project its company, people and managers, and for each milestone
+        the ids of its tasks.
+        """
+        rng = random.Random(self.seed)
+        usernames = ["user%d" % id for id in xrange(1, self.users + 1)]
+
+        projects = []
+        milestones = []
+        next_task = 1
+        for company in xrange(1, self.companies + 1):
+            for project in xrange(len(projects) + 1, len(projects) + self.projects + 1):
+                people = rng.sample(usernames, min(len(usernames), rng.randint(2, 8)))
+                projects.append((project, company, people, people[:max(1, len(people) / 4)]))
+                for milestone in xrange(len(milestones) + 1, len(milestones) + self.milestones + 1):
+                    milestones.append((milestone, project, people, range(next_task, next_task + self.tasks)))
+                    next_task += self.tasks
+        return usernames, projects, milestones
+
+    def history(self, task_id, people):
+        """
+        Returns (created_at, final state, changesets) of a task, the state
+        holding the assignees too and changesets being (username, created_at, comment, [(field,
+        old value, new value)]) tuples in time order.
+        """
+        rng = random.Random(self.seed * 1000003 + task_id)
+        created_at = self.now - datetime.timedelta(seconds=rng.randint(0, self.days * 24 * 3600))
+
+        state = {
+            "name": "%s %s %s" % (rng.choice(VERBS), rng.choice(WORDS), rng.choice(WORDS)),
+            "type": rng.choice(TYPES),
+            "priority": rng.choice(PRIORITIES),
+            "status": "new",
+            "duration": rng.randint(1, 8),
+        }
+        state["users"] = rng.sample(people, min(len(people), rng.randint(0, 2)))
+
+        changesets = []
+        when = created_at
+        for step in xrange(rng.randint(0, self.changesets * 2)):
+            when += datetime.timedelta(seconds=rng.randint(600, 5 * 24 * 3600))
+            if when > self.now:
+                break
+
+            changes = []
+            roll = rng.random()
+            if roll < 0.6 and workflow.is_open(state["status"]):
+                changes.append(("status", rng.choice(workflow.TRANSITIONS[state["type"]][state["status"]])))
+            elif roll < 0.75:
+                changes.append(("priority", rng.choice(PRIORITIES)))
+            elif roll < 0.85:
+                changes.append(("duration", rng.randint(1, 8)))
+
+            comment = None
+            if not changes or rng.random() < 0.4:
+                comment = rng.choice(COMMENTS)
+
+            diffs = []
+            for field, value in changes:
+                if state[field] != value:
+                    diffs.append((field, unicode(state[field]), unicode(value)))
+                    state[field] = value
+            if diffs or comment:
+                changesets.append((rng.choice(people), when, comment, diffs))
+
+        return created_at, state, changesets
+
+    def records(self):
+        """
+        Yields (model key, record) pairs, parents first, for
+        dump.Importer.run().
+        """
+        usernames, projects, milestones = self.plan()
+
+        for id, username in enumerate(usernames):
+            yield "auth.user", {"id": id + 1, "username": username, "first_name": username.capitalize(),
+                "last_name": "", "email": "%s@example.com" % username}
+
+        for company in xrange(1, self.companies + 1):
+            yield "accounts.company", {"id": company, "name": "Company %d" % company, "description": ""}
+
+        for project, company, people, managers in projects:
+            yield "projects.project", {"id": project, "name": "Project %d" % project, "description": "",
+                "company": company, "people": people, "managers": managers}
+
+        for milestone, project, people, tasks in milestones:
+            yield "projects.milestone", {"id": milestone, "project": project, "name": "Milestone %d" % milestone,
+                "description": ""}
+
+        for milestone, project, people, tasks in milestones:
+            for task in tasks:
+                created_at, state, changesets = self.history(task, people)
+                record = {"id": task, "description": "Generated task %d." % task, "milestone": milestone,
+                    "created_at": created_at, "changed_at": changesets and changesets[-1][1] or created_at}
+                record.update(state)
+                yield "projects.task", record
+
+        changeset_id = 0
+        for milestone, project, people, tasks in milestones:
+            for task in tasks:
+                for username, created_at, comment, diffs in self.history(task, people)[2]:
+                    changeset_id += 1
+                    yield "projects.taskchangeset", {"id": changeset_id, "user": username, "task": task,
+                        "created_at": created_at, "comment": comment}
+
+        changeset_id = change_id = 0
+        for milestone, project, people, tasks in milestones:
+            for task in tasks:
+                for username, created_at, comment, diffs in self.history(task, people)[2]:
+                    changeset_id += 1
+                    for field, old_value, new_value in diffs:
+                        change_id += 1
+                        yield "projects.taskchange", {"id": change_id, "user": username, "task": task,
+                            "changeset": changeset_id, "created_at": created_at, "field": field,
+                            "old_value": old_value, "new_value": new_value}
@@ -0,0 +1,419 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import csv
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.utils import simplejson
+
+from projecter.apps.accounts.models import Company
+from projecter.apps.projects import workflow
+from projecter.apps.projects.bulk import bulk_insert
+from projecter.apps.projects.models import Project, Milestone, Task, TaskChangeSet, TaskChange, MilestoneCounter, SyncVersion
+from projecter.apps.projects.models import MilestoneSnapshot
+
+CHUNK_SIZE = 5000
+
+# Parents come before their children, in the dump and in the import.
+MODELS = (
+    ("auth.user", User),
+    ("accounts.company", Company),
+    ("projects.project", Project),
+    ("projects.milestone", Milestone),
+    ("projects.task", Task),
+    ("projects.taskchangeset", TaskChangeSet),
+    ("projects.taskchange", TaskChange),
+)
+
+# Users are matched by username, and only these fields travel with them.
+USER_FIELDS = ("username", "first_name", "last_name", "email")
+
+# Models other rows point to, whose old to new id maps are kept.
+REFERENCED = (Company, Project, Milestone, Task, TaskChangeSet)
+
+def describe(model):
+    """
+    Returns the (concrete fields, many to many fields) dumped for a model.
+    """
+    fields = [f for f in model._meta.local_fields if not isinstance(f, models.AutoField)]
+    return fields, list(model._meta.local_many_to_many)
+
+def columns(model):
+    if model is User:
+        return ["id"] + list(USER_FIELDS)
+    fields, m2m = describe(model)
+    return ["id"] + [f.name for f in fields] + [f.name for f in m2m]
+
+##### Formats
+
+class JsonLinesWriter(object):
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, key, names, values):
+        record = dict(zip(names, values))
+        record["model"] = key
+        self.stream.write(simplejson.dumps(record))
+        self.stream.write("\n")
+
+class JsonLinesReader(object):
+    def __init__(self, stream):
+        self.stream = stream
+
+    def __iter__(self):
+        for line in self.stream:
+            if line.strip():
+                record = simplejson.loads(line)
+                yield record.pop("model"), record
+
+class CsvWriter(object):
+    """
+    Writes every model as a section that starts with a "#model" header row
+    naming the columns of the rows that follow.
+    """
+    def __init__(self, stream):
+        self.writer = csv.writer(stream)
+        self.key = None
+
+    def write(self, key, names, values):
+        if key != self.key:
+            self.writer.writerow(["#%s" % key] + names)
+            self.key = key
+        self.writer.writerow([self.encode(value) for value in values])
+
+    def encode(self, value):
+        if value is None:
+            return ""
+        if isinstance(value, (list, tuple)):
+            value = u" ".join(value)
+        return unicode(value).encode("utf-8")
+
+class CsvReader(object):
+    def __init__(self, stream):
+        self.stream = stream
+
+    def __iter__(self):
+        key = names = None
+        for row in csv.reader(self.stream):
+            if row and row[0].startswith("#"):
+                key, names = row[0][1:], row[1:]
+            elif row:
+                yield key, dict(zip(names, [value.decode("utf-8") for value in row]))
+
+FORMATS = {
+    "jsonl": (JsonLinesReader, JsonLinesWriter),
+    "csv": (CsvReader, CsvWriter),
+}
+
+##### Export
+
+class Exporter(object):
+    """
+    Writes companies with their projects, milestones, tasks and history.
+
+    Rows are read in primary key order, chunk_size at a time, with each
+    chunk starting after the last id of the previous one. Memory stays
+    flat whatever the size of the tables and no chunk costs more than the
+    first one, which a plain OFFSET or a client side cursor over the whole
+    table would not give.
+    """
+    def __init__(self, writer, companies=None, chunk_size=CHUNK_SIZE):
+        self.writer = writer
+        self.chunk_size = chunk_size
+
+        self.querysets = {}
+        self.querysets[Company] = Company.objects.all()
+        if companies is not None:
+            self.querysets[Company] = self.querysets[Company].filter(id__in=companies)
+        self.querysets[Project] = Project.objects.filter(company__in=self.querysets[Company])
+        self.querysets[Milestone] = Milestone.objects.filter(project__in=self.querysets[Project])
+        self.querysets[Task] = Task.objects.filter(milestone__in=self.querysets[Milestone])
+        if companies is None:
+            self.querysets[TaskChangeSet] = TaskChangeSet.objects.all()
+            self.querysets[TaskChange] = TaskChange.objects.all()
+        else:
+            self.querysets[TaskChangeSet] = TaskChangeSet.objects.filter(task__milestone__project__company__in=companies)
+            self.querysets[TaskChange] = TaskChange.objects.filter(task__milestone__project__company__in=companies)
+
+    def run(self):
+        """
+        Writes everything and returns a dict of model key to row count.
+        """
+        self.usernames = self.export_users()
+        counts = {"auth.user": len(self.usernames)}
+        for key, model in MODELS[1:]:
+            counts[key] = self.export(key, model)
+        return counts
+
+    def export_users(self):
+        """
+        Writes the users any exported row refers to, and returns their
+        usernames by id.
+        """
+        ids = set()
+        for field in Project._meta.local_many_to_many:
+            ids.update(field.rel.through.objects.filter(project__in=self.querysets[Project]).values_list("user", flat=True))
+        ids.update(Task.users.through.objects.filter(task__in=self.querysets[Task]).values_list("user", flat=True))
+        for model in (TaskChangeSet, TaskChange):
+            ids.update(self.querysets[model].order_by().values_list("user", flat=True).distinct())
+
+        usernames = {}
+        for rows in self.chunks(User.objects.filter(id__in=ids), ("id",) + USER_FIELDS):
+            for row in rows:
+                usernames[row["id"]] = row["username"]
+                self.writer.write("auth.user", columns(User), [row[name] for name in columns(User)])
+        return usernames
+
+    def export(self, key, model):
+        fields, m2m = describe(model)
+        names = columns(model)
+
+        count = 0
+        for rows in self.chunks(self.querysets[model], ["id"] + [f.attname for f in fields]):
+            related = self.related(m2m, [row["id"] for row in rows])
+            for row in rows:
+                values = [row["id"]]
+                for f in fields:
+                    values.append(self.value(f, row[f.attname]))
+                for f in m2m:
+                    values.append(related[f.name].get(row["id"], []))
+                self.writer.write(key, names, values)
+            count += len(rows)
+        return count
+
+    def chunks(self, queryset, fields):
+        last = 0
+        while True:
+            rows = list(queryset.filter(id__gt=last).order_by("id").values(*fields)[:self.chunk_size])
+            if not rows:
+                break
+            yield rows
+            last = rows[-1]["id"]
+
+    def related(self, m2m, ids):
+        """
+        Returns the usernames linked to the given ids through every many to
+        many field, with one query per field.
+        """
+        related = {}
+        for f in m2m:
+            related[f.name] = {}
+            rows = f.rel.through.objects.filter(**{"%s__in" % f.m2m_field_name(): ids}).values_list(
+                f.m2m_field_name(), f.m2m_reverse_field_name())
+            for id, user_id in rows:
+                related[f.name].setdefault(id, []).append(self.usernames[user_id])
+        return related
+
+    def value(self, field, value):
+        if value is not None and field.rel and field.rel.to is User:
+            return self.usernames[value]
+        if isinstance(value, (int, long, basestring)) or value is None:
+            return value
+        return unicode(value)
+
+##### Import
+
+class DumpError(Exception):
+    pass
+
+class Importer(object):
+    """
+    Reads a dump written by Exporter into new rows.
+
+    Rows are inserted chunk_size at a time with multi-row INSERTs, one
+    transaction per chunk, and their new ids are read back so children
+    can be pointed at them through in-memory maps of old to new ids.
+    Model.save() is never called, so nothing listening to signals sees
+    the new rows; milestone counters and project caches are refreshed by
+    finish().
+
+    Reading new ids back relies on nobody else inserting into the same
+    tables during the import.
+
+    Project names are unique: a project named like an existing one, or
+    like an earlier one of the dump, stops the import with a DumpError
+    before its chunk is written, unless rename is set, in which case it
+    gets the first free name of the form "name (2)", "name (3)"...
+    clashes() finds them all before anything is written.
+    """
+    def __init__(self, chunk_size=CHUNK_SIZE, rename=False):
+        self.chunk_size = chunk_size
+        self.rename = rename
+        self.project_names = set(Project.objects.values_list("name", flat=True))
+        self.users = dict(User.objects.values_list("username", "id"))
+        self.ids = dict((model, {}) for model in REFERENCED)
+        self.milestone_projects = {}
+        self.counts = {}
+
+    def run(self, records):
+        """
+        Imports (key, record) pairs and returns a dict of model key to the
+        number of rows created.
+        """
+        models_by_key = dict(MODELS)
+
+        key, chunk = None, []
+        for record_key, record in records:
+            if record_key not in models_by_key:
+                raise DumpError("Unknown model %r." % record_key)
+            if chunk and (record_key != key or len(chunk) >= self.chunk_size):
+                self.load(models_by_key[key], key, chunk)
+                chunk = []
+            key = record_key
+            chunk.append(record)
+        if chunk:
+            self.load(models_by_key[key], key, chunk)
+
+        self.finish()
+        return self.counts
+
+    def clashes(self, records):
+        """
+        Returns the sorted project names of a dump that are already taken,
+        in the database or by an earlier project of the same dump.
+        """
+        names = set(self.project_names)
+        found = set()
+        for key, record in records:
+            if key == "projects.project":
+                if record["name"] in names:
+                    found.add(record["name"])
+                names.add(record["name"])
+        return sorted(found)
+
+    @transaction.commit_on_success
+    def load(self, model, key, records):
+        if model is User:
+            created = self.load_users(records)
+        else:
+            created = self.load_rows(model, records)
+        self.counts[key] = self.counts.get(key, 0) + created
+
+    def load_users(self, records):
+        users = {}
+        for record in records:
+            if record["username"] not in self.users:
+                user = User(**dict((name, record.get(name) or "") for name in USER_FIELDS))
+                user.set_unusable_password()
+                users[user.username] = user
+
+        bulk_insert(User, users.values())
+        self.users.update(User.objects.filter(username__in=users.keys()).values_list("username", "id"))
+        return len(users)
+
+    def load_rows(self, model, records):
+        fields, m2m = describe(model)
+
+        # Sync versions of the source database mean nothing here.
+        version = model in (Task, TaskChangeSet) and SyncVersion.objects.next()
+
+        objects = []
+        for record in records:
+            obj = model()
+            for f in fields:
+                setattr(obj, f.attname, self.value(f, record.get(f.name)))
+            if model is Project:
+                obj.name = self.project_name(obj.name)
+            if model is Task:
+                obj.project_id = self.milestone_projects[obj.milestone_id]
+                obj.is_open = workflow.is_open(obj.status)
+            if version:
+                obj.version = version
+            objects.append(obj)
+
+        if model not in REFERENCED and not m2m:
+            bulk_insert(model, objects)
+            return len(objects)
+
+        last = model.objects.order_by("-id").values_list("id", flat=True)[:1]
+        last = last and last[0] or 0
+        bulk_insert(model, objects)
+        new_ids = list(model.objects.filter(id__gt=last).order_by("id").values_list("id", flat=True))
+        if len(new_ids) != len(objects):
+            raise DumpError("%s got %d new rows instead of %d, is something else writing to it?" % (
+                model._meta.db_table, len(new_ids), len(objects)))
+
+        if model in REFERENCED:
+            for record, id in zip(records, new_ids):
+                self.ids[model][int(record["id"])] = id
+        if model is Milestone:
+            for obj, id in zip(objects, new_ids):
+                self.milestone_projects[id] = obj.project_id
+
+        for f in m2m:
+            through = f.rel.through
+            rows = []
+            for record, id in zip(records, new_ids):
+                usernames = record.get(f.name) or []
+                if isinstance(usernames, basestring):
+                    usernames = usernames.split()
+                for username in usernames:
+                    rows.append(through(**{
+                        "%s_id" % f.m2m_field_name(): id,
+                        "%s_id" % f.m2m_reverse_field_name(): self.user(username)
+                    }))
+            bulk_insert(through, rows)
+
+        return len(objects)
+
+    def project_name(self, name):
+        if name in self.project_names:
+            if not self.rename:
+                raise DumpError("A project named %r already exists." % name)
+            base, number = name, 2
+            while name in self.project_names:
+                suffix = " (%d)" % number
+                name = base[:Project._meta.get_field("name").max_length - len(suffix)] + suffix
+                number += 1
+        self.project_names.add(name)
+        return name
+
+    def value(self, field, value):
+        if value == "" and field.null:
+            value = None
+        if value is None:
+            return None
+
+        if field.rel:
+            if field.rel.to is User:
+                return self.user(value)
+            try:
+                return self.ids[field.rel.to][int(value)]
+            except KeyError, err:
+                raise DumpError("%s %s points to a missing %s." % (
+                    field.model._meta.object_name, field.name, field.rel.to._meta.object_name))
+
+        try:
+            return field.to_python(value)
+        except ValidationError, err:
+            raise DumpError("Invalid %s %s: %r" % (field.model._meta.object_name, field.name, value))
+
+    def user(self, username):
+        try:
+            return self.users[username]
+        except KeyError, err:
+            raise DumpError("Unknown user %r." % username)
+
+    def finish(self):
+        milestones = self.milestone_projects.keys()
+        for start in xrange(0, len(milestones), self.chunk_size):
+            MilestoneCounter.objects.rebuild(milestones[start:start + self.chunk_size])
+        MilestoneSnapshot.objects.rebuild(milestones, chunk_size=self.chunk_size)
+
+        for project_id in set(self.ids[Project].values()):
+            Project.objects.bump_version(project_id)
+            Project.objects.invalidate_stats(project_id)
+        Project.objects.invalidate_index()
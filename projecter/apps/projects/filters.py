@@ -0,0 +1,142 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+
+from django import forms
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.http import QueryDict
+from django.utils.http import urlencode
+from django.utils.translation import ugettext as _
+
+from projecter.apps.projects import workflow
+from projecter.apps.projects.models import Project
+
+FILTER_CACHE_TIMEOUT = getattr(settings, "PROJECTER_FILTER_CACHE_TIMEOUT", 60 * 60)
+FILTER_CACHE_MAX_IDS = getattr(settings, "PROJECTER_FILTER_CACHE_MAX_IDS", 5000)
+
+# The single ?filter=...&target=... links the project page used to have.
+LEGACY_FILTERS = {
+    "upcoming": lambda target: [("status", "open")],
+    "closed": lambda target: [("status", "closed")],
+    "assigned_to_me": lambda target: [("assignee", "me")],
+    "assigned_to": lambda target: [("assignee", target)],
+    "by_milestone": lambda target: [("milestone", target)],
+}
+
+def from_legacy(data):
+    """
+    Translates the old filter/target parameters into TaskFilterForm ones.
+    """
+    legacy = data.get("filter")
+    if legacy not in LEGACY_FILTERS:
+        return data
+
+    return QueryDict(urlencode(LEGACY_FILTERS[legacy](data.get("target", ""))))
+
+class TaskFilterForm(forms.Form):
+    """
+    Parses the task listing parameters. Every field is optional and can be
+    given several times; apply() ANDs the fields together and ORs the
+    values of a field, adding to the queryset without evaluating it.
+    """
+    status = forms.MultipleChoiceField(required=False,
+        choices=(("open", _("Open")),) + workflow.TASK_STATUS)
+    priority = forms.MultipleChoiceField(required=False, choices=workflow.TASK_PRIORITY)
+    type = forms.MultipleChoiceField(required=False, choices=workflow.TASK_TYPE)
+    assignee = forms.MultipleChoiceField(required=False)
+    milestone = forms.MultipleChoiceField(required=False)
+    created_after = forms.DateField(required=False)
+    created_before = forms.DateField(required=False)
+
+    def __init__(self, data, user, people=(), milestones=(), *args, **kwargs):
+        super(TaskFilterForm, self).__init__(data, *args, **kwargs)
+        self.user = user
+
+        self.fields["assignee"].choices = [("me", _("Me"))] + [
+            (str(person.id), unicode(person)) for person in people]
+        self.fields["milestone"].choices = [
+            (str(milestone.id), unicode(milestone)) for milestone in milestones]
+
+    def values(self):
+        """
+        Returns the cleaned value of every field that validates, silently
+        leaving out the ones that don't.
+        """
+        values = {}
+        for name, field in self.fields.items():
+            value = field.widget.value_from_datadict(self.data, self.files, self.add_prefix(name))
+            try:
+                value = field.clean(value)
+            except forms.ValidationError, err:
+                continue
+            if value:
+                values[name] = value
+        return values
+
+    def apply(self, tasks):
+        values = self.values()
+
+        if "status" in values:
+            statuses = values["status"]
+            condition = Q(status__in=[status for status in statuses if status != "open"])
+            if "open" in statuses:
+                condition |= Q(is_open=True)
+            tasks = tasks.filter(condition)
+
+        if "priority" in values:
+            tasks = tasks.filter(priority__in=values["priority"])
+
+        if "type" in values:
+            tasks = tasks.filter(type__in=values["type"])
+
+        if "assignee" in values:
+            ids = [self.user.id if value == "me" else int(value) for value in values["assignee"]]
+            tasks = tasks.filter(users__in=ids).distinct()
+
+        if "milestone" in values:
+            tasks = tasks.filter(milestone__in=[int(value) for value in values["milestone"]])
+
+        if "created_after" in values:
+            tasks = tasks.filter(created_at__gte=values["created_after"])
+
+        if "created_before" in values:
+            tasks = tasks.filter(created_at__lt=values["created_before"] + datetime.timedelta(days=1))
+
+        return tasks
+
+    def query_string(self):
+        pairs = []
+        for name, value in sorted(self.values().items()):
+            if not isinstance(value, (list, tuple)):
+                value = [value]
+            pairs.extend((name, unicode(item)) for item in value)
+        return urlencode(pairs)
+
+def cached_task_ids(saved_filter, tasks):
+    """
+    Returns the ids matched by a saved filter, cached until a task of its
+    project changes. Results bigger than FILTER_CACHE_MAX_IDS are not
+    cached and None is returned, the caller then uses the query itself.
+    """
+    key = "projects:filter:%s:%s" % (saved_filter.id, Project.objects.version(saved_filter.project_id))
+    ids = cache.get(key)
+    if ids is None:
+        ids = list(tasks.order_by().values_list("id", flat=True)[:FILTER_CACHE_MAX_IDS + 1])
+        if len(ids) > FILTER_CACHE_MAX_IDS:
+            return None
+        cache.set(key, ids, FILTER_CACHE_TIMEOUT)
+    return ids
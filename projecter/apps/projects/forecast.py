@@ -0,0 +1,272 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Monte Carlo completion dates for milestones.
+
+The open work of a milestone is split between workers: each assignee
+carries the duration of the open tasks assigned to them, and the tasks
+nobody is assigned to go to a pool per project. A worker's daily
+throughput is drawn from their history, the hours of the tasks they
+closed on each of the last FORECAST_HISTORY_DAYS days (idle days
+included); a project pool draws from every task closed in the project.
+Assignees split their time between milestones in proportion to the work
+they have left in each, so they finish their share of all of them on the
+same day, and a milestone is done when the last of its workers is.
+
+Every worker and run is simulated at once with numpy, a few weeks per
+step, which takes a fraction of a second for a company of a couple
+hundred people. numpy is required: without it run() raises
+ImproperlyConfigured rather than quietly taking seconds. The same model
+in plain Python, simulate_python(), is kept as the reference the numpy
+version is tested against. The simulation never runs in a request:
+manage.py forecast_milestones, from cron, stores the results as
+MilestoneForecast rows and the milestone page reads those.
+"""
+
+import datetime
+import math
+import random
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import Sum
+
+from projecter.apps.projects import workflow
+from projecter.apps.projects.bulk import bulk_delete, bulk_insert
+from projecter.apps.projects.models import Milestone, MilestoneForecast, Task, TaskChange
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+FORECAST_RUNS = getattr(settings, "PROJECTER_FORECAST_RUNS", 500)
+FORECAST_HISTORY_DAYS = getattr(settings, "PROJECTER_FORECAST_HISTORY_DAYS", 56)
+FORECAST_HORIZON_DAYS = getattr(settings, "PROJECTER_FORECAST_HORIZON_DAYS", 365)
+
+# Percentiles of the simulated completion days that are reported, one
+# column each in MilestoneForecast.
+PERCENTILES = (50, 85, 95)
+
+# Days simulated per step by the numpy version.
+STEP_DAYS = 28
+
+class Forecast(object):
+    """
+    Completion estimate of one milestone: the open hours left and, for
+    every percentile, the date the milestone is done by in that share of
+    the runs. A date is None when those runs did not finish within the
+    horizon, or a worker had no throughput to draw from.
+    """
+    def __init__(self, milestone_id, remaining, workers, dates):
+        self.milestone_id = milestone_id
+        self.remaining = remaining
+        self.workers = workers
+        self.dates = dates
+
+    def by_percentile(self):
+        return [(percent, self.dates[percent]) for percent in PERCENTILES]
+
+class Forecaster(object):
+    def __init__(self, runs=FORECAST_RUNS, history_days=FORECAST_HISTORY_DAYS,
+            horizon_days=FORECAST_HORIZON_DAYS, seed=0, today=None, pure_python=False):
+        self.runs = runs
+        self.pure_python = pure_python
+        self.history_days = history_days
+        self.horizon_days = horizon_days
+        self.seed = seed
+        self.today = today or datetime.date.today()
+
+    def run(self, milestones):
+        """
+        Returns a dict of milestone id to Forecast for a queryset of
+        milestones, with five queries whatever their number.
+        """
+        milestones = dict(milestones.values_list("id", "project"))
+        if not milestones:
+            return {}
+
+        work = self.load_work(milestones.keys())
+        history = self.load_history(set(milestones.values()))
+
+        # What every worker has left over all the milestones.
+        totals = {}
+        for hours in work.values():
+            for worker, count in hours.items():
+                totals[worker] = totals.get(worker, 0) + count
+        workers = totals.keys()
+
+        if self.pure_python:
+            finish = self.simulate_python(workers, totals, history)
+        elif numpy is None:
+            raise ImproperlyConfigured("Milestone forecasts need numpy installed.")
+        else:
+            finish = self.simulate_numpy(workers, totals, history)
+
+        index = dict((worker, position) for position, worker in enumerate(workers))
+        forecasts = {}
+        for milestone_id in milestones:
+            hours = work.get(milestone_id, {})
+            if not self.pure_python:
+                if hours:
+                    days = finish[[index[worker] for worker in hours]].max(axis=0)
+                    days.sort()
+                else:
+                    days = numpy.zeros(self.runs)
+            else:
+                days = [0] * self.runs
+                for worker in hours:
+                    days = map(max, days, finish[index[worker]])
+                days.sort()
+
+            dates = {}
+            for percent in PERCENTILES:
+                day = days[max(0, int(math.ceil(self.runs * percent / 100.0)) - 1)]
+                if day > self.horizon_days:
+                    dates[percent] = None
+                else:
+                    dates[percent] = self.today + datetime.timedelta(days=int(day))
+            forecasts[milestone_id] = Forecast(milestone_id, sum(hours.values()), len(hours), dates)
+
+        return forecasts
+
+    def load_work(self, milestone_ids):
+        """
+        Returns {milestone id: {worker: open hours}}, where a worker is
+        ("user", user id) or ("project", project id) for the unassigned
+        tasks, summed by the database.
+        """
+        work = {}
+        rows = Task.users.through.objects.filter(task__milestone__in=milestone_ids, task__is_open=True).values(
+            "task__milestone", "user").annotate(hours=Sum("task__duration")).order_by()
+        for row in rows:
+            if row["hours"] > 0:
+                work.setdefault(row["task__milestone"], {})[("user", row["user"])] = int(row["hours"])
+
+        rows = Task.objects.filter(milestone__in=milestone_ids, is_open=True, users__isnull=True).values(
+            "milestone", "project").annotate(hours=Sum("duration")).order_by()
+        for row in rows:
+            if row["hours"] > 0:
+                work.setdefault(row["milestone"], {})[("project", row["project"])] = int(row["hours"])
+
+        return work
+
+    def load_history(self, project_ids):
+        """
+        Returns {worker: [hours closed on each of the last history_days
+        days]} from the status changes into a closed status. A task
+        closed with several assignees counts for each of them, the same
+        way its open hours do, and for the pool of its project.
+        """
+        since = self.today - datetime.timedelta(days=self.history_days - 1)
+        rows = list(TaskChange.objects.filter(field="status", new_value__in=workflow.CLOSED_STATUSES,
+            created_at__gte=since, task__project__in=project_ids).values_list(
+            "task", "task__project", "task__duration", "created_at"))
+
+        assigned = {}
+        through = Task.users.through
+        for task_id, user_id in through.objects.filter(task__in=set(row[0] for row in rows)).values_list("task", "user"):
+            assigned.setdefault(task_id, []).append(("user", user_id))
+
+        history = {}
+        for task_id, project_id, duration, created_at in rows:
+            day = (created_at.date() - since).days
+            if not 0 <= day < self.history_days:
+                continue
+            for worker in assigned.get(task_id, []) + [("project", project_id)]:
+                if worker not in history:
+                    history[worker] = [0] * self.history_days
+                history[worker][day] += duration
+        return history
+
+    def simulate_numpy(self, workers, totals, history):
+        """
+        Returns a (workers, runs) array of the day each worker finishes in
+        each run, horizon_days + 1 for never. Every step draws STEP_DAYS of
+        throughput for all the (worker, run) pairs still going at once,
+        and drops the ones that finished.
+        """
+        rng = numpy.random.RandomState(self.seed)
+        never = self.horizon_days + 1
+        finish = numpy.empty((len(workers), self.runs))
+        finish.fill(never)
+
+        hours = numpy.array([totals[worker] for worker in workers], dtype=float)
+        days = numpy.array([history.get(worker, [0] * self.history_days) for worker in workers], dtype=float)
+        days = days.reshape((len(workers), self.history_days))
+        samples = days.ravel()
+        # Workers who never closed anything can't finish.
+        able = numpy.flatnonzero(days.sum(axis=1) > 0)
+
+        worker = numpy.repeat(able, self.runs)
+        run = numpy.tile(numpy.arange(self.runs), len(able))
+        target = hours[worker]
+        done = numpy.zeros(len(worker))
+
+        day = 0
+        while day < self.horizon_days and len(worker):
+            picks = rng.randint(0, self.history_days, size=(len(worker), STEP_DAYS))
+            burned = done[:, None] + samples[worker[:, None] * self.history_days + picks].cumsum(axis=1)
+            reached = burned >= target[:, None]
+            # Throughput is never negative, so a pair got there if it has
+            # on the last day of the step.
+            hit = reached[:, -1]
+            finish[worker[hit], run[hit]] = day + reached[hit].argmax(axis=1) + 1
+
+            going = ~hit
+            worker, run, target, done = worker[going], run[going], target[going], burned[going, -1]
+            day += STEP_DAYS
+
+        finish[finish > self.horizon_days] = never
+        return finish
+
+    def simulate_python(self, workers, totals, history):
+        """
+        Same as simulate_numpy() with lists, one worker and run at a time.
+        """
+        rng = random.Random(self.seed)
+        never = self.horizon_days + 1
+        finish = []
+        for worker in workers:
+            days = history.get(worker)
+            if not days or not sum(days):
+                finish.append([never] * self.runs)
+                continue
+
+            target = totals[worker]
+            result = []
+            for run in xrange(self.runs):
+                done = 0
+                day = 0
+                while done < target and day < self.horizon_days:
+                    done += rng.choice(days)
+                    day += 1
+                result.append(done >= target and day or never)
+            finish.append(result)
+        return finish
+
+@transaction.commit_on_success
+def store(forecasts):
+    """
+    Replaces the MilestoneForecast rows of the given milestones with a
+    dict of milestone id to Forecast.
+    """
+    now = datetime.datetime.now()
+    bulk_delete(MilestoneForecast.objects.filter(milestone__in=forecasts.keys()))
+    bulk_insert(MilestoneForecast, [MilestoneForecast(milestone_id=milestone_id, computed_at=now,
+        remaining=result.remaining, workers=result.workers,
+        **dict(("p%d" % percent, date) for percent, date in result.by_percentile()))
+        for milestone_id, result in forecasts.items()])
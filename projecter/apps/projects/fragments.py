@@ -0,0 +1,84 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Cache for rendered page fragments.
+
+Keys carry the version of the project or task they were rendered from
+(see Project.objects.version() and Task.objects.version()), so nothing is
+ever deleted: a write bumps the version and the old fragments are simply
+not asked for again. Only plain cache get/set/incr are used, so it works
+with the locmem and file backends as well as memcached.
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.safestring import mark_safe
+
+FRAGMENT_CACHE_TIMEOUT = getattr(settings, "PROJECTER_FRAGMENT_CACHE_TIMEOUT", 60 * 60)
+STATS_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+
+# Names of the fragments in use, for stats().
+FRAGMENTS = ("task_rows", "task_filters", "task_history")
+
+def _key(name, parts):
+    digest = hashlib.md5(u":".join([unicode(part) for part in parts]).encode("utf-8")).hexdigest()
+    return "fragments:%s:%s" % (name, digest)
+
+def _count(name, outcome):
+    key = "fragments:stats:%s:%s" % (name, outcome)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, STATS_CACHE_TIMEOUT)
+        try:
+            cache.incr(key)
+        except ValueError:
+            pass
+
+def get_or_render(name, parts, render):
+    """
+    Returns the fragment cached under name and the key parts, or calls
+    render() to build it. Anything render() needs from the database should
+    be fetched inside it, so a hit skips the queries too.
+    """
+    key = _key(name, parts)
+    html = cache.get(key)
+    if html is None:
+        _count(name, "misses")
+        html = render()
+        cache.set(key, html, FRAGMENT_CACHE_TIMEOUT)
+    else:
+        _count(name, "hits")
+    return mark_safe(html)
+
+def stats():
+    """
+    Returns {name: (hits, misses)} for every fragment.
+    """
+    keys = []
+    for name in FRAGMENTS:
+        keys.extend(["fragments:stats:%s:hits" % name, "fragments:stats:%s:misses" % name])
+    values = cache.get_many(keys)
+
+    return dict((name, (
+        values.get("fragments:stats:%s:hits" % name, 0),
+        values.get("fragments:stats:%s:misses" % name, 0)
+    )) for name in FRAGMENTS)
+
+def reset_stats():
+    for name in FRAGMENTS:
+        cache.delete_many(["fragments:stats:%s:hits" % name, "fragments:stats:%s:misses" % name])
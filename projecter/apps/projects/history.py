@@ -0,0 +1,106 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import csv
+import StringIO
+
+from django.contrib.auth.models import User
+from django.utils import simplejson
+
+from projecter.apps.projects.models import Task, TaskChange, TaskChangeSet
+
+CHUNK_SIZE = 1000
+
+# Bytes gathered before handing a piece of the response to the server.
+FLUSH_SIZE = 16 * 1024
+
+COLUMNS = ("changeset", "id", "created_at", "task", "task_name", "user", "field", "old_value", "new_value", "comment")
+
+def history_rows(project_id, after=0, chunk_size=CHUNK_SIZE):
+    """
+    Yields the history of a project as dicts with COLUMNS, one per
+    TaskChange, oldest first, starting after the changeset with id after.
+    A changeset without changes, a comment left on its own, still gives
+    one row, with no change id, field or values. Milestones are given by
+    name.
+
+    Changesets are read chunk_size at a time, each chunk starting after
+    the last id of the previous one, and their changes, task names and
+    usernames are fetched with one query each, so memory does not grow
+    with the history. Changes that belong to no changeset, written before
+    build_changesets was run, are not exported.
+    """
+    changesets = TaskChangeSet.objects.filter(task__project=project_id).order_by("id").values(
+        "id", "created_at", "task", "user", "comment")
+
+    while True:
+        chunk = list(changesets.filter(id__gt=after)[:chunk_size])
+        if not chunk:
+            break
+
+        ids = [row["id"] for row in chunk]
+        changes = {}
+        for change in TaskChange.objects.filter(changeset__in=ids).order_by("id").values(
+                "id", "changeset", "field", "old_value", "new_value"):
+            changes.setdefault(change.pop("changeset"), []).append(change)
+        moves = [change for batch in changes.values() for change in batch if change["field"] == "milestone"]
+        names = TaskChange.objects.milestone_names(
+            [change["old_value"] for change in moves] + [change["new_value"] for change in moves])
+        for change in moves:
+            change["old_value"] = names.get(change["old_value"], change["old_value"])
+            change["new_value"] = names.get(change["new_value"], change["new_value"])
+        tasks = dict(Task.objects.filter(id__in=set(row["task"] for row in chunk)).values_list("id", "name"))
+        users = dict(User.objects.filter(id__in=set(row["user"] for row in chunk)).values_list("id", "username"))
+
+        for changeset in chunk:
+            base = {
+                "changeset": changeset["id"],
+                "created_at": changeset["created_at"].strftime("%Y-%m-%dT%H:%M:%S"),
+                "task": changeset["task"],
+                "task_name": tasks.get(changeset["task"]),
+                "user": users.get(changeset["user"]),
+                "comment": changeset["comment"],
+            }
+            for change in changes.get(changeset["id"]) or [{"id": None, "field": None, "old_value": None, "new_value": None}]:
+                row = dict(base)
+                row.update(change)
+                yield row
+
+        after = chunk[-1]["id"]
+
+def csv_lines(rows, header=True):
+    buffer = StringIO.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(COLUMNS)
+    for row in rows:
+        writer.writerow([row[name] is not None and unicode(row[name]).encode("utf-8") or "" for name in COLUMNS])
+        if buffer.tell() >= FLUSH_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def ndjson_lines(rows):
+    lines, size = [], 0
+    for row in rows:
+        line = simplejson.dumps(row) + "\n"
+        lines.append(line)
+        size += len(line)
+        if size >= FLUSH_SIZE:
+            yield "".join(lines)
+            lines, size = [], 0
+    if lines:
+        yield "".join(lines)
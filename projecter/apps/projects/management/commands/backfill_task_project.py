@@ -0,0 +1,60 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import connection, transaction
+
+from projecter.apps.projects.models import Task
+
+class Command(NoArgsCommand):
+    help = ("Fills task.project_id from the task's milestone. On an existing "
+            "database, add the column and indexes first:\n\n"
+            "  ALTER TABLE task ADD COLUMN project_id integer NULL REFERENCES project (id);\n"
+            "  CREATE INDEX task_project_id ON task (project_id);\n"
+            "and the statements in projects/sql/task.sql.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option("--chunk-size", dest="chunk_size", type="int", default=10000,
+            help="Number of task ids updated per transaction."),
+    )
+
+    def handle_noargs(self, **options):
+        chunk_size = options["chunk_size"]
+        verbosity = int(options.get("verbosity", 1))
+
+        ids = Task.objects.order_by("-id").values_list("id", flat=True)[:1]
+        last_id = ids and ids[0] or 0
+
+        total = 0
+        for start in xrange(0, last_id + 1, chunk_size):
+            total += self.backfill(start, start + chunk_size)
+            if verbosity > 1:
+                print "Up to task %d" % (start + chunk_size)
+
+        if verbosity > 0:
+            print "Updated %d tasks." % total
+
+    @transaction.commit_on_success
+    def backfill(self, start, end):
+        cursor = connection.cursor()
+        cursor.execute("""
+            UPDATE task SET project_id = (
+                SELECT milestone.project_id FROM milestone WHERE milestone.id = task.milestone_id
+            ) WHERE task.id >= %s AND task.id < %s AND task.project_id IS NULL
+        """, [start, end])
+        transaction.set_dirty()
+
+        return cursor.rowcount
@@ -0,0 +1,91 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import platform
+from optparse import make_option
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import simplejson
+
+from projecter.apps.projects.benchmark import Benchmark
+from projecter.apps.projects.dataset import Dataset, SIZES
+from projecter.apps.projects.dump import Importer
+
+class Command(NoArgsCommand):
+    help = ("Measures the projects views at several data sizes and writes a JSON "
+            "report. Runs in a throwaway test database (in memory for SQLite) and "
+            "clears the configured cache, so never point it at a shared one.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option("--sizes", dest="sizes", default="tiny,small,medium",
+            help="Comma separated presets among: %s." % ", ".join(sorted(SIZES))),
+        make_option("--repeat", dest="repeat", type="int", default=20,
+            help="Warm requests per view."),
+        make_option("--seed", dest="seed", type="int", default=0),
+        make_option("--output", dest="output", default=None,
+            help="File for the JSON report, stdout by default."),
+        make_option("--strict", dest="strict", action="store_true", default=False,
+            help="Fail on the first view going over its INSTRUMENTATION_BUDGETS entry."),
+    )
+
+    def handle_noargs(self, **options):
+        sizes = options["sizes"].split(",")
+        for size in sizes:
+            if size not in SIZES:
+                raise CommandError("Unknown size %r." % size)
+        verbosity = int(options.get("verbosity", 1))
+
+        report = {
+            "python": platform.python_version(),
+            "database": settings.DATABASES["default"]["ENGINE"],
+            "cache": settings.CACHE_BACKEND,
+            "repeat": options["repeat"],
+            "seed": options["seed"],
+            "sizes": {},
+        }
+
+        if options["strict"]:
+            settings.INSTRUMENTATION_STRICT = True
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            for size in sizes:
+                call_command("flush", interactive=False, verbosity=0)
+                cache.clear()
+
+                dataset = Dataset.of_size(size, seed=options["seed"])
+                counts = Importer().run(dataset.records())
+                if verbosity > 1:
+                    sys.stderr.write("%s: %r\n" % (size, counts))
+
+                report["sizes"][size] = {
+                    "rows": counts,
+                    "views": Benchmark(options["repeat"], options["seed"]).run(),
+                }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        output = simplejson.dumps(report, indent=2, sort_keys=True)
+        if options["output"]:
+            open(options["output"], "w").write(output)
+        else:
+            print output
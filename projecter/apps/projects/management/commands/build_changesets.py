@@ -0,0 +1,87 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from projecter.apps.projects.models import TaskChange, TaskChangeSet
+
+class Command(NoArgsCommand):
+    help = ("Groups TaskChange rows recorded before changesets existed into "
+            "TaskChangeSet rows. Legacy 'comment' rows are folded into the "
+            "changeset comment. Run 'manage.py sqlall projects' first to "
+            "create the task_changeset table and task_change.changeset_id column.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option("--chunk-size", dest="chunk_size", type="int", default=1000,
+            help="Number of TaskChange rows handled per transaction."),
+    )
+
+    def handle_noargs(self, **options):
+        chunk_size = options["chunk_size"]
+        verbosity = int(options.get("verbosity", 1))
+
+        total = 0
+        while True:
+            done = self.build_chunk(chunk_size)
+            if not done:
+                break
+            total += done
+            if verbosity > 1:
+                print "%d changes grouped" % total
+
+        if verbosity > 0:
+            print "Grouped %d legacy changes." % total
+
+    @transaction.commit_on_success
+    def build_chunk(self, chunk_size):
+        changes = list(TaskChange.objects.filter(changeset__isnull=True)
+            .order_by("task", "created_at", "user", "id")[:chunk_size])
+        if not changes:
+            return 0
+
+        # Don't split the last edit of the chunk, it goes in the next one,
+        # unless it fills the chunk, then all of it is read now.
+        last = changes[-1]
+        if len(changes) == chunk_size:
+            tail = [c for c in changes if (c.task_id, c.created_at, c.user_id) == (last.task_id, last.created_at, last.user_id)]
+            if len(tail) < len(changes):
+                changes = changes[:-len(tail)]
+            else:
+                changes = list(TaskChange.objects.filter(changeset__isnull=True, task=last.task_id,
+                    created_at=last.created_at, user=last.user_id).order_by("id"))
+
+        groups = {}
+        for change in changes:
+            groups.setdefault((change.task_id, change.created_at, change.user_id), []).append(change)
+
+        comments = []
+        for (task_id, created_at, user_id), group in groups.iteritems():
+            changeset = TaskChangeSet(task_id=task_id, user_id=user_id, created_at=created_at)
+            for change in group:
+                if change.field == "comment":
+                    changeset.comment = change.new_value
+                    comments.append(change.id)
+            changeset.save()
+
+            ids = [change.id for change in group if change.field != "comment"]
+            if ids:
+                TaskChange.objects.filter(id__in=ids).update(changeset=changeset)
+
+        if comments:
+            TaskChange.objects.filter(id__in=comments).delete()
+
+        return len(changes)
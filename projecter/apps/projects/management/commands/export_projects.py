@@ -0,0 +1,51 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from projecter.apps.projects.dump import Exporter, FORMATS, CHUNK_SIZE
+
+class Command(BaseCommand):
+    help = ("Streams companies with their projects, milestones, tasks and task history "
+            "to a JSON-lines or CSV file, or to stdout.")
+    args = "[file]"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--format", dest="format", default=None,
+            help="jsonl or csv, guessed from the file name when not given."),
+        make_option("--company", dest="companies", type="int", action="append", default=None,
+            help="Only export this company, can be given several times."),
+        make_option("--chunk-size", dest="chunk_size", type="int", default=CHUNK_SIZE,
+            help="Number of rows read per query."),
+    )
+
+    def handle(self, path="-", **options):
+        format = options["format"] or (path.endswith(".csv") and "csv" or "jsonl")
+        if format not in FORMATS:
+            raise CommandError("Unknown format %r." % format)
+
+        stream = path == "-" and sys.stdout or open(path, "wb")
+        try:
+            exporter = Exporter(FORMATS[format][1](stream), options["companies"], options["chunk_size"])
+            counts = exporter.run()
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+
+        if int(options.get("verbosity", 1)) > 0:
+            for key, count in sorted(counts.items()):
+                sys.stderr.write("%s: %d\n" % (key, count))
@@ -0,0 +1,57 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from projecter.apps.accounts.models import Company
+from projecter.apps.projects import forecast
+from projecter.apps.projects.models import Milestone
+
+class Command(BaseCommand):
+    help = ("Computes the completion forecast of every milestone of the given companies, "
+            "or of all of them, and stores it for the milestone pages. Run it from cron, "
+            "daily or more often.")
+    args = "[company_id ...]"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--runs", dest="runs", type="int", default=forecast.FORECAST_RUNS,
+            help="Number of Monte Carlo runs."),
+        make_option("--pure-python", dest="pure_python", action="store_true", default=False,
+            help="Use the slow plain Python simulation, to compare against numpy."),
+    )
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get("verbosity", 1))
+        if forecast.numpy is None and not options["pure_python"]:
+            raise CommandError("Milestone forecasts need numpy installed.")
+
+        companies = [int(arg) for arg in args] or Company.objects.order_by("id").values_list("id", flat=True)
+        for company_id in companies:
+            milestones = Milestone.objects.filter(project__company=company_id)
+
+            started = time.time()
+            forecasts = forecast.Forecaster(runs=options["runs"], pure_python=options["pure_python"]).run(milestones)
+            elapsed = time.time() - started
+            forecast.store(forecasts)
+
+            if verbosity > 1:
+                for milestone_id, result in sorted(forecasts.items()):
+                    print "%d: %d hours, %s" % (milestone_id, result.remaining,
+                        ", ".join(["p%d %s" % (percent, date or "-") for percent, date in result.by_percentile()]))
+            if verbosity > 0:
+                print "Company %s: %d milestones in %.3fs (%s)." % (company_id, len(forecasts), elapsed,
+                    options["pure_python"] and "pure Python" or "numpy")
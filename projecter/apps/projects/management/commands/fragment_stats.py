@@ -0,0 +1,36 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from projecter.apps.projects import fragments
+
+class Command(NoArgsCommand):
+    help = "Prints the hit/miss counters of the page fragment cache."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option("--reset", action="store_true", dest="reset", default=False,
+            help="Set the counters back to zero after printing them."),
+    )
+
+    def handle_noargs(self, **options):
+        for name, (hits, misses) in sorted(fragments.stats().items()):
+            total = hits + misses
+            ratio = total and 100.0 * hits / total or 0.0
+            print "%-15s hits: %8d  misses: %8d  hit rate: %5.1f%%" % (name, hits, misses, ratio)
+
+        if options["reset"]:
+            fragments.reset_stats()
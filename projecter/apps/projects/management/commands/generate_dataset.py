@@ -0,0 +1,53 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from projecter.apps.projects.dataset import Dataset, SIZES
+from projecter.apps.projects.dump import Importer, CHUNK_SIZE
+
+class Command(NoArgsCommand):
+    help = ("Fills an empty database with synthetic companies, projects, milestones, "
+            "tasks, users and task histories. The same options and seed give the same data.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option("--size", dest="size", default="small",
+            help="Preset: %s." % ", ".join(sorted(SIZES))),
+        make_option("--companies", dest="companies", type="int"),
+        make_option("--projects", dest="projects", type="int", help="Projects per company."),
+        make_option("--milestones", dest="milestones", type="int", help="Milestones per project."),
+        make_option("--tasks", dest="tasks", type="int", help="Tasks per milestone."),
+        make_option("--users", dest="users", type="int"),
+        make_option("--changesets", dest="changesets", type="int", help="Average changesets per task."),
+        make_option("--seed", dest="seed", type="int", default=0),
+        make_option("--chunk-size", dest="chunk_size", type="int", default=CHUNK_SIZE,
+            help="Number of rows inserted per transaction."),
+    )
+
+    def handle_noargs(self, **options):
+        if options["size"] not in SIZES:
+            raise CommandError("Unknown size %r." % options["size"])
+
+        dataset = Dataset.of_size(options["size"], seed=options["seed"])
+        for name in ("companies", "projects", "milestones", "tasks", "users", "changesets"):
+            if options.get(name) is not None:
+                setattr(dataset, name, options[name])
+
+        counts = Importer(options["chunk_size"]).run(dataset.records())
+
+        if int(options.get("verbosity", 1)) > 0:
+            for key, count in sorted(counts.items()):
+                print "%s: %d" % (key, count)
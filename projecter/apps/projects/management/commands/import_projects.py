@@ -0,0 +1,72 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from projecter.apps.projects.dump import Importer, DumpError, FORMATS, CHUNK_SIZE
+
+class Command(BaseCommand):
+    help = ("Loads a file written by export_projects as new rows, with multi-row "
+            "inserts and one transaction per chunk. Rows are not saved through the "
+            "models, so rebuild derived data such as the search index afterwards. "
+            "Stop other writes while it runs.")
+    args = "<file>"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--format", dest="format", default=None,
+            help="jsonl or csv, guessed from the file name when not given."),
+        make_option("--chunk-size", dest="chunk_size", type="int", default=CHUNK_SIZE,
+            help="Number of rows inserted per transaction."),
+        make_option("--rename", dest="rename", action="store_true", default=False,
+            help="Give projects whose name is taken a numbered name instead of stopping."),
+    )
+
+    def handle(self, path=None, **options):
+        if path is None:
+            raise CommandError("Give the file to import, or - for stdin.")
+
+        format = options["format"] or (path.endswith(".csv") and "csv" or "jsonl")
+        if format not in FORMATS:
+            raise CommandError("Unknown format %r." % format)
+
+        reader = FORMATS[format][0]
+        importer = Importer(options["chunk_size"], options["rename"])
+
+        # A file is read twice so name clashes are reported before anything
+        # is written; stdin can only be checked project chunk by chunk.
+        if path != "-" and not options["rename"]:
+            stream = open(path, "rb")
+            try:
+                clashes = importer.clashes(reader(stream))
+            finally:
+                stream.close()
+            if clashes:
+                raise CommandError("These project names are already taken, use --rename to number "
+                    "them: %s" % ", ".join(clashes))
+
+        stream = path == "-" and sys.stdin or open(path, "rb")
+        try:
+            counts = importer.run(reader(stream))
+        except DumpError, err:
+            raise CommandError(str(err))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        if int(options.get("verbosity", 1)) > 0:
+            for key, count in sorted(counts.items()):
+                print "%s: %d" % (key, count)
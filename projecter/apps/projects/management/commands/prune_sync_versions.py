@@ -0,0 +1,33 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from projecter.apps.projects.models import SyncVersion
+
+class Command(NoArgsCommand):
+    help = ("Deletes the sync_version rows older than the settled version. Every "
+            "task save adds one, so run it from cron.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option("--chunk-size", dest="chunk_size", type="int", default=10000,
+            help="Number of ids deleted per transaction."),
+    )
+
+    def handle_noargs(self, **options):
+        deleted = SyncVersion.objects.prune(options["chunk_size"])
+        if int(options.get("verbosity", 1)) > 0:
+            print "Deleted %d sync versions." % deleted
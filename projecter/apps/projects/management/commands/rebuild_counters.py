@@ -0,0 +1,34 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.core.management.base import BaseCommand
+
+from projecter.apps.projects.models import Milestone, MilestoneCounter
+
+class Command(BaseCommand):
+    help = "Recomputes the per-milestone task counters from the task table."
+    args = "[milestone_id ...]"
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get("verbosity", 1))
+
+        if args:
+            milestones = Milestone.objects.filter(id__in=[int(arg) for arg in args])
+            MilestoneCounter.objects.rebuild(milestones)
+        else:
+            milestones = Milestone.objects.all()
+            MilestoneCounter.objects.rebuild()
+
+        if verbosity > 0:
+            print "Rebuilt counters for %d milestones." % milestones.count()
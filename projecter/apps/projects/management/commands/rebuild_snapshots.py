@@ -0,0 +1,39 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from projecter.apps.projects.models import MilestoneSnapshot
+
+class Command(BaseCommand):
+    help = "Recomputes the daily milestone snapshots from the task change history."
+    args = "[milestone_id ...]"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--chunk-size", dest="chunk_size", type="int", default=5000,
+            help="Number of tasks or changes read per query."),
+    )
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get("verbosity", 1))
+
+        milestones = None
+        if args:
+            milestones = [int(arg) for arg in args]
+        count = MilestoneSnapshot.objects.rebuild(milestones, chunk_size=options["chunk_size"])
+
+        if verbosity > 0:
+            print "Wrote %d snapshots." % count
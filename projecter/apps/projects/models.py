@@ -12,21 +12,339 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import datetime
 import logging
 import time
 
-from django.db import models
-from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.contrib.auth.models import User, Group
 from django.utils.translation import ugettext as _
 from django.forms.models import model_to_dict
 
 from projecter.apps.accounts.models import Company
-from projecter.apps.projects import workflow
+from projecter.apps.projects import signals, workflow
+from projecter.apps.projects.bulk import bulk_delete, bulk_insert
+
+INDEX_CACHE_TIMEOUT = getattr(settings, "PROJECTER_INDEX_CACHE_TIMEOUT", 60 * 60)
+PROJECT_STATS_KEY = "projects:stats:%s"
+PROJECT_VERSION_KEY = "projects:version:%s"
+TASK_VERSION_KEY = "projects:task_version:%s"
+AUTH_VERSION_KEY = "projects:auth_version:%s"
+USER_CACHE_KEY = "projects:user:%s"
+VERSION_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+
+# Sync versions younger than this are not handed out by the sync feed,
+# giving the transaction that allocated them time to commit.
+SYNC_SETTLE_SECONDS = getattr(settings, "PROJECTER_SYNC_SETTLE_SECONDS", 5)
+
+# TaskChange fields that move a task between milestone counters.
+COUNTED_FIELDS = ("status", "duration", "milestone")
+
+def cache_version(key):
+    version = cache.get(key)
+    if version is None:
+        # Starting from the clock keeps a version evicted from the cache
+        # from coming back with a value used before.
+        cache.add(key, int(time.time() * 1000), VERSION_CACHE_TIMEOUT)
+        version = cache.get(key)
+    return version
+
+def bump_cache_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache_version(key)
+
+def auth_version(user_id):
+    """
+    Version of a user's cached permissions and project memberships. It
+    moves when the user's own groups, permissions or memberships change,
+    and for everyone at once on changes that reach many users.
+    """
+    return "%s.%s" % (cache_version(AUTH_VERSION_KEY % "all"), cache_version(AUTH_VERSION_KEY % user_id))
+
+def bump_auth_version(user_id=None):
+    bump_cache_version(AUTH_VERSION_KEY % (user_id is None and "all" or user_id))
 
 ##### Managers
 
+class SyncVersionManager(models.Manager):
+    def next(self):
+        """
+        Allocates a new sync version, greater than every one before it.
+        """
+        return self.create().id
+
+    def settled(self):
+        """
+        Returns the newest version allocated more than SYNC_SETTLE_SECONDS
+        ago. Anything written under a lower version has committed, unless
+        its transaction ran for longer than that.
+        """
+        cutoff = datetime.datetime.now() - datetime.timedelta(seconds=SYNC_SETTLE_SECONDS)
+        ids = self.filter(created_at__lte=cutoff).order_by("-id").values_list("id", flat=True)[:1]
+        return ids and ids[0] or 0
+
+    def prune(self, chunk_size=10000):
+        """
+        Deletes the rows below settled(), which nothing reads any more,
+        chunk_size ids per transaction. The settled row itself is kept so
+        the newest id stays in the table and is never handed out again.
+        Returns the number of rows deleted.
+        """
+        settled = self.settled()
+        first = self.order_by("id").values_list("id", flat=True)[:1]
+        if not first:
+            return 0
+
+        total = 0
+        for start in xrange(first[0], settled, chunk_size):
+            total += self._prune_range(start, min(start + chunk_size, settled))
+        return total
+
+    @transaction.commit_on_success
+    def _prune_range(self, start, end):
+        return bulk_delete(self.filter(id__gte=start, id__lt=end))
+
+class ProjectManager(models.Manager):
+    ORDERING = {
+        "name": "name",
+        "company": "company"
+    }
+
+    def index(self, order="name"):
+        """
+        Returns the projects in the given ORDERING with their Progress in
+        project.progress.
+
+        The project list is cached per ordering and every project's
+        Progress on its own, so a task edit only invalidates the stats of
+        its project. A cold index costs one query for the projects and one
+        aggregate for the stats of all of them.
+        """
+        key = "projects:index:%s" % order
+        projects = cache.get(key)
+        if projects is None:
+            projects = list(self.select_related("company").order_by(self.ORDERING[order]))
+            cache.set(key, projects, INDEX_CACHE_TIMEOUT)
+
+        keys = dict((project.id, PROJECT_STATS_KEY % project.id) for project in projects)
+        cached = cache.get_many(keys.values())
+
+        missing = [id for id, key in keys.items() if key not in cached]
+        if missing:
+            fresh = MilestoneCounter.objects.project_progress(missing)
+            cache.set_many(dict((keys[id], progress) for id, progress in fresh.items()), INDEX_CACHE_TIMEOUT)
+            cached.update((keys[id], progress) for id, progress in fresh.items())
+
+        for project in projects:
+            project.progress = cached[keys[project.id]]
+
+        return projects
+
+    def invalidate_index(self):
+        cache.delete_many(["projects:index:%s" % order for order in self.ORDERING])
+
+    def invalidate_stats(self, project_id):
+        cache.delete(PROJECT_STATS_KEY % project_id)
+
+    def version(self, project_id):
+        """
+        Returns a number that changes every time something in the project's
+        tasks or milestones does, to build cache keys that go stale on
+        their own.
+        """
+        return cache_version(PROJECT_VERSION_KEY % project_id)
+
+    def bump_version(self, project_id):
+        bump_cache_version(PROJECT_VERSION_KEY % project_id)
+
 class TaskManager(models.Manager):
-    pass
+    def version(self, task_id):
+        """
+        Like Project.objects.version(), but for a single task and its
+        change history.
+        """
+        return cache_version(TASK_VERSION_KEY % task_id)
+
+    def bump_version(self, task_id):
+        bump_cache_version(TASK_VERSION_KEY % task_id)
+
+    def attach_users(self, tasks):
+        """
+        Loads the assigned users of every task in a single query and stores
+        them in task.assigned, so listings don't hit task_users per row.
+        """
+        tasks = list(tasks)
+        by_id = {}
+        for task in tasks:
+            task.assigned = []
+            by_id[task.id] = task
+
+        if by_id:
+            through = Task.users.through
+            for row in through.objects.filter(task__in=by_id.keys()).select_related("user"):
+                by_id[row.task_id].assigned.append(row.user)
+
+        return tasks
+
+    @transaction.commit_on_success
+    def save_changed(self, tasks, user, comment=None):
+        """
+        Saves a batch of tasks and records what changed in each of them.
+
+        Every edited task gets one TaskChangeSet holding the author, time
+        and comment. The field diffs of the whole batch are written with
+        one multi-row INSERT in the same transaction as the task UPDATEs.
+        """
+        created_at = datetime.datetime.now()
+        version = SyncVersion.objects.next()
+
+        changesets = []
+        changes = []
+        for task in tasks:
+            task.check_status()
+            task._next_version = version
+            super(Task, task).save()
+
+            task_changes = task.get_changes(user, created_at)
+            if task_changes or comment:
+                changeset = TaskChangeSet.objects.create(task=task, user=user,
+                    comment=comment, created_at=created_at, version=version)
+                for change in task_changes:
+                    change.changeset = changeset
+                changeset.fields = task_changes
+
+                changesets.append(changeset)
+                changes.extend(task_changes)
+
+            task.reset_changes()
+
+        bulk_insert(TaskChange, changes)
+
+        for task in tasks:
+            self.bump_version(task.id)
+
+        signals.history_logged.send(sender=Task, changesets=changesets)
+        for changeset in changesets:
+            signals.changed.send(sender=Task, user=user, instance=changeset.task, created=False)
+
+        return changesets
+
+    @transaction.commit_on_success
+    def bulk_change(self, project_id, task_ids, user, values, comment=None):
+        """
+        Applies the same status, priority, milestone or assignee to many
+        tasks of a project at once.
+
+        values holds the new "status", "priority", "milestone" (an id) and
+        "users" (a list of users replacing the assignees) to apply. The
+        tasks are changed with one UPDATE and their history is written
+        with multi-row INSERTs, every changeset sharing one SyncVersion,
+        timestamp and comment. Tasks that already have the given values
+        are left alone. Returns the changesets written, or raises
+        workflow.InvalidTransition without writing anything when the new
+        status is not allowed for one of the tasks.
+        """
+        values = dict(values)
+        users = values.pop("users", None)
+
+        fields = ["id", "type", "milestone", "status", "duration"] + [
+            field for field in values if field not in ("milestone", "status")]
+        tasks = list(self.filter(project=project_id, id__in=task_ids).values(*fields))
+
+        if "status" in values:
+            for task in tasks:
+                workflow.check_change(task["type"], task["status"], values["status"])
+
+        assigned = {}
+        if users is not None:
+            rows = Task.users.through.objects.filter(task__in=[task["id"] for task in tasks]).select_related("user")
+            for row in rows:
+                assigned.setdefault(row.task_id, []).append(row.user)
+            new_users = u", ".join(sorted(unicode(person) for person in users))
+
+        created_at = datetime.datetime.now()
+        changed = {}
+        for task in tasks:
+            task_changes = []
+            for field, value in values.items():
+                if task[field] != value:
+                    task_changes.append((field, task[field], value))
+            if users is not None:
+                old_users = u", ".join(sorted(unicode(person) for person in assigned.get(task["id"], ())))
+                if old_users != new_users:
+                    task_changes.append(("users", old_users, new_users))
+            if task_changes:
+                changed[task["id"]] = (task, task_changes)
+
+        if not changed:
+            return []
+
+        version = SyncVersion.objects.next()
+        ids = changed.keys()
+
+        update = dict(values)
+        if "status" in values:
+            update["is_open"] = workflow.is_open(values["status"])
+        self.filter(id__in=ids).update(changed_at=created_at, version=version, **update)
+
+        if users is not None:
+            through = Task.users.through
+            through.objects.filter(task__in=ids).delete()
+            bulk_insert(through, [through(task_id=task_id, user_id=person.id)
+                for task_id in ids for person in users])
+
+        deltas = {}
+        for task, task_changes in changed.values():
+            milestone_id = values.get("milestone", task["milestone"])
+            status = values.get("status", task["status"])
+            if (milestone_id, status) == (task["milestone"], task["status"]):
+                continue
+            for key, sign in (((task["milestone"], task["status"]), -1), ((milestone_id, status), 1)):
+                delta = deltas.setdefault(key, [0, 0])
+                delta[0] += sign
+                delta[1] += sign * task["duration"]
+        for (milestone_id, status), (count, duration) in deltas.items():
+            if count or duration:
+                MilestoneCounter.objects.add(milestone_id, status, count, duration)
+
+        bulk_insert(TaskChangeSet, [TaskChangeSet(task_id=task_id, user=user, comment=comment,
+            created_at=created_at, version=version) for task_id in ids])
+
+        instances = {}
+        changesets = []
+        changes = []
+        rows = TaskChangeSet.objects.filter(version=version, task__in=ids).values_list("id", "task")
+        for changeset_id, task_id in rows:
+            task, task_changes = changed[task_id]
+            instance = Task(id=task_id, project_id=project_id,
+                milestone_id=values.get("milestone", task["milestone"]))
+            instances[task_id] = instance
+
+            changeset = TaskChangeSet(id=changeset_id, task=instance, user=user, comment=comment,
+                created_at=created_at, version=version)
+            changeset.fields = [TaskChange(user=user, task_id=task_id, changeset_id=changeset_id,
+                field=field, old_value=old_value, new_value=new_value, created_at=created_at)
+                for field, old_value, new_value in task_changes]
+
+            changesets.append(changeset)
+            changes.extend(changeset.fields)
+
+        bulk_insert(TaskChange, changes)
+
+        Project.objects.bump_version(project_id)
+        Project.objects.invalidate_stats(project_id)
+        for task_id in ids:
+            self.bump_version(task_id)
+
+        signals.history_logged.send(sender=Task, changesets=changesets)
+        signals.bulk_changed.send(sender=Task, user=user, instances=instances.values())
+
+        return changesets
 
 class TaskChangeManager(models.Manager):
     def for_task(self, task):
@@ -34,35 +352,306 @@ class TaskChangeManager(models.Manager):
 
         return changes
 
-    def grouped(self, task):
-        changes = self.for_task(task)
-        num = 0
-        last_uid = None
-        for change in changes:
-            uid = (change.created_at, change.user)
-            if uid != last_uid:
-                current = {
-                    "user": change.user,
-                    "created_at": change.created_at,
-                    "fields":[],
-                    "num": num
-                }
-                num += 1
-                last_uid = uid
-
-                yield current
-
-            if change.field == "comment":
-                current["comment"] = change.new_value
-            else:
-                current["fields"].append({
-                    "label": change.field,                    
-                    "old": change.old_value,
-                    "new": change.new_value
-                })
+    def milestone_names(self, values):
+        """
+        Milestone changes store the milestone ids. Returns {value: name}
+        for the values that are ids of existing milestones, with one
+        query, to show them by name.
+        """
+        ids = set(int(value) for value in values if value and unicode(value).isdigit())
+        if not ids:
+            return {}
+        return dict((unicode(id), name) for id, name in Milestone.objects.filter(id__in=ids).values_list("id", "name"))
+
+class TaskChangeSetManager(models.Manager):
+    def for_task(self, task):
+        return self.filter(task=task).select_related("user").order_by("created_at", "id")
+
+    def attach_changes(self, changesets):
+        """
+        Loads the field diffs of a page of changesets with a single query
+        and stores them in changeset.fields, milestones by name.
+        """
+        changesets = list(changesets)
+        by_id = {}
+        for changeset in changesets:
+            changeset.fields = []
+            by_id[changeset.id] = changeset
+
+        if by_id:
+            changes = list(TaskChange.objects.filter(changeset__in=by_id.keys()).order_by("id"))
+            moves = [change for change in changes if change.field == "milestone"]
+            names = TaskChange.objects.milestone_names(
+                [change.old_value for change in moves] + [change.new_value for change in moves])
+            for change in moves:
+                change.old_value = names.get(change.old_value, change.old_value)
+                change.new_value = names.get(change.new_value, change.new_value)
+            for change in changes:
+                by_id[change.changeset_id].fields.append(change)
+
+        return changesets
+
+class Progress(object):
+    """
+    Task counts and durations by status, for a milestone or a project.
+    """
+    def __init__(self):
+        self.counts = dict((status, 0) for status, label in workflow.TASK_STATUS)
+        self.durations = dict((status, 0) for status, label in workflow.TASK_STATUS)
+
+    def add(self, status, tasks, duration):
+        self.counts[status] = self.counts.get(status, 0) + tasks
+        self.durations[status] = self.durations.get(status, 0) + duration
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    @property
+    def completed(self):
+        return sum(self.counts.get(status, 0) for status in workflow.CLOSED_STATUSES)
+
+    @property
+    def open(self):
+        return self.total - self.completed
+
+    @property
+    def duration(self):
+        return sum(self.durations.values())
+
+    @property
+    def open_duration(self):
+        return self.duration - sum(self.durations.get(status, 0) for status in workflow.CLOSED_STATUSES)
+
+    def by_status(self):
+        return [(label, self.counts[status]) for status, label in workflow.TASK_STATUS]
+
+class MilestoneCounterManager(models.Manager):
+    def add(self, milestone_id, status, tasks, duration):
+        """
+        Moves a milestone's counters for the given status by a delta, with
+        an UPDATE ... SET tasks = tasks + n so concurrent edits don't race.
+        """
+        update = lambda: self.filter(milestone=milestone_id, status=status).update(
+            tasks=models.F("tasks") + tasks, duration=models.F("duration") + duration)
+
+        # Decrements never create rows: a missing row means the milestone
+        # is being deleted or its counters are waiting for a rebuild.
+        if update():
+            MilestoneSnapshot.objects.add(milestone_id, status, tasks, duration)
+        elif tasks > 0:
+            self.get_or_create(milestone__id=milestone_id, status=status,
+                defaults={"milestone_id": milestone_id})
+            update()
+            MilestoneSnapshot.objects.add(milestone_id, status, tasks, duration)
+
+    def progress(self, milestones):
+        """
+        Returns a dict of milestone id to Progress, with a single query for
+        all the given milestones.
+        """
+        ids = [getattr(milestone, "id", milestone) for milestone in milestones]
+        progress = dict((id, Progress()) for id in ids)
+        for counter in self.filter(milestone__in=ids):
+            progress[counter.milestone_id].add(counter.status, counter.tasks, counter.duration)
+
+        return progress
+
+    def project_progress(self, projects):
+        """
+        Same as progress() but summed per project, in one GROUP BY query
+        over the counters rather than the task table.
+        """
+        ids = [getattr(project, "id", project) for project in projects]
+        progress = dict((id, Progress()) for id in ids)
+        if ids:
+            rows = self.filter(milestone__project__in=ids).values("milestone__project", "status").annotate(
+                num=models.Sum("tasks"), total=models.Sum("duration")).order_by()
+            for row in rows:
+                progress[row["milestone__project"]].add(row["status"], row["num"] or 0, row["total"] or 0)
+
+        return progress
+
+    @transaction.commit_on_success
+    def rebuild(self, milestones=None):
+        """
+        Recomputes the counters from the task table.
+        """
+        tasks = Task.objects.all()
+        counters = self.all()
+        if milestones is not None:
+            tasks = tasks.filter(milestone__in=milestones)
+            counters = counters.filter(milestone__in=milestones)
+
+        counters.delete()
+
+        rows = tasks.order_by().values("milestone", "status").annotate(
+            num=models.Count("id"), total=models.Sum("duration"))
+        bulk_insert(MilestoneCounter, [
+            MilestoneCounter(milestone_id=row["milestone"], status=row["status"],
+                tasks=row["num"], duration=row["total"] or 0)
+            for row in rows
+        ])
+
+class MilestoneSnapshotManager(models.Manager):
+    def add(self, milestone_id, status, tasks, duration):
+        """
+        Moves today's snapshot of a milestone's status by the same delta as
+        its counter. The first change of the day copies the counter, which
+        already holds the delta.
+        """
+        today = datetime.date.today()
+        if self.filter(milestone=milestone_id, day=today, status=status).update(
+                tasks=models.F("tasks") + tasks, duration=models.F("duration") + duration):
+            return
+
+        counted = MilestoneCounter.objects.filter(milestone=milestone_id, status=status).values_list(
+            "tasks", "duration")[:1]
+        if counted:
+            self.get_or_create(milestone__id=milestone_id, day=today, status=status, defaults={
+                "milestone_id": milestone_id, "tasks": counted[0][0], "duration": counted[0][1]})
+
+    def series(self, milestone_id, start, end):
+        """
+        Returns one dict per day from start to end with the tasks of each
+        status in "tasks", the open ones in "open" and their summed
+        duration in "remaining", for burndown and cumulative flow charts.
+        Days without a snapshot carry the numbers of the one before.
+
+        Only the rows from start to end are read, plus the last one of
+        every status before start, so the cost depends on the range and
+        not on the age of the milestone.
+        """
+        snapshots = self.filter(milestone=milestone_id)
+        before = snapshots.filter(day__lt=start).values("status").annotate(last=models.Max("day")).order_by()
+        wanted = models.Q(day__gte=start, day__lte=end)
+        for row in before:
+            wanted |= models.Q(status=row["status"], day=row["last"])
+        rows = snapshots.filter(wanted).order_by("day").values_list("day", "status", "tasks", "duration")
+
+        tasks = dict((status, 0) for status, label in workflow.TASK_STATUS)
+        durations = {}
+        series = []
+        day = start
+        rows = iter(rows)
+        row = next(rows, None)
+        while day <= end:
+            while row is not None and row[0] <= day:
+                tasks[row[1]] = row[2]
+                durations[row[1]] = row[3]
+                row = next(rows, None)
+            series.append({
+                "day": day,
+                "tasks": dict(tasks),
+                "open": sum(count for status, count in tasks.items() if workflow.is_open(status)),
+                "remaining": sum(total for status, total in durations.items() if workflow.is_open(status)),
+            })
+            day += datetime.timedelta(days=1)
+        return series
+
+    @transaction.commit_on_success
+    def rebuild(self, milestones=None, chunk_size=5000):
+        """
+        Recomputes the snapshots from the task table and its history.
+
+        Starting from the tasks as they are now, the status, duration and
+        milestone changes are undone newest first, in id chunks, which
+        gives the day by day moves between counters and what every task
+        was created as. Snapshots of the given milestones are then the
+        running totals of those moves. Tasks only move within a project,
+        so the history of the milestones' projects is all that is read.
+        """
+        tasks = Task.objects.all()
+        changes = TaskChange.objects.filter(field__in=COUNTED_FIELDS)
+        snapshots = self.all()
+        if milestones is not None:
+            milestones = set(getattr(milestone, "id", milestone) for milestone in milestones)
+            projects = set(Milestone.objects.filter(id__in=milestones).values_list("project", flat=True))
+            tasks = tasks.filter(project__in=projects)
+            changes = changes.filter(task__project__in=projects)
+            snapshots = snapshots.filter(milestone__in=milestones)
+
+        state = {}
+        created = {}
+        last = 0
+        while True:
+            rows = list(tasks.filter(id__gt=last).order_by("id").values_list(
+                "id", "milestone", "status", "duration", "created_at")[:chunk_size])
+            if not rows:
+                break
+            for task_id, milestone_id, status, duration, created_at in rows:
+                state[task_id] = (milestone_id, status, duration)
+                created[task_id] = created_at.date()
+            last = rows[-1][0]
+
+        moves = {}
+        def move(day, counted, sign):
+            milestone_id, status, duration = counted
+            delta = moves.setdefault((milestone_id, day, status), [0, 0])
+            delta[0] += sign
+            delta[1] += sign * duration
+
+        last = None
+        while True:
+            chunk = changes.order_by("-id")
+            if last is not None:
+                chunk = chunk.filter(id__lt=last)
+            rows = list(chunk.values_list("id", "task", "field", "old_value", "created_at")[:chunk_size])
+            if not rows:
+                break
+            for change_id, task_id, field, old_value, created_at in rows:
+                if task_id not in state:
+                    continue
+                milestone_id, status, duration = after = state[task_id]
+                try:
+                    if field == "status":
+                        status = old_value
+                    elif field == "duration":
+                        duration = int(old_value)
+                    else:
+                        milestone_id = int(old_value)
+                except (TypeError, ValueError), err:
+                    continue
+                before = state[task_id] = (milestone_id, status, duration)
+                move(created_at.date(), after, 1)
+                move(created_at.date(), before, -1)
+            last = rows[-1][0]
+
+        for task_id, counted in state.items():
+            move(created[task_id], counted, 1)
+
+        totals = {}
+        objects = []
+        for (milestone_id, day, status), (count, duration) in sorted(moves.items()):
+            if milestones is not None and milestone_id not in milestones:
+                continue
+            if not count and not duration:
+                continue
+            total = totals.setdefault((milestone_id, status), [0, 0])
+            total[0] += count
+            total[1] += duration
+            objects.append(MilestoneSnapshot(milestone_id=milestone_id, day=day, status=status,
+                tasks=total[0], duration=total[1]))
+
+        bulk_delete(snapshots)
+        bulk_insert(MilestoneSnapshot, objects)
+        return len(objects)
 
 ##### Models
 
+class SyncVersion(models.Model):
+    """
+    Sequence of the versions stamped on tasks, changesets and deleted
+    tasks. The sync feed hands out whatever was written after the version
+    a client last saw.
+    """
+    created_at = models.DateTimeField(default=datetime.datetime.now)
+
+    objects = SyncVersionManager()
+
+    class Meta:
+        db_table = "sync_version"
+
 class Project(models.Model):
     name = models.CharField(max_length=255, unique=True)
     description = models.TextField(blank=True)
@@ -71,6 +660,8 @@ class Project(models.Model):
     managers = models.ManyToManyField(User, related_name="project_managers")
     people = models.ManyToManyField(User, related_name="project_people")
 
+    objects = ProjectManager()
+
     class Meta:
         db_table = "project"
         ordering = ["name"]
@@ -80,7 +671,7 @@ class Project(models.Model):
 
     @models.permalink
     def get_absolute_url(self):
-        return ('project_detail', {"id": self.id})
+        return ('project_detail', (), {"project_id": self.id})
 
 class Milestone(models.Model):
     project = models.ForeignKey(Project)
@@ -95,7 +686,7 @@ class Milestone(models.Model):
 
     @models.permalink
     def get_absolute_url(self):
-        return ('milestone_detail', {"id": self.id})
+        return ('milestone_detail', (), {"milestone_id": self.id})
 
 class Task(models.Model):
     name = models.CharField(max_length=255)
@@ -105,14 +696,21 @@ class Task(models.Model):
     type = models.CharField(max_length=100, choices=workflow.TASK_TYPE)
     priority = models.CharField(max_length=100, choices=workflow.TASK_PRIORITY)
     status = models.CharField(max_length=100, choices=workflow.TASK_STATUS)
+    # workflow.is_open(status), kept by task_pre_save for indexed lookups.
+    is_open = models.BooleanField(default=True, editable=False)
 
     milestone = models.ForeignKey(Milestone)
+    # Copy of milestone.project, so task listings filter without a join.
+    project = models.ForeignKey(Project, null=True, editable=False)
 
     created_at = models.DateTimeField(auto_now_add=True)
     changed_at = models.DateTimeField(auto_now_add=True, auto_now=True)
 
     duration = models.IntegerField(default=1)
 
+    # SyncVersion of the last write, set by task_pre_save.
+    version = models.PositiveIntegerField(default=0, editable=False)
+
     objects = TaskManager()
 
     class Meta:
@@ -125,39 +723,172 @@ class Task(models.Model):
         self._old = {
             "name": self.name,
             "status": self.status,
-            "comment": None,
             "priority": self.priority,
             "duration": self.duration,
-            "type": self.type
+            "type": self.type,
+            "milestone": self.milestone_id
         }
 
+        # What this task currently adds to its milestone's counters.
+        self._counted = None
+        # Set to share one SyncVersion between the tasks of a batch.
+        self._next_version = None
+        # Project the task was moved out of by the save in progress.
+        self._left_project = None
+        if self.id:
+            self._counted = (self.milestone_id, self.status, self.duration)
+
     def __unicode__(self):
         return u"%s" % self.name
 
     @models.permalink
     def get_absolute_url(self):
-        return ('task_detail', {"id": self.id})
+        return ('task_detail', (), {"task_id": self.id})
+
+    def get_changes(self, user, created_at=None):
+        """
+        Returns unsaved TaskChange rows for every tracked field that differs
+        from the values the task was loaded with.
+        """
+        new = model_to_dict(self, fields=self._old.keys())
+
+        changes = []
+        for field in self._old.keys():
+            if self._old[field] != new[field]:
+                changes.append(TaskChange(
+                    user=user,
+                    task=self,
+                    field=field,
+                    old_value=self._old[field],
+                    new_value=new[field],
+                    created_at=created_at
+                ))
+        return changes
+
+    def reset_changes(self):
+        self._old = model_to_dict(self, fields=self._old.keys())
+
+    def check_status(self):
+        """
+        Raises workflow.InvalidTransition if the status the task was loaded
+        with can't be changed to its current one, or a new task does not
+        start in one of workflow.INITIAL_STATUSES.
+        """
+        if self.id:
+            workflow.check_change(self.type, self._old["status"], self.status)
+        else:
+            workflow.check_initial(self.type, self.status)
+
+    def clean(self):
+        try:
+            self.check_status()
+        except workflow.InvalidTransition, err:
+            raise ValidationError(err.args[0])
 
     def save(self, request=None, comment=None):
         if self._old and request:
-            new = model_to_dict(self)
-            new["comment"] = comment
+            Task.objects.save_changed([self], request.user, comment)
+        else:
+            self.check_status()
+            super(Task, self).save()
+            self.reset_changes()
+
+class SavedFilter(models.Model):
+    user = models.ForeignKey(User)
+    project = models.ForeignKey(Project)
+    name = models.CharField(max_length=255)
+    query = models.TextField()
+
+    class Meta:
+        db_table = "saved_filter"
+        ordering = ["name"]
+
+    def __unicode__(self):
+        return u"%s" % self.name
+
+class MilestoneCounter(models.Model):
+    """
+    Number of tasks and summed duration per milestone and status, kept up
+    to date by the Task signal handlers below.
+    """
+    milestone = models.ForeignKey(Milestone, related_name="counters")
+    status = models.CharField(max_length=100, choices=workflow.TASK_STATUS)
+    tasks = models.IntegerField(default=0)
+    duration = models.IntegerField(default=0)
 
-            _version = time.time()
+    objects = MilestoneCounterManager()
 
-            for field in self._old.keys():
-                if self._old[field] != new[field]:            
-                    change = {
-                        "user": request.user,
-                        "task": self,
-                        "field": field,
-                        "old_value": self._old[field],
-                        "new_value": new[field],
-                        "created_at": _version
-                    }
-                    TaskChange(**change).save()
+    class Meta:
+        db_table = "milestone_counter"
+        unique_together = (("milestone", "status"),)
+
+    def __unicode__(self):
+        return u"%s: %d" % (self.status, self.tasks)
+
+class MilestoneSnapshot(models.Model):
+    """
+    A milestone's MilestoneCounter for one status at the end of a day.
+    Rows are only written on the days the numbers moved, so a day without
+    one has the numbers of the latest row before it.
+    """
+    milestone = models.ForeignKey(Milestone, related_name="snapshots")
+    day = models.DateField()
+    status = models.CharField(max_length=100, choices=workflow.TASK_STATUS)
+    tasks = models.IntegerField(default=0)
+    duration = models.IntegerField(default=0)
+
+    objects = MilestoneSnapshotManager()
+
+    class Meta:
+        db_table = "milestone_snapshot"
+        unique_together = (("milestone", "day", "status"),)
+
+    def __unicode__(self):
+        return u"%s %s: %d" % (self.day, self.status, self.tasks)
 
-        super(Task, self).save()
+class MilestoneForecast(models.Model):
+    """
+    Completion forecast of a milestone: its open hours and the dates it is
+    done by in 50, 85 and 95% of the simulated runs, None past the
+    horizon. Written by manage.py forecast_milestones, see forecast.py,
+    so pages only read it.
+    """
+    milestone = models.OneToOneField(Milestone, related_name="forecast")
+    computed_at = models.DateTimeField(default=datetime.datetime.now)
+    remaining = models.IntegerField(default=0)
+    workers = models.IntegerField(default=0)
+    p50 = models.DateField(null=True)
+    p85 = models.DateField(null=True)
+    p95 = models.DateField(null=True)
+
+    class Meta:
+        db_table = "milestone_forecast"
+
+    def __unicode__(self):
+        return u"%s @ %s" % (self.milestone_id, self.computed_at)
+
+    def by_percentile(self):
+        return [(50, self.p50), (85, self.p85), (95, self.p95)]
+
+class TaskChangeSet(models.Model):
+    """
+    One edit of a task: who made it, when, and the comment left with it.
+    The changed fields hang from it as TaskChange rows.
+    """
+    user = models.ForeignKey(User)
+    task = models.ForeignKey(Task)
+    created_at = models.DateTimeField(default=datetime.datetime.now, db_index=True)
+    comment = models.TextField(blank=True, null=True)
+    version = models.PositiveIntegerField(default=0)
+
+    objects = TaskChangeSetManager()
+
+    class Meta:
+        db_table = "task_changeset"
+        ordering = ["created_at", "id"]
+
+    def __unicode__(self):
+        return u"%s @ %s" % (self.user_id, self.created_at)
 
 class TaskChange(models.Model):
     _TASK_FIELDS = (
@@ -167,10 +898,13 @@ class TaskChange(models.Model):
         ("duration", _("Duration")),
         ("type", _("Type")),
         ("name", _("Name")),
+        ("milestone", _("Milestone")),
+        ("users", _("Assigned to")),
     )
 
     user = models.ForeignKey(User)
     task = models.ForeignKey(Task)
+    changeset = models.ForeignKey(TaskChangeSet, related_name="changes", blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     field = models.CharField(max_length=100, choices=_TASK_FIELDS)
@@ -184,3 +918,142 @@ class TaskChange(models.Model):
 
     def __unicode__(self):
         return u"%s" % self.field
+
+class DeletedTask(models.Model):
+    """
+    Tombstone left by a deleted task, or in the old project by a task
+    moved to another one, so sync clients can drop it too.
+    """
+    task_id = models.PositiveIntegerField()
+    project = models.ForeignKey(Project)
+    version = models.PositiveIntegerField()
+
+    class Meta:
+        db_table = "deleted_task"
+
+    def __unicode__(self):
+        return u"%s" % self.task_id
+
+##### Signals
+
+def task_pre_save(sender, instance, **kwargs):
+    moved = instance._counted and instance._counted[0] != instance.milestone_id
+    if instance.project_id is None or moved:
+        project_id = instance.project_id
+        instance.project_id = instance.milestone.project_id
+        if project_id and project_id != instance.project_id:
+            instance._left_project = project_id
+
+    instance.is_open = workflow.is_open(instance.status)
+    instance.version = instance._next_version or SyncVersion.objects.next()
+    instance._next_version = None
+
+def task_saved(sender, instance, **kwargs):
+    Project.objects.bump_version(instance.project_id)
+    Task.objects.bump_version(instance.id)
+
+    if instance._left_project:
+        # To the sync feed of the project it left, a moved task is gone.
+        DeletedTask.objects.filter(task_id=instance.id, project=instance.project_id).delete()
+        DeletedTask.objects.create(task_id=instance.id, project_id=instance._left_project,
+            version=instance.version)
+        Project.objects.bump_version(instance._left_project)
+        Project.objects.invalidate_stats(instance._left_project)
+        instance._left_project = None
+
+    counted = (instance.milestone_id, instance.status, instance.duration)
+    if counted == instance._counted:
+        return
+
+    if instance._counted:
+        milestone_id, status, duration = instance._counted
+        MilestoneCounter.objects.add(milestone_id, status, -1, -duration)
+    MilestoneCounter.objects.add(instance.milestone_id, instance.status, 1, instance.duration)
+
+    instance._counted = counted
+
+    Project.objects.invalidate_stats(instance.project_id)
+
+def task_deleted(sender, instance, **kwargs):
+    if instance._counted:
+        milestone_id, status, duration = instance._counted
+        MilestoneCounter.objects.add(milestone_id, status, -1, -duration)
+        instance._counted = None
+
+        for project_id in Milestone.objects.filter(id=milestone_id).values_list("project", flat=True):
+            Project.objects.invalidate_stats(project_id)
+
+    if instance.project_id:
+        Project.objects.bump_version(instance.project_id)
+        DeletedTask.objects.create(task_id=instance.id, project_id=instance.project_id,
+            version=SyncVersion.objects.next())
+
+def task_users_changed(sender, instance, **kwargs):
+    if kwargs.get("action", "").startswith("post_"):
+        task_ids = isinstance(instance, Task) and [instance.id] or kwargs.get("pk_set") or ()
+        Task.objects.filter(id__in=task_ids).update(version=SyncVersion.objects.next())
+
+    if isinstance(instance, Task):
+        Project.objects.bump_version(instance.project_id)
+        Task.objects.bump_version(instance.id)
+    else:
+        task_ids = kwargs.get("pk_set") or ()
+        for task_id in task_ids:
+            Task.objects.bump_version(task_id)
+        for project_id in set(Task.objects.filter(id__in=task_ids).values_list("project", flat=True)):
+            Project.objects.bump_version(project_id)
+
+def milestone_saved(sender, instance, **kwargs):
+    Project.objects.bump_version(instance.project_id)
+
+def milestone_deleted(sender, instance, **kwargs):
+    Project.objects.invalidate_stats(instance.project_id)
+    Project.objects.bump_version(instance.project_id)
+
+def project_changed(sender, instance, **kwargs):
+    Project.objects.invalidate_index()
+    Project.objects.invalidate_stats(instance.id)
+    Project.objects.bump_version(instance.id)
+
+def project_members_changed(sender, instance, **kwargs):
+    if isinstance(instance, Project):
+        Project.objects.bump_version(instance.id)
+    else:
+        for project_id in kwargs.get("pk_set") or ():
+            Project.objects.bump_version(project_id)
+
+def project_deleted(sender, instance, **kwargs):
+    bump_auth_version()
+
+def user_changed(sender, instance, **kwargs):
+    cache.delete(USER_CACHE_KEY % instance.id)
+
+def auth_changed(sender, instance, action, model, pk_set, **kwargs):
+    if not action.startswith("post_"):
+        return
+    if isinstance(instance, User):
+        bump_auth_version(instance.id)
+    elif model is User and pk_set:
+        for user_id in pk_set:
+            bump_auth_version(user_id)
+    else:
+        bump_auth_version()
+
+models.signals.pre_save.connect(task_pre_save, sender=Task)
+models.signals.post_save.connect(task_saved, sender=Task)
+models.signals.post_delete.connect(task_deleted, sender=Task)
+models.signals.m2m_changed.connect(task_users_changed, sender=Task.users.through)
+models.signals.post_save.connect(milestone_saved, sender=Milestone)
+models.signals.post_delete.connect(milestone_deleted, sender=Milestone)
+models.signals.post_save.connect(project_changed, sender=Project)
+models.signals.post_delete.connect(project_changed, sender=Project)
+models.signals.m2m_changed.connect(project_members_changed, sender=Project.people.through)
+models.signals.m2m_changed.connect(project_members_changed, sender=Project.managers.through)
+models.signals.post_delete.connect(project_deleted, sender=Project)
+models.signals.post_save.connect(user_changed, sender=User)
+models.signals.post_delete.connect(user_changed, sender=User)
+for through in (Project.people.through, Project.managers.through, User.groups.through,
+        User.user_permissions.through, Group.permissions.through):
+    models.signals.m2m_changed.connect(auth_changed, sender=through)
+models.signals.post_save.connect(lambda sender, **kwargs: Project.objects.invalidate_index(),
+    sender=Company, weak=False)
@@ -0,0 +1,134 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Notifiers wake up requests waiting for writes to a project's tasks.
+
+Both keep a per project version that moves on every write; wait()
+returns as soon as it differs from the one the caller saw, or when the
+timeout passes. The waits only sleep, so under a cooperative server
+(gunicorn or spawning with eventlet/gevent workers, with the standard
+library monkeypatched) an idle waiting request holds a greenlet rather
+than an OS thread.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models, transaction
+
+from projecter.apps.projects import signals
+from projecter.apps.projects.models import Task, DeletedTask
+
+class LocalNotifier(object):
+    """
+    In-process notifier for development and tests: writes made by this
+    process wake the requests waiting in it right away.
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.versions = {}
+
+    def notify(self, project_id):
+        self.condition.acquire()
+        try:
+            self.versions[project_id] = self.versions.get(project_id, 0) + 1
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+    def version(self, project_id):
+        return self.versions.get(project_id, 0)
+
+    def wait(self, project_id, seen, timeout):
+        deadline = time.time() + timeout
+        self.condition.acquire()
+        try:
+            while self.versions.get(project_id, 0) == seen:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            return self.versions.get(project_id, 0)
+        finally:
+            self.condition.release()
+
+class DatabaseNotifier(object):
+    """
+    Works across processes and hosts: the version of a project is the
+    newest sync version of its tasks and tombstones, read every
+    poll_interval seconds with two lookups on the (project, version)
+    indexes.
+    """
+    def __init__(self, poll_interval=None):
+        self.poll_interval = poll_interval or getattr(settings, "PROJECTER_NOTIFIER_POLL_INTERVAL", 1.0)
+
+    def notify(self, project_id):
+        pass
+
+    def version(self, project_id):
+        versions = []
+        for model in (Task, DeletedTask):
+            versions.extend(model.objects.filter(project=project_id).order_by("-version").values_list(
+                "version", flat=True)[:1])
+        transaction.rollback_unless_managed()
+        return max(versions or [0])
+
+    def wait(self, project_id, seen, timeout):
+        deadline = time.time() + timeout
+        current = self.version(project_id)
+        while current == seen:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            time.sleep(min(self.poll_interval, remaining))
+            current = self.version(project_id)
+        return current
+
+BACKENDS = {
+    "database": DatabaseNotifier,
+    "local": LocalNotifier,
+}
+
+_notifier = None
+
+def get_notifier():
+    global _notifier
+    if _notifier is None:
+        backend = getattr(settings, "PROJECTER_NOTIFIER_BACKEND", "database")
+        if backend not in BACKENDS:
+            raise ImproperlyConfigured("Unknown PROJECTER_NOTIFIER_BACKEND %r" % backend)
+        _notifier = BACKENDS[backend]()
+    return _notifier
+
+##### Signals
+
+def task_written(sender, instance, **kwargs):
+    if instance.project_id:
+        get_notifier().notify(instance.project_id)
+
+def task_users_changed(sender, instance, **kwargs):
+    if isinstance(instance, Task) and kwargs.get("action", "").startswith("post_"):
+        task_written(sender, instance)
+
+def tasks_written(sender, instances, **kwargs):
+    for project_id in set(instance.project_id for instance in instances):
+        get_notifier().notify(project_id)
+
+models.signals.post_save.connect(task_written, sender=Task)
+models.signals.post_delete.connect(task_written, sender=Task)
+models.signals.m2m_changed.connect(task_users_changed, sender=Task.users.through)
+signals.bulk_changed.connect(tasks_written, sender=Task)
@@ -0,0 +1,140 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import datetime
+
+from django.db.models import Q
+
+DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+class InvalidCursor(ValueError):
+    pass
+
+class KeysetPage(object):
+    def __init__(self, object_list, next_cursor=None, prev_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+class TaskKeysetPaginator(object):
+    """
+    Pages over tasks following Task.Meta.ordering (-created_at, priority,
+    status), with id as tie breaker so every row has a unique position.
+
+    Instead of OFFSET, every page is fetched with a WHERE clause that starts
+    right after (or before) the row encoded in the cursor, so the cost of a
+    page does not depend on how deep into the listing it is.
+    """
+    # (field, descending)
+    keys = (
+        ("created_at", True),
+        ("priority", False),
+        ("status", False),
+        ("id", False),
+    )
+
+    def __init__(self, queryset, per_page=50):
+        self.queryset = queryset
+        self.per_page = per_page
+
+    def encode(self, task):
+        # Pages of values() querysets hold dicts rather than tasks.
+        if isinstance(task, dict):
+            get = task.__getitem__
+        else:
+            get = lambda field: getattr(task, field)
+
+        values = (
+            get("created_at").strftime(DATETIME_FORMAT),
+            get("priority"),
+            get("status"),
+            str(get("id")),
+        )
+        return base64.urlsafe_b64encode("|".join(values).encode("utf-8"))
+
+    def decode(self, cursor):
+        try:
+            values = base64.urlsafe_b64decode(str(cursor)).decode("utf-8").split("|")
+            created_at, priority, status, id = values
+            return (
+                datetime.datetime.strptime(created_at, DATETIME_FORMAT),
+                priority,
+                status,
+                int(id),
+            )
+        except (TypeError, ValueError, UnicodeError), err:
+            raise InvalidCursor(cursor)
+
+    def _after(self, values, backwards=False):
+        """
+        Builds the lexicographic "row comes after values" condition:
+
+            k1 > v1 OR (k1 = v1 AND (k2 > v2 OR (k2 = v2 AND ...)))
+        """
+        condition = None
+        for (field, descending), value in reversed(zip(self.keys, values)):
+            lookup = "lt" if descending != backwards else "gt"
+            strict = Q(**{"%s__%s" % (field, lookup): value})
+            if condition is None:
+                condition = strict
+            else:
+                condition = strict | (Q(**{field: value}) & condition)
+        return condition
+
+    def _ordering(self, backwards=False):
+        ordering = []
+        for field, descending in self.keys:
+            if descending != backwards:
+                ordering.append("-%s" % field)
+            else:
+                ordering.append(field)
+        return ordering
+
+    def page(self, after=None, before=None):
+        backwards = before is not None
+        queryset = self.queryset.order_by(*self._ordering(backwards))
+
+        cursor = before if backwards else after
+        if cursor:
+            queryset = queryset.filter(self._after(self.decode(cursor), backwards))
+
+        # One extra row tells us if there is anything beyond this page.
+        object_list = list(queryset[:self.per_page + 1])
+        has_more = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+
+        if backwards:
+            object_list.reverse()
+
+        next_cursor = prev_cursor = None
+        if object_list:
+            if has_more or backwards:
+                next_cursor = self.encode(object_list[-1])
+            if (has_more and backwards) or (not backwards and cursor):
+                prev_cursor = self.encode(object_list[0])
+
+        return KeysetPage(object_list, next_cursor, prev_cursor)
@@ -0,0 +1,203 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Answers "can this user do that on this project" from a per user set of
+permissions and project roles, cached across requests until
+projects.models.bump_auth_version() is called for the user, and kept on
+the user object for the rest of the request.
+
+Users and permissions are only cached across requests when the cache is
+shared by every process (memcached): with a per-process one a bump
+would only reach the process that made it, and a deactivated user or a
+revoked role would live on in the others.
+"""
+
+from django import http
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User, Permission
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils.functional import wraps
+
+from projecter.apps.projects.models import Project, Milestone, Task, auth_version, USER_CACHE_KEY
+
+PERMISSIONS_CACHE_TIMEOUT = getattr(settings, "PROJECTER_PERMISSIONS_CACHE_TIMEOUT", 60 * 60)
+
+# Cache backends every process has a copy of, or none at all.
+LOCAL_CACHES = ("locmem", "dummy")
+SHARED_CACHE = settings.CACHE_BACKEND.split(":", 1)[0] not in LOCAL_CACHES
+
+ROLES = ("people", "managers")
+
+# action: (roles allowed on the project, permission allowed on any project)
+ACTIONS = {
+    "view": (("people", "managers"), None),
+    "add_task": (("people", "managers"), "projects.add_task"),
+    "add_milestone": (("managers",), "projects.add_milestone"),
+    "change": (("managers",), "projects.change_project"),
+}
+
+def cached(user, kind, load):
+    """
+    Returns load(user) from the request's user object, or the cache when
+    it is shared, or by calling it, in that order.
+    """
+    attr = "_%s_cache" % kind
+    if not hasattr(user, attr):
+        if SHARED_CACHE:
+            key = "projects:%s:%s:%s" % (kind, user.id, auth_version(user.id))
+            value = cache.get(key)
+            if value is None:
+                value = load(user)
+                cache.set(key, value, PERMISSIONS_CACHE_TIMEOUT)
+        else:
+            value = load(user)
+        setattr(user, attr, value)
+    return getattr(user, attr)
+
+def load_permissions(user):
+    """
+    Loads the user's own and group permissions with a single query.
+    """
+    rows = Permission.objects.filter(Q(user=user) | Q(group__user=user)).values_list(
+        "content_type__app_label", "codename").distinct()
+    return set([u"%s.%s" % (app_label, codename) for app_label, codename in rows])
+
+def load_roles(user):
+    roles = {}
+    for role in ROLES:
+        through = getattr(Project, role).through
+        for project_id in through.objects.filter(user=user).values_list("project", flat=True):
+            roles.setdefault(project_id, set()).add(role)
+    return roles
+
+def project_roles(user):
+    """
+    Returns {project id: set of ROLES} for the projects the user is in.
+    """
+    return cached(user, "roles", load_roles)
+
+def can(user, action, project_id):
+    if not user.is_active:
+        return False
+    if user.is_superuser:
+        return True
+
+    roles, permission = ACTIONS[action]
+    if project_roles(user).get(project_id, set()).intersection(roles):
+        return True
+    return permission is not None and user.has_perm(permission)
+
+def visible_projects(user):
+    """
+    Returns the ids of the projects the user can view, or None for all.
+    """
+    if user.is_superuser:
+        return None
+    return project_roles(user).keys()
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend whose users and permission sets come from the cache, so
+    a logged in request costs no query to authenticate and templates
+    checking perms and permission_required cost none either once warm.
+    Saving or deleting a user drops its cached copy, and deactivated
+    users are logged out on their next request.
+
+    Without a SHARED_CACHE it reads the user on every request, like
+    ModelBackend.
+    """
+    def get_user(self, user_id):
+        if not SHARED_CACHE:
+            return super(CachedModelBackend, self).get_user(user_id)
+
+        key = USER_CACHE_KEY % user_id
+        user = cache.get(key)
+        if user is None:
+            try:
+                user = User.objects.get(pk=user_id)
+            except User.DoesNotExist:
+                return None
+            cache.set(key, user, PERMISSIONS_CACHE_TIMEOUT)
+
+        if not user.is_active:
+            return None
+        return user
+
+    def get_all_permissions(self, user_obj):
+        if user_obj.is_anonymous():
+            return set()
+        if not hasattr(user_obj, "_perm_cache"):
+            user_obj._perm_cache = cached(user_obj, "permissions", load_permissions)
+        return user_obj._perm_cache
+
+##### Project lookups
+
+_milestone_projects = {}
+
+def milestone_project(milestone_id):
+    """
+    A milestone never moves to another project, so the mapping is kept in
+    the process for the life of the worker.
+    """
+    if milestone_id not in _milestone_projects:
+        project_id = Milestone.objects.filter(id=milestone_id).values_list("project", flat=True)
+        if not project_id:
+            return None
+        _milestone_projects[milestone_id] = project_id[0]
+    return _milestone_projects[milestone_id]
+
+def task_project(task_id):
+    """
+    Tasks do move, so their project is cached under the task's version.
+    """
+    key = "projects:task_project:%s:%s" % (task_id, Task.objects.version(task_id))
+    project_id = cache.get(key)
+    if project_id is None:
+        project_id = Task.objects.filter(id=task_id).values_list("project", flat=True)
+        if not project_id:
+            return None
+        project_id = project_id[0]
+        cache.set(key, project_id, PERMISSIONS_CACHE_TIMEOUT)
+    return project_id
+
+def project_permission_required(action, post_action=None):
+    """
+    Lets the view run only if the user can do action on the project named
+    by its project_id, milestone_id or task_id argument, or post_action
+    for a POST when given; 404 when that does not exist, 403 when the
+    user may not.
+    """
+    def decorator(view):
+        def wrapped(request, *args, **kwargs):
+            if "project_id" in kwargs:
+                project_id = int(kwargs["project_id"])
+            elif "milestone_id" in kwargs:
+                project_id = milestone_project(int(kwargs["milestone_id"]))
+            else:
+                project_id = task_project(int(kwargs["task_id"]))
+
+            if project_id is None:
+                raise http.Http404()
+            if request.method == "POST" and post_action is not None:
+                allowed = can(request.user, post_action, project_id)
+            else:
+                allowed = can(request.user, action, project_id)
+            if not allowed:
+                return http.HttpResponseForbidden()
+            return view(request, *args, **kwargs)
+        return wraps(view)(wrapped)
+    return decorator
@@ -0,0 +1,27 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.dispatch import Signal
+
+# Sent when a user creates or edits a project, milestone or task. Unlike
+# post_save it carries who did it, and it is sent once per user action.
+changed = Signal(providing_args=["user", "instance", "created"])
+
+# Sent by TaskManager.save_changed with the TaskChangeSet rows it wrote,
+# each with its TaskChange rows in changeset.fields.
+history_logged = Signal(providing_args=["changesets"])
+
+# Sent by bulk edits instead of one changed signal per task, with the
+# (partially loaded) tasks they wrote to.
+bulk_changed = Signal(providing_args=["user", "instances"])
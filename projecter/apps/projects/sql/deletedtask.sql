@@ -0,0 +1 @@
+CREATE INDEX deleted_task_project_version ON deleted_task (project_id, version);
@@ -0,0 +1,8 @@
+-- Composite indexes for the project task listings. Django only indexes
+-- single foreign key columns.
+CREATE INDEX task_project_status ON task (project_id, status);
+CREATE INDEX task_project_is_open ON task (project_id, is_open);
+CREATE INDEX task_project_created_at ON task (project_id, created_at);
+CREATE INDEX task_users_user_task ON task_users (user_id, task_id);
+-- Range scans of the sync feed.
+CREATE INDEX task_project_version ON task (project_id, version, id);
@@ -0,0 +1 @@
+CREATE INDEX task_changeset_task_version ON task_changeset (task_id, version);
@@ -0,0 +1,1038 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import os
+import random
+import tempfile
+import threading
+import time
+from cStringIO import StringIO
+
+from django import http
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.utils import simplejson
+
+from projecter.apps.accounts.models import Company
+from projecter.apps.projects import api, benchmark, dump, filters, forecast, fragments, history, notify, permissions, workflow
+from projecter.apps.projects.bulk import bulk_insert
+from projecter.apps.projects.dataset import Dataset
+from projecter.apps.projects.pagination import InvalidCursor, TaskKeysetPaginator
+from projecter.apps.projects.models import Project, Milestone, MilestoneCounter, MilestoneForecast, MilestoneSnapshot, SavedFilter, SyncVersion, Task, TaskChange, TaskChangeSet
+from projecter.apps.projects import views
+from projecter.apps.projects.views import TaskForm
+
+class ProjectFixture(object):
+    """
+    A company with one project, two milestones and a manager, with the
+    cache and the in-process lookups emptied, since ids are reused
+    between tests.
+    """
+    def setUp(self):
+        cache.clear()
+        permissions._milestone_projects.clear()
+
+        self.user = User.objects.create_user("admin", "admin@example.com", "pw")
+        self.company = Company.objects.create(name="company")
+        self.project = Project.objects.create(name="project", company=self.company)
+        self.project.people.add(self.user)
+        self.project.managers.add(self.user)
+        self.milestone = Milestone.objects.create(project=self.project, name="milestone", description="")
+        self.other_milestone = Milestone.objects.create(project=self.project, name="other", description="")
+
+    def task(self, **kwargs):
+        values = {"name": "task", "description": "", "type": "bug", "priority": "normal", "status": "new",
+            "milestone": self.milestone, "duration": 1}
+        values.update(kwargs)
+        task = Task(**values)
+        task.save()
+        return task
+
+    def login(self):
+        self.assertTrue(self.client.login(username="admin", password="pw"))
+
+    def settle(self):
+        SyncVersion.objects.update(created_at=datetime.datetime(2000, 1, 1))
+
+    def get_json(self, url, data=None):
+        response = self.client.get(url, data or {})
+        self.assertEqual(response.status_code, 200)
+        return simplejson.loads(response.content)
+
+class WorkflowTest(TestCase):
+    def test_check_change(self):
+        workflow.check_change("bug", "new", "new")
+        workflow.check_change("bug", "review", "resolved")
+        self.assertRaises(workflow.InvalidTransition, workflow.check_change, "request", "review", "resolved")
+        self.assertRaises(workflow.InvalidTransition, workflow.check_change, "bug", "closed", "review")
+
+    def test_status_choices(self):
+        self.assertEqual([value for value, label in workflow.status_choices("bug", "closed")], ["new", "closed"])
+
+    def test_check_initial(self):
+        workflow.check_initial("bug", "new")
+        self.assertRaises(workflow.InvalidTransition, workflow.check_initial, "bug", "closed")
+
+class TransitionTest(ProjectFixture, TransactionTestCase):
+    def setUp(self):
+        super(TransitionTest, self).setUp()
+        self.tasks = [self.task(), self.task()]
+        self.tasks[1].status = "closed"
+        self.tasks[1].save()
+
+    def reload(self):
+        return [Task.objects.get(id=task.id) for task in self.tasks]
+
+    def test_new_task_status(self):
+        task = Task(name="task", description="", type="bug", priority="normal", status="closed",
+            milestone=self.milestone)
+        self.assertRaises(workflow.InvalidTransition, task.save)
+        self.assertEqual(TaskForm().fields["status"].choices, list(workflow.initial_choices()))
+
+    def test_save_changed_rejects(self):
+        new, closed = self.reload()
+        new.status = "process"
+        closed.status = "review"
+        self.assertRaises(workflow.InvalidTransition, Task.objects.save_changed, [new, closed], self.user, "edit")
+
+        self.assertEqual([task.status for task in self.reload()], ["new", "closed"])
+        self.assertEqual(TaskChangeSet.objects.count(), 0)
+
+    def test_bulk_change_rejects(self):
+        ids = [task.id for task in self.tasks]
+        self.assertRaises(workflow.InvalidTransition, Task.objects.bulk_change,
+            self.milestone.project_id, ids, self.user, {"status": "process"}, "bulk")
+
+        self.assertEqual([task.status for task in self.reload()], ["new", "closed"])
+        self.assertEqual(TaskChangeSet.objects.count(), 0)
+        self.assertEqual(TaskChange.objects.count(), 0)
+        counters = dict(MilestoneCounter.objects.filter(milestone=self.milestone).values_list("status", "tasks"))
+        self.assertEqual(counters.get("process", 0), 0)
+
+    def test_bulk_change_allowed(self):
+        ids = [task.id for task in self.tasks]
+        changesets = Task.objects.bulk_change(self.milestone.project_id, ids, self.user, {"status": "new"})
+
+        self.assertEqual(len(changesets), 1)
+        self.assertEqual([task.status for task in self.reload()], ["new", "new"])
+        self.assertEqual([task.is_open for task in self.reload()], [True, True])
+
+class SyncTest(ProjectFixture, TestCase):
+    def setUp(self):
+        super(SyncTest, self).setUp()
+        self.login()
+        self.tasks = [self.task() for i in range(3)]
+        # One bulk change gives the three tasks the same version.
+        Task.objects.bulk_change(self.project.id, [task.id for task in self.tasks], self.user, {"priority": "high"})
+        self.settle()
+        self.url = "/api/projects/%d/sync/" % self.project.id
+
+    def test_continues_within_a_version(self):
+        first = self.get_json(self.url, {"limit": 2})
+        self.assertTrue(first["more"])
+        self.assertEqual([task["id"] for task in first["tasks"]], [task.id for task in self.tasks[:2]])
+        version = Task.objects.get(id=self.tasks[0].id).version
+        self.assertEqual(first["next"], "%d-%d" % (version, self.tasks[1].id))
+
+        second = self.get_json(self.url, {"limit": 2, "since": first["next"]})
+        self.assertFalse(second["more"])
+        self.assertEqual([task["id"] for task in second["tasks"]], [self.tasks[2].id])
+
+        third = self.get_json(self.url, {"since": second["next"]})
+        self.assertEqual(third["tasks"], [])
+
+    def test_unsettled_writes_wait(self):
+        since = self.get_json(self.url)["next"]
+        self.task(name="fresh")
+        self.assertEqual(self.get_json(self.url, {"since": since})["tasks"], [])
+
+    def test_deleted_and_moved_tasks(self):
+        since = self.get_json(self.url)["next"]
+        other = Project.objects.create(name="other", company=self.company)
+        moved = Task.objects.get(id=self.tasks[0].id)
+        moved.milestone = Milestone.objects.create(project=other, name="elsewhere", description="")
+        moved.save()
+        Task.objects.get(id=self.tasks[1].id).delete()
+        self.settle()
+
+        data = self.get_json(self.url, {"since": since})
+        self.assertEqual(sorted(data["deleted"]), [self.tasks[0].id, self.tasks[1].id])
+
+    def test_bad_limits(self):
+        for limit in ("0", "-1", "x"):
+            request = http.HttpRequest()
+            request.GET = http.QueryDict("limit=%s" % limit)
+            self.assertRaises(http.Http404, api.sync_parameters, request)
+
+class PermissionTest(ProjectFixture, TestCase):
+    def setUp(self):
+        super(PermissionTest, self).setUp()
+        self.stranger = User.objects.create_user("stranger", "stranger@example.com", "pw")
+        self.task_ = self.task()
+        self.client.login(username="stranger", password="pw")
+
+    def status(self, url, data=None):
+        if data is None:
+            return self.client.get(url).status_code
+        return self.client.post(url, data).status_code
+
+    def edit(self):
+        return {"name": "edited", "type": "bug", "priority": "normal", "status": "new",
+            "milestone": self.milestone.id, "duration": 1, "users": [self.user.id], "comment": "edit"}
+
+    def test_non_members_are_refused(self):
+        for url in ("/projects/%d/" % self.project.id, "/milestones/%d/" % self.milestone.id,
+                "/tasks/%d/" % self.task_.id, "/api/projects/%d/" % self.project.id):
+            self.assertEqual(self.status(url), 403, url)
+        self.assertEqual(self.status("/tasks/%d/" % self.task_.id, self.edit()), 403)
+        self.assertEqual(self.status("/projects/%d/filters/" % self.project.id, {"name": "x", "query": ""}), 403)
+        self.assertEqual(Task.objects.get(id=self.task_.id).name, "task")
+
+    def test_people_read_and_managers_change(self):
+        self.project.people.add(self.stranger)
+        self.assertEqual(self.status("/tasks/%d/" % self.task_.id), 200)
+        self.assertEqual(self.status("/milestones/%d/" % self.milestone.id), 200)
+        self.assertEqual(self.status("/tasks/%d/" % self.task_.id, self.edit()), 403)
+        self.assertEqual(self.status("/projects/%d/add_task/" % self.project.id), 200)
+        self.assertEqual(self.status("/projects/%d/add_milestone/" % self.project.id), 403)
+
+        self.project.managers.add(self.stranger)
+        self.assertEqual(self.status("/tasks/%d/" % self.task_.id, self.edit()), 302)
+        self.assertEqual(Task.objects.get(id=self.task_.id).name, "edited")
+        self.assertEqual(self.status("/projects/%d/add_milestone/" % self.project.id), 200)
+
+    def test_cached_roles_follow_membership(self):
+        stranger = User.objects.get(id=self.stranger.id)
+        self.assertFalse(permissions.can(stranger, "view", self.project.id))
+        self.project.people.add(self.stranger)
+        # A new request gets a fresh user object, the cache has to follow.
+        stranger = User.objects.get(id=self.stranger.id)
+        self.assertTrue(permissions.can(stranger, "view", self.project.id))
+        self.project.people.remove(self.stranger)
+        stranger = User.objects.get(id=self.stranger.id)
+        self.assertFalse(permissions.can(stranger, "view", self.project.id))
+
+    def test_cached_user_follows_deactivation(self):
+        backend = permissions.CachedModelBackend()
+        self.assertEqual(backend.get_user(self.stranger.id).id, self.stranger.id)
+        self.stranger.is_active = False
+        self.stranger.save()
+        self.assertEqual(backend.get_user(self.stranger.id), None)
+
+class TaskEditTest(ProjectFixture, TestCase):
+    def setUp(self):
+        super(TaskEditTest, self).setUp()
+        self.login()
+        self.other = User.objects.create_user("other", "other@example.com", "pw")
+        self.task_ = self.task()
+        self.task_.users.add(self.user)
+
+    def test_edit_writes_one_changeset(self):
+        response = self.client.post("/tasks/%d/" % self.task_.id, {"name": "renamed", "type": "bug",
+            "priority": "urgent", "status": "process", "milestone": self.milestone.id, "duration": 1,
+            "users": [self.other.id], "comment": "moving on"})
+        self.assertEqual(response.status_code, 302)
+
+        task = Task.objects.get(id=self.task_.id)
+        self.assertEqual((task.name, task.priority, task.status), ("renamed", "urgent", "process"))
+        self.assertEqual([person.id for person in task.users.all()], [self.other.id])
+
+        changeset = TaskChangeSet.objects.get(task=task)
+        self.assertEqual(changeset.comment, "moving on")
+        changes = dict((change.field, (change.old_value, change.new_value)) for change in changeset.changes.all())
+        self.assertEqual(changes, {"name": ("task", "renamed"), "priority": ("normal", "urgent"),
+            "status": ("new", "process")})
+
+    def test_plain_save_writes_no_history(self):
+        self.task_.name = "quiet"
+        self.task_.save()
+        self.assertEqual(TaskChange.objects.count(), 0)
+
+class BuildChangesetsTest(ProjectFixture, TestCase):
+    def legacy(self, task, created_at, *fields):
+        bulk_insert(TaskChange, [TaskChange(task=task, user=self.user, created_at=created_at, field=field,
+            old_value="a", new_value=field == "comment" and "said so" or "b") for field in fields])
+
+    def test_groups_edits_across_chunks(self):
+        task = self.task()
+        first = datetime.datetime(2010, 1, 1, 12, 0)
+        second = datetime.datetime(2010, 1, 2, 12, 0)
+        # The first edit alone is larger than a chunk.
+        self.legacy(task, first, "name", "status", "priority", "duration", "comment")
+        self.legacy(task, second, "name")
+
+        call_command("build_changesets", chunk_size=2, verbosity=0)
+
+        changesets = list(TaskChangeSet.objects.filter(task=task).order_by("created_at"))
+        self.assertEqual([changeset.created_at for changeset in changesets], [first, second])
+        self.assertEqual(changesets[0].comment, "said so")
+        self.assertEqual(sorted(changesets[0].changes.values_list("field", flat=True)),
+            ["duration", "name", "priority", "status"])
+        self.assertEqual(changesets[1].changes.count(), 1)
+        self.assertFalse(TaskChange.objects.filter(changeset__isnull=True).exists())
+
+class ForecastTest(ProjectFixture, TestCase):
+    def workload(self, size, seed=0):
+        rng = random.Random(seed)
+        workers = [("user", number) for number in range(size)]
+        history = dict((worker, [rng.choice((0, 0, 1, 2, 4, 8)) for day in range(56)]) for worker in workers)
+        totals = dict((worker, rng.randint(10, 300)) for worker in workers)
+        return workers, totals, history
+
+    def test_steady_pace_is_exact(self):
+        workers = [("user", 1), ("user", 2), ("project", 1)]
+        totals = {("user", 1): 10, ("user", 2): 11, ("project", 1): 5}
+        history = {("user", 1): [2] * 56, ("user", 2): [2] * 56}
+        forecaster = forecast.Forecaster(runs=50)
+
+        expected = [[5] * 50, [6] * 50, [forecaster.horizon_days + 1] * 50]
+        self.assertEqual(forecaster.simulate_numpy(workers, totals, history).tolist(), expected)
+        self.assertEqual(forecaster.simulate_python(workers, totals, history), expected)
+
+    def test_numpy_agrees_with_python(self):
+        workers, totals, history = self.workload(20)
+        forecaster = forecast.Forecaster(runs=400, seed=7)
+        fast = forecaster.simulate_numpy(workers, totals, history)
+        slow = forecast.numpy.array(forecaster.simulate_python(workers, totals, history))
+
+        self.assertEqual(fast.tolist(), forecaster.simulate_numpy(workers, totals, history).tolist())
+        for percent in forecast.PERCENTILES:
+            a = forecast.numpy.percentile(fast, percent, axis=1)
+            b = forecast.numpy.percentile(slow, percent, axis=1)
+            self.assertTrue((abs(a - b) <= forecast.numpy.maximum(3, 0.1 * b)).all(), (percent, a, b))
+
+    def test_numpy_is_fast(self):
+        workers, totals, history = self.workload(200)
+        started = time.time()
+        forecast.Forecaster(runs=500).simulate_numpy(workers, totals, history)
+        self.assertTrue(time.time() - started < 1.0)
+
+    def test_run_and_store(self):
+        today = datetime.date.today()
+        for number in range(4):
+            task = self.task(duration=4)
+            task.users.add(self.user)
+        for task in Task.objects.all()[:2]:
+            task.status = "closed"
+            Task.objects.save_changed([task], self.user)
+        self.task(duration=3)
+
+        forecasts = forecast.Forecaster(runs=200, today=today).run(Milestone.objects.all())
+        result = forecasts[self.milestone.id]
+        self.assertEqual((result.remaining, result.workers), (11, 2))
+        # The project pool closed nothing alone but draws from every close.
+        self.assertTrue(today < result.dates[50] <= result.dates[85] <= result.dates[95])
+        self.assertEqual(forecasts[self.other_milestone.id].remaining, 0)
+
+        forecast.store(forecasts)
+        forecast.store(forecasts)
+        stored = MilestoneForecast.objects.get(milestone=self.milestone)
+        self.assertEqual((stored.remaining, stored.p50), (11, result.dates[50]))
+        self.assertEqual(MilestoneForecast.objects.count(), 2)
+
+        self.login()
+        self.assertContains(self.client.get("/milestones/%d/" % self.milestone.id), "Open work: 11 hours")
+
+class KeysetPaginationTest(ProjectFixture, TestCase):
+    def setUp(self):
+        super(KeysetPaginationTest, self).setUp()
+        for priority in ("low", "urgent", "high", "low", "normal", "urgent", "low"):
+            self.task(priority=priority)
+        # Equal creation times leave the ties to priority, status and id.
+        Task.objects.update(created_at=datetime.datetime(2010, 1, 1, 12, 0, 0, 500))
+        Task.objects.filter(id=Task.objects.order_by("id")[0].id).update(created_at=datetime.datetime(2010, 1, 2))
+        self.ordered = list(Task.objects.order_by("-created_at", "priority", "status", "id").values_list("id", flat=True))
+        self.paginator = TaskKeysetPaginator(Task.objects.all(), per_page=3)
+
+    def test_forward_visits_every_task_once(self):
+        seen, cursor, pages = [], None, 0
+        while True:
+            page = self.paginator.page(after=cursor)
+            seen.extend(task.id for task in page)
+            pages += 1
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+        self.assertEqual(seen, self.ordered)
+        self.assertEqual(pages, 3)
+
+    def test_backward_returns_the_previous_page(self):
+        first = self.paginator.page()
+        self.assertFalse(first.has_previous())
+        second = self.paginator.page(after=first.next_cursor)
+        back = self.paginator.page(before=second.prev_cursor)
+        self.assertEqual([task.id for task in back], self.ordered[:3])
+        self.assertEqual(back.next_cursor, first.next_cursor)
+
+    def test_cursor_round_trip(self):
+        task = Task.objects.get(id=self.ordered[4])
+        self.assertEqual(self.paginator.decode(self.paginator.encode(task)),
+            (task.created_at, task.priority, task.status, task.id))
+        self.assertEqual(self.paginator.encode(Task.objects.filter(id=task.id).values()[0]), self.paginator.encode(task))
+        for cursor in ("nonsense", "Zm9v", ""):
+            self.assertRaises(InvalidCursor, self.paginator.decode, cursor)
+
+    def test_attach_users(self):
+        task = Task.objects.get(id=self.ordered[0])
+        task.users.add(self.user)
+        tasks = Task.objects.attach_users(Task.objects.filter(id__in=self.ordered[:2]))
+        self.assertEqual(dict((task.id, task.assigned) for task in tasks),
+            {self.ordered[0]: [self.user], self.ordered[1]: []})
+
+class CounterTest(ProjectFixture, TestCase):
+    def counters(self, milestone):
+        return dict((counter.status, (counter.tasks, counter.duration))
+            for counter in MilestoneCounter.objects.filter(milestone=milestone) if counter.tasks)
+
+    def test_deltas(self):
+        task = self.task(duration=3)
+        self.task(duration=2)
+        self.assertEqual(self.counters(self.milestone), {"new": (2, 5)})
+
+        task.status = "closed"
+        task.duration = 4
+        task.save()
+        self.assertEqual(self.counters(self.milestone), {"new": (1, 2), "closed": (1, 4)})
+
+        task.milestone = self.other_milestone
+        task.save()
+        self.assertEqual(self.counters(self.milestone), {"new": (1, 2)})
+        self.assertEqual(self.counters(self.other_milestone), {"closed": (1, 4)})
+
+        progress = MilestoneCounter.objects.progress([self.milestone, self.other_milestone])
+        self.assertEqual((progress[self.milestone.id].open, progress[self.other_milestone.id].completed), (1, 1))
+
+        task.delete()
+        self.assertEqual(self.counters(self.other_milestone), {})
+
+    def test_rebuild(self):
+        self.task(duration=3)
+        self.task(duration=2, milestone=self.other_milestone)
+        expected = (self.counters(self.milestone), self.counters(self.other_milestone))
+
+        MilestoneCounter.objects.all().update(tasks=7, duration=7)
+        call_command("rebuild_counters", str(self.milestone.id), verbosity=0)
+        self.assertEqual(self.counters(self.milestone), expected[0])
+        self.assertEqual(self.counters(self.other_milestone), {"new": (7, 7)})
+
+        call_command("rebuild_counters", verbosity=0)
+        self.assertEqual((self.counters(self.milestone), self.counters(self.other_milestone)), expected)
+
+class ProjectIndexTest(ProjectFixture, TestCase):
+    def index(self):
+        return dict((project.id, (project.name, project.progress.total, project.progress.open))
+            for project in Project.objects.index())
+
+    def test_cached_until_invalidated(self):
+        self.task()
+        self.assertEqual(self.index(), {self.project.id: ("project", 1, 1)})
+
+        # Writes that skip the signals are not seen until an invalidation.
+        Project.objects.filter(id=self.project.id).update(name="renamed")
+        MilestoneCounter.objects.filter(milestone=self.milestone).update(tasks=5)
+        self.assertEqual(self.index(), {self.project.id: ("project", 1, 1)})
+
+        Project.objects.invalidate_stats(self.project.id)
+        self.assertEqual(self.index(), {self.project.id: ("project", 5, 5)})
+
+        Project.objects.invalidate_index()
+        self.assertEqual(self.index(), {self.project.id: ("renamed", 5, 5)})
+
+    def test_task_writes_invalidate_stats(self):
+        task = self.task()
+        self.index()
+
+        task.status = "closed"
+        task.save()
+        self.assertEqual(self.index(), {self.project.id: ("project", 1, 0)})
+
+        self.task()
+        self.assertEqual(self.index(), {self.project.id: ("project", 2, 1)})
+
+        task.delete()
+        self.assertEqual(self.index(), {self.project.id: ("project", 1, 1)})
+
+    def test_project_writes_invalidate_index(self):
+        self.index()
+        self.project.name = "renamed"
+        self.project.save()
+        self.assertEqual(self.index(), {self.project.id: ("renamed", 0, 0)})
+
+        project = Project.objects.create(name="second", company=self.company)
+        self.assertEqual(self.index()[project.id], ("second", 0, 0))
+
+class TaskProjectTest(ProjectFixture, TestCase):
+    def test_follows_the_milestone(self):
+        task = self.task()
+        self.assertEqual(Task.objects.get(id=task.id).project_id, self.project.id)
+
+        other = Project.objects.create(name="other", company=self.company)
+        task.milestone = Milestone.objects.create(project=other, name="elsewhere", description="")
+        task.save()
+        self.assertEqual(Task.objects.get(id=task.id).project_id, other.id)
+        self.assertEqual(list(Task.objects.filter(project=self.project)), [])
+
+    def test_backfill(self):
+        tasks = [self.task(), self.task(milestone=self.other_milestone), self.task()]
+        Task.objects.filter(id__in=[task.id for task in tasks[:2]]).update(project=None)
+
+        call_command("backfill_task_project", chunk_size=1, verbosity=0)
+        self.assertEqual(list(Task.objects.order_by("id").values_list("project", flat=True)),
+            [self.project.id] * 3)
+
+class FilterTest(ProjectFixture, TestCase):
+    def setUp(self):
+        super(FilterTest, self).setUp()
+        self.new = self.task(priority="high")
+        self.closed = self.task(priority="low", milestone=self.other_milestone)
+        self.closed.status = "closed"
+        self.closed.save()
+        self.mine = self.task(priority="low")
+        self.mine.users.add(self.user)
+
+    def matches(self, query):
+        form = filters.TaskFilterForm(filters.from_legacy(http.QueryDict(query)), self.user,
+            people=[self.user], milestones=[self.milestone, self.other_milestone])
+        return set(form.apply(Task.objects.all()).values_list("id", flat=True))
+
+    def test_apply(self):
+        self.assertEqual(self.matches("status=open"), set([self.new.id, self.mine.id]))
+        self.assertEqual(self.matches("status=open&status=closed&priority=low"), set([self.closed.id, self.mine.id]))
+        self.assertEqual(self.matches("assignee=me&priority=low"), set([self.mine.id]))
+        self.assertEqual(self.matches("milestone=%d" % self.other_milestone.id), set([self.closed.id]))
+        self.assertEqual(self.matches("created_before=2000-01-01"), set())
+
+    def test_invalid_values_are_left_out(self):
+        everything = set([self.new.id, self.closed.id, self.mine.id])
+        self.assertEqual(self.matches("status=bogus&milestone=0&created_after=never"), everything)
+        self.assertEqual(self.matches("priority=bogus&priority=high"), everything)
+
+    def test_legacy_links(self):
+        self.assertEqual(self.matches("filter=closed"), set([self.closed.id]))
+        self.assertEqual(self.matches("filter=assigned_to&target=%d" % self.user.id), set([self.mine.id]))
+        self.assertEqual(self.matches("filter=by_milestone&target=%d" % self.milestone.id), set([self.new.id, self.mine.id]))
+
+    def test_query_string(self):
+        form = filters.TaskFilterForm(http.QueryDict("type=bug&status=open&status=new&priority=bogus"), self.user)
+        self.assertEqual(form.query_string(), "status=open&status=new&type=bug")
+
+    def test_saved_filter_cache(self):
+        saved = SavedFilter.objects.create(user=self.user, project=self.project, name="low", query="priority=low")
+        tasks = lambda: Task.objects.filter(priority="low")
+        self.assertEqual(sorted(filters.cached_task_ids(saved, tasks())), sorted([self.closed.id, self.mine.id]))
+
+        # Unchanged while the project's version holds, then recomputed.
+        Task.objects.filter(id=self.new.id).update(priority="low")
+        self.assertEqual(len(filters.cached_task_ids(saved, tasks())), 2)
+        self.task(priority="low")
+        self.assertEqual(len(filters.cached_task_ids(saved, tasks())), 4)
+
+    def test_saved_filter_too_big(self):
+        saved = SavedFilter.objects.create(user=self.user, project=self.project, name="all", query="")
+        limit = filters.FILTER_CACHE_MAX_IDS
+        filters.FILTER_CACHE_MAX_IDS = 2
+        try:
+            self.assertEqual(filters.cached_task_ids(saved, Task.objects.all()), None)
+            self.assertEqual(len(filters.cached_task_ids(saved, Task.objects.filter(priority="low"))), 2)
+        finally:
+            filters.FILTER_CACHE_MAX_IDS = limit
+
+    def test_saved_filter_page(self):
+        self.login()
+        response = self.client.post("/projects/%d/filters/" % self.project.id, {"name": "mine", "query": "assignee=me"})
+        saved = SavedFilter.objects.get(user=self.user)
+        response = self.client.get("/projects/%d/" % self.project.id, {"saved": saved.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([task.id for task in response.context["tasks"]], [self.mine.id])
+
+class FragmentTest(ProjectFixture, TestCase):
+    def test_get_or_render(self):
+        calls = []
+        render = lambda: calls.append(1) or u"<p>%d</p>" % len(calls)
+
+        self.assertEqual(fragments.get_or_render("task_rows", (1, "a"), render), u"<p>1</p>")
+        self.assertEqual(fragments.get_or_render("task_rows", (1, "a"), render), u"<p>1</p>")
+        self.assertEqual(fragments.get_or_render("task_rows", (1, "b"), render), u"<p>2</p>")
+        self.assertEqual(fragments.stats()["task_rows"], (1, 2))
+
+        fragments.reset_stats()
+        self.assertEqual(fragments.stats()["task_rows"], (0, 0))
+
+    def test_versions(self):
+        task = self.task()
+        project, version = Project.objects.version(self.project.id), Task.objects.version(task.id)
+        self.assertEqual(Project.objects.version(self.project.id), project)
+
+        task.name = "renamed"
+        task.save()
+        self.assertNotEqual(Project.objects.version(self.project.id), project)
+        self.assertNotEqual(Task.objects.version(task.id), version)
+
+        project, version = Project.objects.version(self.project.id), Task.objects.version(task.id)
+        task.users.add(self.user)
+        self.assertNotEqual(Project.objects.version(self.project.id), project)
+        self.assertNotEqual(Task.objects.version(task.id), version)
+
+        project = Project.objects.version(self.project.id)
+        Milestone.objects.create(project=self.project, name="third", description="")
+        self.assertNotEqual(Project.objects.version(self.project.id), project)
+
+    def test_pages(self):
+        task = self.task(name="first")
+        self.login()
+        fragments.reset_stats()
+
+        self.client.get("/projects/%d/" % self.project.id)
+        self.client.get("/tasks/%d/" % task.id)
+        self.assertEqual(fragments.stats(), {"task_rows": (0, 1), "task_filters": (0, 1), "task_history": (0, 1)})
+
+        self.client.get("/projects/%d/" % self.project.id)
+        self.client.get("/tasks/%d/" % task.id)
+        self.assertEqual(fragments.stats(), {"task_rows": (1, 1), "task_filters": (1, 1), "task_history": (1, 1)})
+
+        task.name = "second"
+        task.save()
+        response = self.client.get("/projects/%d/" % self.project.id)
+        self.assertContains(response, "second")
+        self.assertEqual(fragments.stats()["task_rows"], (1, 2))
+
+class DumpTest(ProjectFixture, TestCase):
+    def setUp(self):
+        super(DumpTest, self).setUp()
+        self.member = User.objects.create_user("member", "member@example.com", "pw")
+        self.project.people.add(self.member)
+        self.tasks = [self.task(name="first", duration=3), self.task(name="second", milestone=self.other_milestone)]
+        self.tasks[0].users.add(self.member)
+
+        task = Task.objects.get(id=self.tasks[0].id)
+        task.status = "closed"
+        Task.objects.save_changed([task], self.member, "done")
+
+    def export(self, format, chunk_size=1):
+        stream = StringIO()
+        dump.Exporter(dump.FORMATS[format][1](stream), chunk_size=chunk_size).run()
+        return stream.getvalue()
+
+    def load(self, data, format, **kwargs):
+        importer = dump.Importer(chunk_size=1, **kwargs)
+        return importer.run(dump.FORMATS[format][0](StringIO(data)))
+
+    def snapshot(self, project):
+        tasks = []
+        for task in Task.objects.filter(project=project).order_by("name"):
+            changesets = [(changeset.user.username, changeset.comment,
+                sorted((change.field, change.old_value, change.new_value) for change in changeset.changes.all()))
+                for changeset in TaskChangeSet.objects.filter(task=task)]
+            tasks.append((task.name, task.milestone.name, task.status, task.is_open, task.duration,
+                sorted(user.username for user in task.users.all()), changesets))
+        counters = sorted(MilestoneCounter.objects.filter(milestone__project=project, tasks__gt=0).values_list(
+            "milestone__name", "status", "tasks", "duration"))
+        return (sorted(user.username for user in project.people.all()), tasks, counters)
+
+    def test_round_trip(self):
+        expected = self.snapshot(self.project)
+        dumps = [(format, self.export(format)) for format in ("jsonl", "csv")]
+        for format, data in dumps:
+            counts = self.load(data, format, rename=True)
+            self.assertEqual((counts["projects.project"], counts["projects.task"], counts.get("auth.user", 0)),
+                (1, 2, 0))
+
+            project = Project.objects.order_by("-id")[0]
+            self.assertNotEqual(project.id, self.project.id)
+            self.assertEqual(self.snapshot(project), expected)
+            self.assertEqual(set(Task.objects.filter(project=project).values_list("milestone__project", flat=True)),
+                set([project.id]))
+        self.assertEqual(list(Project.objects.order_by("id").values_list("name", flat=True)),
+            ["project", "project (2)", "project (3)"])
+
+    def test_new_users(self):
+        data = self.export("jsonl")
+        Project.objects.filter(id=self.project.id).update(name="old")
+        User.objects.filter(username="member").update(username="renamed")
+
+        counts = self.load(data, "jsonl")
+        self.assertEqual(counts["auth.user"], 1)
+        member = User.objects.get(username="member")
+        self.assertFalse(member.has_usable_password())
+        self.assertEqual(member.email, "member@example.com")
+        self.assertEqual(list(Project.objects.get(name="project").people.order_by("username")), [self.user, member])
+
+    def test_name_clashes(self):
+        data = self.export("jsonl")
+        importer = dump.Importer()
+        self.assertEqual(importer.clashes(dump.JsonLinesReader(StringIO(data))), ["project"])
+        self.assertRaises(dump.DumpError, self.load, data, "jsonl")
+        self.assertEqual(Project.objects.count(), 1)
+
+        fd, path = tempfile.mkstemp(suffix=".jsonl")
+        try:
+            os.write(fd, data)
+            os.close(fd)
+            call_command("import_projects", path, rename=True, verbosity=0)
+        finally:
+            os.remove(path)
+        self.assertEqual(Project.objects.filter(name="project (2)").count(), 1)
+
+    def test_broken_dumps(self):
+        self.assertRaises(dump.DumpError, self.load, '{"model": "projects.nothing"}\n', "jsonl")
+        self.assertRaises(dump.DumpError, self.load,
+            '{"model": "projects.milestone", "id": 1, "project": 999, "name": "x"}\n', "jsonl")
+
+class HistoryExportTest(ProjectFixture, TestCase):
+    def setUp(self):
+        super(HistoryExportTest, self).setUp()
+        self.other = self.task(name="other")
+        task = self.task(name="exported")
+        self.task_id = task.id
+
+        task = Task.objects.get(id=task.id)
+        task.status = "closed"
+        task.milestone = self.other_milestone
+        Task.objects.save_changed([task], self.user, "moved")
+        Task.objects.save_changed([Task.objects.get(id=task.id)], self.user, "just a note")
+
+    def test_rows(self):
+        rows = list(history.history_rows(self.project.id, chunk_size=1))
+        self.assertEqual([(row["task_name"], row["user"], row["field"], row["old_value"], row["new_value"], row["comment"])
+            for row in rows], [
+            ("exported", "admin", "status", "new", "closed", "moved"),
+            ("exported", "admin", "milestone", "milestone", "other", "moved"),
+            ("exported", "admin", None, None, None, "just a note"),
+        ])
+        self.assertEqual(rows[0]["changeset"], rows[1]["changeset"])
+        self.assertEqual(rows[2]["id"], None)
+
+        after = list(history.history_rows(self.project.id, after=rows[0]["changeset"]))
+        self.assertEqual(after, rows[2:])
+
+    def test_csv_pieces(self):
+        flush = history.FLUSH_SIZE
+        history.FLUSH_SIZE = 1
+        try:
+            pieces = list(history.csv_lines(history.history_rows(self.project.id)))
+        finally:
+            history.FLUSH_SIZE = flush
+        self.assertEqual(len(pieces), 3)
+        self.assertEqual(pieces[0].split("\r\n")[0], ",".join(history.COLUMNS))
+        self.assertTrue(pieces[2].endswith(",,,,just a note\r\n"))
+
+    def test_view(self):
+        self.login()
+        response = self.client.get("/projects/%d/history/" % self.project.id, {"format": "ndjson"})
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [simplejson.loads(line) for line in response.content.splitlines()]
+        self.assertEqual([row["field"] for row in rows], ["status", "milestone", None])
+
+        response = self.client.get("/projects/%d/history/" % self.project.id, {"after": rows[0]["changeset"]})
+        self.assertEqual(response.content.splitlines()[1:], [",".join([str(rows[2]["changeset"]), "",
+            rows[2]["created_at"], str(self.task_id), "exported", "admin", "", "", "", "just a note"])])
+
+class ApiTest(ProjectFixture, TestCase):
+    def setUp(self):
+        super(ApiTest, self).setUp()
+        self.tasks = [self.task(name="first"), self.task(name="second", priority="high")]
+        self.tasks[0].users.add(self.user)
+        self.login()
+
+    def queries(self, url, **extra):
+        """
+        Returns the response to a GET of url and the number of queries it
+        took.
+        """
+        debug = settings.DEBUG
+        settings.DEBUG = True
+        connection.queries = []
+        try:
+            response = self.client.get(url, **extra)
+            return response, len(connection.queries)
+        finally:
+            settings.DEBUG = debug
+
+    def test_not_modified_costs_no_queries(self):
+        for url in ("/api/projects/%d/" % self.project.id, "/api/projects/%d/tasks/" % self.project.id,
+                "/api/milestones/%d/" % self.milestone.id, "/api/tasks/%d/" % self.tasks[0].id):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+            response, queries = self.queries(url, HTTP_IF_NONE_MATCH=response["ETag"])
+            self.assertEqual((url, response.status_code, queries), (url, 304, 0))
+
+    def test_etag_follows_writes(self):
+        url = "/api/tasks/%d/" % self.tasks[0].id
+        tag = self.client.get(url)["ETag"]
+        self.assertNotEqual(self.client.get(url, {"fields": "id"})["ETag"], tag)
+
+        self.tasks[0].name = "renamed"
+        self.tasks[0].save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=tag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(simplejson.loads(response.content)["name"], "renamed")
+
+    def test_fields(self):
+        data = self.get_json("/api/tasks/%d/" % self.tasks[0].id, {"fields": "name,users,bogus"})
+        self.assertEqual(data, {"name": "first", "users": ["admin"]})
+
+        data = self.get_json("/api/projects/%d/" % self.project.id, {"fields": "progress"})
+        self.assertEqual((data["progress"]["total"], [milestone["name"] for milestone in data["milestones"]]),
+            (2, ["milestone", "other"]))
+
+    def test_task_list(self):
+        api_per_page = api.API_TASKS_PER_PAGE
+        api.API_TASKS_PER_PAGE = 1
+        try:
+            first = self.get_json("/api/projects/%d/tasks/" % self.project.id, {"fields": "name"})
+            second = self.get_json("/api/projects/%d/tasks/" % self.project.id, {"fields": "name", "after": first["next"]})
+        finally:
+            api.API_TASKS_PER_PAGE = api_per_page
+        self.assertEqual((first["tasks"], second["tasks"], second["next"]), ([{"name": "second"}], [{"name": "first"}], None))
+
+        data = self.get_json("/api/projects/%d/tasks/" % self.project.id, {"priority": "high", "fields": "id"})
+        self.assertEqual(data["tasks"], [{"id": self.tasks[1].id}])
+
+    def test_task_changes(self):
+        task = Task.objects.get(id=self.tasks[0].id)
+        task.status = "closed"
+        Task.objects.save_changed([task], self.user, "done")
+        Task.objects.save_changed([Task.objects.get(id=task.id)], self.user, "note")
+
+        data = self.get_json("/api/tasks/%d/changes/" % task.id)
+        self.assertEqual([(row["comment"], row["changes"]) for row in data["changes"]], [
+            ("done", [{"field": "status", "old_value": "new", "new_value": "closed"}]), ("note", [])])
+        data = self.get_json("/api/tasks/%d/changes/" % task.id, {"after": data["changes"][0]["id"]})
+        self.assertEqual([row["comment"] for row in data["changes"]], ["note"])
+
+class WaitTest(ProjectFixture, TestCase):
+    def setUp(self):
+        super(WaitTest, self).setUp()
+        self.task()
+        self.settle()
+        self.login()
+        self.url = "/api/projects/%d/wait/" % self.project.id
+
+    def test_local_notifier(self):
+        notifier = notify.LocalNotifier()
+        self.assertEqual(notifier.wait(1, 5, 10), 0)
+
+        started = time.time()
+        self.assertEqual(notifier.wait(1, 0, 0.05), 0)
+        self.assertTrue(time.time() - started >= 0.05)
+
+        threading.Timer(0.05, notifier.notify, [1]).start()
+        started = time.time()
+        self.assertEqual(notifier.wait(1, 0, 5), 1)
+        self.assertTrue(time.time() - started < 1)
+
+    def test_database_notifier(self):
+        notifier = notify.DatabaseNotifier(poll_interval=0.01)
+        seen = notifier.version(self.project.id)
+        self.assertEqual(seen, Task.objects.get().version)
+
+        task = self.task()
+        self.assertEqual(notifier.wait(self.project.id, seen, 1), task.version)
+        task.delete()
+        self.assertTrue(notifier.version(self.project.id) > task.version)
+
+    def test_answers_right_away(self):
+        started = time.time()
+        data = self.get_json(self.url, {"timeout": "5"})
+        self.assertEqual(len(data["tasks"]), 1)
+        self.assertTrue(time.time() - started < 1)
+
+    def test_times_out(self):
+        since = self.get_json(self.url)["next"]
+        interval = api.API_WAIT_POLL_INTERVAL
+        api.API_WAIT_POLL_INTERVAL = 0.01
+        try:
+            # An unsettled write is polled for, not handed out.
+            self.task(name="fresh")
+            started = time.time()
+            data = self.get_json(self.url, {"since": since, "timeout": "0.1"})
+        finally:
+            api.API_WAIT_POLL_INTERVAL = interval
+        self.assertTrue(time.time() - started >= 0.1)
+        self.assertEqual((data["tasks"], data["next"]), ([], since))
+
+class BenchmarkTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        permissions._milestone_projects.clear()
+
+    def test_percentile(self):
+        values = [5, 1, 4, 2, 3]
+        self.assertEqual([benchmark.percentile(values, fraction) for fraction in (0, 0.2, 0.5, 0.9, 1)], [1, 1, 3, 5, 5])
+        self.assertEqual(benchmark.percentile(range(1, 101), 0.99), 99)
+        self.assertEqual(benchmark.percentile([], 0.5), None)
+
+    def test_dataset_is_seeded(self):
+        records = lambda seed: list(Dataset.of_size("tiny", seed=seed).records())
+        self.assertEqual(records(1), records(1))
+        self.assertNotEqual(records(1), records(2))
+
+    def test_run(self):
+        call_command("generate_dataset", size="tiny", verbosity=0)
+        self.assertEqual(Task.objects.count(), 20)
+        for type, status in Task.objects.values_list("type", "status"):
+            self.assertTrue(status in [value for value, label in workflow.status_choices(type, status)])
+
+        results = benchmark.Benchmark(repeat=2).run()
+        self.assertEqual(results["projects_task:post"]["status"], [302])
+        for name, stats in results.items():
+            self.assertEqual((name, stats["requests"]), (name, 2))
+            self.assertTrue(set(stats["status"]) <= set([200, 302]), name)
+            self.assertTrue(stats["p50_ms"] <= stats["p99_ms"] <= stats["max_ms"])
+
+class BulkChangeTest(ProjectFixture, TestCase):
+    def setUp(self):
+        super(BulkChangeTest, self).setUp()
+        self.member = User.objects.create_user("member", "member@example.com", "pw")
+        self.project.people.add(self.member)
+        self.tasks = [self.task(duration=2), self.task(duration=3), self.task(priority="high")]
+        self.tasks[0].users.add(self.member)
+        self.ids = [task.id for task in self.tasks]
+
+    def changes(self, changeset):
+        return sorted((change.field, change.old_value, change.new_value) for change in changeset.changes.all())
+
+    def test_bulk_change(self):
+        other = Project.objects.create(name="other", company=self.company)
+        outsider = self.task(milestone=Milestone.objects.create(project=other, name="elsewhere", description=""))
+
+        changesets = Task.objects.bulk_change(self.project.id, self.ids + [outsider.id], self.user,
+            {"priority": "high", "milestone": self.other_milestone.id, "users": [self.member]}, "moving")
+        self.assertEqual(sorted(changeset.task_id for changeset in changesets), self.ids)
+
+        tasks = Task.objects.in_bulk(self.ids)
+        self.assertEqual(set((task.priority, task.milestone_id) for task in tasks.values()),
+            set([("high", self.other_milestone.id)]))
+        self.assertEqual([list(tasks[id].users.all()) for id in self.ids], [[self.member]] * 3)
+        self.assertEqual(len(set(task.version for task in tasks.values())), 1)
+        self.assertEqual(Task.objects.get(id=outsider.id).priority, "normal")
+
+        saved = TaskChangeSet.objects.filter(task__in=self.ids)
+        self.assertEqual(set(changeset.comment for changeset in saved), set(["moving"]))
+        self.assertEqual(self.changes(saved.get(task=self.ids[0])), [
+            ("milestone", str(self.milestone.id), str(self.other_milestone.id)), ("priority", "normal", "high")])
+        self.assertEqual(self.changes(saved.get(task=self.ids[2])), [
+            ("milestone", str(self.milestone.id), str(self.other_milestone.id)), ("users", "", "member")])
+
+        progress = MilestoneCounter.objects.progress([self.milestone, self.other_milestone])
+        self.assertEqual((progress[self.milestone.id].total, progress[self.other_milestone.id].duration), (0, 6))
+
+    def test_unchanged_tasks_are_left_alone(self):
+        changesets = Task.objects.bulk_change(self.project.id, self.ids, self.user, {"priority": "high"})
+        self.assertEqual(sorted(changeset.task_id for changeset in changesets), self.ids[:2])
+        self.assertEqual(TaskChangeSet.objects.filter(task=self.ids[2]).count(), 0)
+
+    def test_view(self):
+        self.login()
+        url = "/projects/%d/tasks/bulk/" % self.project.id
+        response = self.client.post(url, {"tasks": self.ids[:2], "status": "closed", "assignee": self.user.id,
+            "query": "status=open"})
+        self.assertEqual(response["Location"], "http://testserver/projects/%d/?status=open" % self.project.id)
+        self.assertEqual([task.status for task in Task.objects.order_by("id")], ["closed", "closed", "new"])
+        self.assertEqual(list(Task.objects.get(id=self.ids[0]).users.all()), [self.user])
+
+        self.client.post(url, {"tasks": self.ids[2:]})
+        self.client.post(url, {"tasks": self.ids[2:], "status": "review"})
+        self.assertEqual(Task.objects.get(id=self.ids[2]).status, "new")
+        self.assertEqual(TaskChangeSet.objects.filter(task=self.ids[2]).count(), 0)
+
+        limit = views.BULK_MAX_TASKS
+        views.BULK_MAX_TASKS = 1
+        try:
+            self.client.post(url, {"tasks": self.ids[2:] + [self.ids[1]], "priority": "low"})
+        finally:
+            views.BULK_MAX_TASKS = limit
+        self.assertEqual(Task.objects.get(id=self.ids[2]).priority, "high")
+
+class SnapshotTest(ProjectFixture, TestCase):
+    def setUp(self):
+        super(SnapshotTest, self).setUp()
+        self.day = datetime.date(2010, 3, 1)
+        self.tasks = [self.task(duration=2), self.task(duration=3)]
+
+    def days(self, count):
+        return [self.day + datetime.timedelta(days=days) for days in range(count)]
+
+    def snapshots(self, milestone):
+        return list(MilestoneSnapshot.objects.filter(milestone=milestone).order_by("day", "status").values_list(
+            "day", "status", "tasks", "duration"))
+
+    def edit(self):
+        closed = Task.objects.get(id=self.tasks[0].id)
+        closed.status = "closed"
+        moved = Task.objects.get(id=self.tasks[1].id)
+        moved.milestone = self.other_milestone
+        Task.objects.save_changed([closed, moved], self.user, "edit")
+
+    def test_follows_the_counters(self):
+        self.edit()
+        today = datetime.date.today()
+        self.assertEqual(self.snapshots(self.milestone), [(today, "closed", 1, 2), (today, "new", 0, 0)])
+        self.assertEqual(self.snapshots(self.other_milestone), [(today, "new", 1, 3)])
+
+    def test_rebuild(self):
+        self.edit()
+        Task.objects.update(created_at=datetime.datetime.combine(self.day, datetime.time(10)))
+        TaskChange.objects.update(created_at=datetime.datetime.combine(self.days(2)[1], datetime.time(10)))
+
+        call_command("rebuild_snapshots", verbosity=0)
+        first, second = self.days(2)
+        self.assertEqual(self.snapshots(self.milestone), [(first, "new", 2, 5), (second, "closed", 1, 2),
+            (second, "new", 0, 0)])
+        self.assertEqual(self.snapshots(self.other_milestone), [(second, "new", 1, 3)])
+
+        # Rebuilding one milestone leaves the others alone.
+        MilestoneSnapshot.objects.filter(milestone=self.other_milestone).update(tasks=9)
+        call_command("rebuild_snapshots", str(self.milestone.id), chunk_size=1, verbosity=0)
+        self.assertEqual(len(self.snapshots(self.milestone)), 3)
+        self.assertEqual(self.snapshots(self.other_milestone), [(second, "new", 9, 3)])
+
+    def test_series(self):
+        MilestoneSnapshot.objects.all().delete()
+        first, second, third, fourth = self.days(4)
+        for day, status, tasks, duration in ((first, "new", 2, 5), (third, "new", 1, 3), (third, "closed", 1, 2)):
+            MilestoneSnapshot.objects.create(milestone=self.milestone, day=day, status=status, tasks=tasks, duration=duration)
+
+        series = MilestoneSnapshot.objects.series(self.milestone.id, second, fourth)
+        self.assertEqual([(row["day"], row["open"], row["remaining"], row["tasks"]["closed"]) for row in series],
+            [(second, 2, 5, 0), (third, 1, 3, 1), (fourth, 1, 3, 1)])
+
+        series = MilestoneSnapshot.objects.series(self.milestone.id, first - datetime.timedelta(days=1), first)
+        self.assertEqual([row["open"] for row in series], [0, 2])
+
+    def test_series_bounds(self):
+        self.login()
+        data = self.get_json("/api/milestones/%d/series/" % self.milestone.id)
+        self.assertEqual(len(data), api.API_SERIES_DAYS)
+        self.assertEqual((data[-1]["day"], data[-1]["open"]), (datetime.date.today().isoformat(), 2))
+
+        request = http.HttpRequest()
+        request.user = self.user
+        for query in ("start=2010-03-02&end=2010-03-01", "start=2000-01-01&end=2010-03-01", "start=March"):
+            request.GET = http.QueryDict(query)
+            self.assertRaises(http.Http404, api.api_milestone_series, request, milestone_id=str(self.milestone.id))
+
+    def test_history_shows_milestone_names(self):
+        self.edit()
+        self.login()
+        response = self.client.get("/tasks/%d/" % self.tasks[1].id)
+        self.assertContains(response, "milestone")
+        self.assertContains(response, "other")
+        self.assertNotContains(response, ">%d<" % self.other_milestone.id)
@@ -3,10 +3,25 @@ from django.conf.urls.defaults import *
 urlpatterns = patterns('projecter.apps.projects.views',
     (r'^projects/$', 'projects_index'),
     (r'^projects/add/$', 'projects_add'),
-    (r'^projects/(?P<project_id>\d+)/$', 'projects_project'),
+    url(r'^projects/(?P<project_id>\d+)/$', 'projects_project', name='project_detail'),
     (r'^projects/(?P<project_id>\d+)/edit/$', 'projects_edit'),
     (r'^projects/(?P<project_id>\d+)/add_task/$', 'projects_task_add'),
     (r'^projects/(?P<project_id>\d+)/add_milestone/$', 'projects_milestone_add'),
-    (r'^tasks/(?P<task_id>\d+)/$', 'projects_task'),
-    (r'^milestones/(?P<milestone_id>\d+)/$', 'projects_milestone'),
+    (r'^projects/(?P<project_id>\d+)/filters/$', 'projects_filter_save'),
+    (r'^projects/(?P<project_id>\d+)/filters/(?P<filter_id>\d+)/delete/$', 'projects_filter_delete'),
+    (r'^projects/(?P<project_id>\d+)/history/$', 'projects_history_export'),
+    (r'^projects/(?P<project_id>\d+)/tasks/bulk/$', 'projects_task_bulk'),
+    url(r'^tasks/(?P<task_id>\d+)/$', 'projects_task', name='task_detail'),
+    url(r'^milestones/(?P<milestone_id>\d+)/$', 'projects_milestone', name='milestone_detail'),
+)
+
+urlpatterns += patterns('projecter.apps.projects.api',
+    (r'^api/projects/(?P<project_id>\d+)/$', 'api_project'),
+    (r'^api/projects/(?P<project_id>\d+)/tasks/$', 'api_project_tasks'),
+    (r'^api/projects/(?P<project_id>\d+)/sync/$', 'api_project_sync'),
+    (r'^api/projects/(?P<project_id>\d+)/wait/$', 'api_project_wait'),
+    (r'^api/milestones/(?P<milestone_id>\d+)/$', 'api_milestone'),
+    (r'^api/milestones/(?P<milestone_id>\d+)/series/$', 'api_milestone_series'),
+    (r'^api/tasks/(?P<task_id>\d+)/$', 'api_task'),
+    (r'^api/tasks/(?P<task_id>\d+)/changes/$', 'api_task_changes'),
 )
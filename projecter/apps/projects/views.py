@@ -17,15 +17,29 @@ import logging
 from django import http
 from django.conf import settings
 from django.template import RequestContext
+from django.template.loader import render_to_string
 
 from django.shortcuts import render_to_response, get_object_or_404
+from django.core.paginator import Paginator, InvalidPage
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, permission_required
 from django.views.decorators.cache import cache_page
 from django.utils.translation import ugettext as _
+from django.utils.http import urlencode
+from django.http import QueryDict
+from django.db.models import Q
+from django.contrib.auth.models import User
 from django import forms
 
-from projecter.apps.projects.models import Project, Milestone, Task, TaskChange
+from projecter.apps.projects import fragments, history, signals, workflow
+from projecter.apps.projects.models import Project, Milestone, MilestoneCounter, MilestoneForecast, SavedFilter, Task, TaskChange, TaskChangeSet
+from projecter.apps.projects.filters import TaskFilterForm, from_legacy, cached_task_ids
+from projecter.apps.projects.pagination import TaskKeysetPaginator, InvalidCursor
+from projecter.apps.projects.permissions import project_permission_required
+
+TASKS_PER_PAGE = getattr(settings, "PROJECTER_TASKS_PER_PAGE", 50)
+CHANGESETS_PER_PAGE = getattr(settings, "PROJECTER_CHANGESETS_PER_PAGE", 25)
+BULK_MAX_TASKS = getattr(settings, "PROJECTER_BULK_MAX_TASKS", 1000)
 
 ##### Forms
 
@@ -38,6 +52,11 @@ class MilestoneForm(forms.ModelForm):
         model = Milestone
         exclude = ("project",)
 
+class SavedFilterForm(forms.ModelForm):
+    class Meta:
+        model = SavedFilter
+        fields = ("name", "query")
+
 class BaseTaskForm(forms.ModelForm):
     milestone = forms.ModelChoiceField(queryset=None, widget=forms.Select())
 
@@ -45,6 +64,10 @@ class BaseTaskForm(forms.ModelForm):
         self.fields["milestone"].queryset = milestones
 
 class TaskForm(BaseTaskForm):
+    def __init__(self, *args, **kwargs):
+        super(TaskForm, self).__init__(*args, **kwargs)
+        self.fields["status"].choices = workflow.initial_choices()
+
     class Meta:
         model = Task
         exclude = ("changed_at",)
@@ -52,23 +75,72 @@ class TaskForm(BaseTaskForm):
 class TaskChangeForm(BaseTaskForm):
     comment = forms.CharField(required=True, widget=forms.Textarea())
 
+    def set_statuses(self, task):
+        """
+        Offers only the statuses the task's workflow allows from its
+        current one.
+        """
+        self.fields["status"].choices = workflow.status_choices(task.type, task.status)
+
     class Meta:
         model = Task
         exclude = ("description", "changed_at",)
 
+class TaskBulkForm(forms.Form):
+    """
+    One change applied to every selected task: any of a new status,
+    priority, milestone or assignee, with a comment for all of them.
+    """
+    tasks = forms.Field(widget=forms.MultipleHiddenInput())
+    status = forms.ChoiceField(required=False, choices=(("", "---------"),) + workflow.TASK_STATUS)
+    priority = forms.ChoiceField(required=False, choices=(("", "---------"),) + workflow.TASK_PRIORITY)
+    milestone = forms.ModelChoiceField(queryset=None, required=False)
+    assignee = forms.ModelChoiceField(queryset=None, required=False)
+    comment = forms.CharField(required=False, widget=forms.Textarea())
+
+    def __init__(self, project, *args, **kwargs):
+        super(TaskBulkForm, self).__init__(*args, **kwargs)
+        self.fields["milestone"].queryset = Milestone.objects.filter(project=project)
+        self.fields["assignee"].queryset = User.objects.filter(
+            Q(project_people=project) | Q(project_managers=project)).distinct()
+
+    def clean_tasks(self):
+        try:
+            ids = set(int(id) for id in self.cleaned_data["tasks"])
+        except (TypeError, ValueError), err:
+            raise forms.ValidationError(_("Invalid task selection."))
+        if len(ids) > BULK_MAX_TASKS:
+            raise forms.ValidationError(_("Select at most %d tasks.") % BULK_MAX_TASKS)
+        return list(ids)
+
+    def clean(self):
+        if not self._errors and not self.values():
+            raise forms.ValidationError(_("Choose a change to apply."))
+        return self.cleaned_data
+
+    def values(self):
+        """
+        Returns the changes to pass to Task.objects.bulk_change().
+        """
+        values = {}
+        for field in ("status", "priority"):
+            if self.cleaned_data.get(field):
+                values[field] = self.cleaned_data[field]
+        if self.cleaned_data.get("milestone"):
+            values["milestone"] = self.cleaned_data["milestone"].id
+        if self.cleaned_data.get("assignee"):
+            values["users"] = [self.cleaned_data["assignee"]]
+        return values
+
 ##### Views
 
 @login_required
 def projects_index(request, template="templates/projects/index.html"):
-    order_map = {
-        "name": "name",
-        "company": "company"
-    }
-    request_order = request.GET.get("order", "name")    
-    if request_order in order_map:
-        projects = Project.objects.order_by(order_map[request_order])
-    else:
-        projects = Project.objects.all()
+    request_order = request.GET.get("order", "name")
+    if request_order not in Project.objects.ORDERING:
+        request_order = "name"
+
+    projects = Project.objects.index(request_order)
 
     return render_to_response(template, RequestContext(request, {
         "projects": projects
@@ -79,7 +151,8 @@ def projects_add(request, template="templates/projects/add.html"):
     if request.method == "POST":
         form = ProjectForm(request.POST)
         if form.is_valid():
-            form.save()
+            project = form.save()
+            signals.changed.send(sender=Project, user=request.user, instance=project, created=True)
 
             messages.success(request, _("Project has been created."))
 
@@ -89,7 +162,8 @@ def projects_add(request, template="templates/projects/add.html"):
 
     return render_to_response(template, RequestContext(request, locals()))
 
-@permission_required("project.change_project", login_url="/permission_required/")
+@login_required
+@project_permission_required("change")
 def projects_edit(request, project_id, template="templates/projects/add.html"):
     project = get_object_or_404(Project, id=project_id)
 
@@ -97,6 +171,7 @@ def projects_edit(request, project_id, template="templates/projects/add.html"):
         form = ProjectForm(request.POST, instance=project)
         if form.is_valid():
             form.save()
+            signals.changed.send(sender=Project, user=request.user, instance=project, created=False)
 
             messages.success(request, _("Project has been succesfully edited."))
 
@@ -107,54 +182,206 @@ def projects_edit(request, project_id, template="templates/projects/add.html"):
     return render_to_response(template, RequestContext(request, locals()))
 
 @login_required
+@project_permission_required("view")
 def projects_project(request, project_id, template="templates/projects/project.html"):
     project = get_object_or_404(Project, id=project_id)
-    milestones = Milestone.objects.filter(project=project)
+    milestones = list(Milestone.objects.filter(project=project))
+
+    progress = MilestoneCounter.objects.progress(milestones)
+    for milestone in milestones:
+        milestone.progress = progress[milestone.id]
+
+    people = list(project.people.all())
+    saved_filters = SavedFilter.objects.filter(project=project, user=request.user)
+
+    saved_filter = None
+    if "saved" in request.GET:
+        try:
+            saved_filter = saved_filters.get(id=int(request.GET["saved"]))
+        except (ValueError, SavedFilter.DoesNotExist), err:
+            raise http.Http404()
+        data = QueryDict(saved_filter.query.encode("utf-8"))
+    else:
+        data = from_legacy(request.GET)
+
+    filter_form = TaskFilterForm(data, request.user, people, milestones)
+    tasks = filter_form.apply(Task.objects.filter(project=project))
 
-    request_filter = request.GET.get("filter") 
-    try:    
-        request_target = int(request.GET.get("target"))
-    except (TypeError, ValueError), err:
-        request_target = 0
-   
-    filter_map = {
-        "upcoming": Task.objects.filter(milestone__project=project).exclude(status="closed"),
-        "closed": Task.objects.filter(milestone__project=project, status="closed"),
-        "assigned_to_me": Task.objects.filter(milestone__project=project, users=request.user),
-        "assigned_to": Task.objects.filter(milestone__project=project, users__id=request_target),
-        "by_milestone": Task.objects.filter(milestone__project=project, milestone__id=request_target)
-    }
-
-    if request_filter in filter_map:
-        tasks = filter_map[request_filter]
+    if saved_filter:
+        filter_query = urlencode({"saved": saved_filter.id})
     else:
-        tasks = Task.objects.filter(milestone__project=project)
+        filter_query = filter_form.query_string()
+
+    after, before = request.GET.get("after"), request.GET.get("before")
+
+    def render_tasks():
+        task_list = tasks
+        if saved_filter:
+            ids = cached_task_ids(saved_filter, task_list)
+            if ids is not None:
+                task_list = Task.objects.filter(id__in=ids)
+
+        paginator = TaskKeysetPaginator(task_list.select_related("milestone"), per_page=TASKS_PER_PAGE)
+        try:
+            page = paginator.page(after=after, before=before)
+        except InvalidCursor, err:
+            raise http.Http404()
+        Task.objects.attach_users(page.object_list)
+
+        return render_to_string("templates/projects/task_rows.html", {
+            "tasks": page,
+            "filter_query": filter_query
+        })
+
+    def render_filters():
+        return render_to_string("templates/projects/task_filters.html", {
+            "filter_form": filter_form
+        })
+
+    version = Project.objects.version(project.id)
+    tasks_html = fragments.get_or_render("task_rows",
+        (project.id, version, request.user.id, filter_query, after, before), render_tasks)
+    filters_html = fragments.get_or_render("task_filters",
+        (project.id, version, filter_query), render_filters)
 
     return render_to_response(template, RequestContext(request, {
         "project": project,
         "milestones": milestones,
-        "tasks": tasks
+        "people": people,
+        "managers": project.managers.all(),
+        "tasks_html": tasks_html,
+        "filters_html": filters_html,
+        "filter_query": filter_query,
+        "saved_filters": saved_filters,
+        "saved_filter": saved_filter,
+        "task_status": workflow.TASK_STATUS,
+        "task_priority": workflow.TASK_PRIORITY
     }))
 
 @login_required
+@project_permission_required("change")
+def projects_filter_save(request, project_id):
+    project = get_object_or_404(Project, id=project_id)
+
+    if request.method != "POST":
+        return http.HttpResponseNotAllowed(["POST"])
+
+    form = SavedFilterForm(request.POST)
+    if not form.is_valid():
+        messages.error(request, _("The filter needs a name."))
+        return http.HttpResponseRedirect("/projects/%d/?%s" % (project.id, request.POST.get("query", "")))
+
+    saved_filter = form.save(commit=False)
+    saved_filter.user = request.user
+    saved_filter.project = project
+    saved_filter.save()
+
+    messages.success(request, _("Filter saved."))
+
+    return http.HttpResponseRedirect("/projects/%d/?saved=%d" % (project.id, saved_filter.id))
+
+@login_required
+@project_permission_required("change")
+def projects_filter_delete(request, project_id, filter_id):
+    saved_filter = get_object_or_404(SavedFilter, id=filter_id, project=project_id, user=request.user)
+
+    if request.method != "POST":
+        return http.HttpResponseNotAllowed(["POST"])
+
+    saved_filter.delete()
+
+    messages.success(request, _("Filter deleted."))
+
+    return http.HttpResponseRedirect("/projects/%d/" % saved_filter.project_id)
+
+@login_required
+@project_permission_required("change")
+def projects_task_bulk(request, project_id):
+    """
+    Applies the change picked below the task list to every task ticked in
+    it, with one UPDATE and one batch of history for all of them.
+    """
+    project = get_object_or_404(Project, id=project_id)
+
+    if request.method != "POST":
+        return http.HttpResponseNotAllowed(["POST"])
+
+    redirect = "/projects/%d/" % project.id
+    if request.POST.get("query"):
+        redirect += "?" + request.POST["query"]
+
+    form = TaskBulkForm(project, request.POST)
+    if not form.is_valid():
+        for errors in form.errors.values():
+            for error in errors:
+                messages.error(request, error)
+        return http.HttpResponseRedirect(redirect)
+
+    try:
+        changesets = Task.objects.bulk_change(project.id, form.cleaned_data["tasks"], request.user,
+            form.values(), form.cleaned_data["comment"] or None)
+    except workflow.InvalidTransition, err:
+        messages.error(request, err.args[0])
+        return http.HttpResponseRedirect(redirect)
+
+    messages.success(request, _("%d tasks modified.") % len(changesets))
+
+    return http.HttpResponseRedirect(redirect)
+
+@login_required
+@project_permission_required("view")
+def projects_history_export(request, project_id):
+    """
+    Streams the change history of the project as CSV or NDJSON. After a
+    dropped download, ?after=<changeset of the last complete changeset
+    received> picks up where it stopped.
+    """
+    project = get_object_or_404(Project, id=project_id)
+
+    format = request.GET.get("format", "csv")
+    try:
+        after = int(request.GET.get("after", 0))
+    except ValueError, err:
+        raise http.Http404()
+
+    rows = history.history_rows(project.id, after)
+    if format == "csv":
+        response = http.HttpResponse(history.csv_lines(rows), mimetype="text/csv; charset=utf-8")
+    elif format == "ndjson":
+        response = http.HttpResponse(history.ndjson_lines(rows), mimetype="application/x-ndjson")
+    else:
+        raise http.Http404()
+
+    response["Content-Disposition"] = "attachment; filename=project-%d-history.%s" % (project.id, format)
+    return response
+
+@login_required
+@project_permission_required("view")
 def projects_milestone(request, milestone_id, template="templates/projects/milestone.html"):
-    milestone = get_object_or_404(Milestone, id=milestone_id)
-    tasks_total = Task.objects.filter(milestone=milestone).count()
-    tasks_completed = Task.objects.filter(milestone=milestone, status="closed").count()
+    milestone = get_object_or_404(Milestone.objects.select_related("project"), id=milestone_id)
+    progress = MilestoneCounter.objects.progress([milestone])[milestone.id]
+    tasks_total = progress.total
+    tasks_completed = progress.completed
 
     try: 
         graph_size = (float(tasks_completed)/float(tasks_total))*98
     except ZeroDivisionError, err:
         graph_size = -2
 
+    # Computed by manage.py forecast_milestones, never here.
+    forecasts = list(MilestoneForecast.objects.filter(milestone=milestone)[:1])
+
     return render_to_response(template, RequestContext(request, {
         "milestone": milestone,
+        "forecast": forecasts and forecasts[0] or None,
+        "progress": progress,
         "tasks_total": int(tasks_total),
         "tasks_completed": int(tasks_completed),
         "graph_size": graph_size+2,
     }))
 
-@permission_required("milestone.add_milestone", login_url="/permission_required/")
+@login_required
+@project_permission_required("add_milestone")
 def projects_milestone_add(request, project_id, template="templates/projects/milestone_add.html"):
     project = get_object_or_404(Project, id=project_id)
     
@@ -164,6 +391,7 @@ def projects_milestone_add(request, project_id, template="templates/projects/mil
             _form = form.save(commit=False)
             _form.project = project
             _form.save()
+            signals.changed.send(sender=Milestone, user=request.user, instance=_form, created=True)
 
             messages.success(request, _("Milestone added."))
 
@@ -176,19 +404,36 @@ def projects_milestone_add(request, project_id, template="templates/projects/mil
     }))
 
 @login_required
+@project_permission_required("view", post_action="change")
 def projects_task(request, task_id, template="templates/projects/task.html"):
-    task = get_object_or_404(Task, id=task_id)
+    task = get_object_or_404(Task.objects.select_related("milestone__project"), id=task_id)
+
+    request_history = request.GET.get("history", "last")
+
+    def render_history():
+        paginator = Paginator(TaskChangeSet.objects.for_task(task), CHANGESETS_PER_PAGE)
+        try:
+            history = paginator.page(paginator.num_pages if request_history == "last" else request_history)
+        except InvalidPage, err:
+            raise http.Http404()
+        changes = TaskChangeSet.objects.attach_changes(history.object_list)
 
-    changes = TaskChange.objects.grouped(task)
-    milestones = Milestone.objects.filter(project=task.milestone.project)
+        return render_to_string("templates/projects/task_history.html", {
+            "changes": changes,
+            "history": history
+        })
+
+    milestones = Milestone.objects.filter(project=task.milestone.project_id)
 
     if request.method == "POST":
         form = TaskChangeForm(request.POST, instance=task)
         form.set_milestones(milestones)
+        form.set_statuses(task)
 
         if form.is_valid():
             _task = form.save(commit=False)
             _task.save(request, form.cleaned_data["comment"])
+            form.save_m2m()
 
             messages.success(request, _("Task modified."))
 
@@ -196,14 +441,19 @@ def projects_task(request, task_id, template="templates/projects/task.html"):
     else:
         form = TaskChangeForm(instance=task)
         form.set_milestones(milestones)
+        form.set_statuses(task)
+
+    history_html = fragments.get_or_render("task_history",
+        (task.id, Task.objects.version(task.id), request_history), render_history)
 
     return render_to_response(template, RequestContext(request, {
         "task": task,
-        "changes": changes,
+        "history_html": history_html,
         "form": form
     }))
 
 @login_required
+@project_permission_required("add_task")
 def projects_task_add(request, project_id, template="templates/projects/task_add.html"):
     project = get_object_or_404(Project, id=project_id)
     milestones = Milestone.objects.filter(project=project)
@@ -213,7 +463,8 @@ def projects_task_add(request, project_id, template="templates/projects/task_add
         form.set_milestones(milestones.all())
 
         if form.is_valid():
-            form.save()
+            task = form.save()
+            signals.changed.send(sender=Task, user=request.user, instance=task, created=True)
 
             messages.success(request, _("Task added."))
 
@@ -36,3 +36,78 @@ TASK_STATUS = (
     ("resolved", _("Resolved")),
     ("closed", _("Closed")),
 )
+
+# Statuses a task is done in. Everything else counts as open.
+CLOSED_STATUSES = ("closed",)
+
+# Statuses a new task may start in.
+INITIAL_STATUSES = ("new", "research", "process")
+
+# Where a task of each type may go from each status. Staying in the same
+# status is always allowed and not listed.
+_FLOW = {
+    "new": ("research", "process", "closed"),
+    "research": ("new", "process", "closed"),
+    "process": ("research", "review", "closed"),
+    "review": ("process", "accepted"),
+    "accepted": ("process", "resolved"),
+    "resolved": ("process", "closed"),
+    "closed": ("new",),
+}
+
+TRANSITIONS = {
+    "request": _FLOW,
+    # Bugs can be resolved straight out of review, requests are accepted first.
+    "bug": dict(_FLOW, review=("process", "accepted", "resolved")),
+}
+
+class InvalidTransition(ValueError):
+    pass
+
+def _compile():
+    """
+    Turns TRANSITIONS into a set of allowed (type, old, new) triples and
+    the status choices to offer from every (type, status), so checking a
+    change or building a form is a lookup.
+    """
+    labels = dict(TASK_STATUS)
+    allowed = set()
+    choices = {}
+    for type, label in TASK_TYPE:
+        flow = TRANSITIONS[type]
+        for status, label in TASK_STATUS:
+            targets = set(flow.get(status, ())) | set([status])
+            for target in targets:
+                allowed.add((type, status, target))
+            choices[(type, status)] = tuple((value, labels[value]) for value, label in TASK_STATUS
+                if value in targets)
+    return frozenset(allowed), choices
+
+_ALLOWED, _CHOICES = _compile()
+_CLOSED = frozenset(CLOSED_STATUSES)
+
+def is_open(status):
+    return status not in _CLOSED
+
+def can_change(type, old, new):
+    return (type, old, new) in _ALLOWED
+
+def check_change(type, old, new):
+    if (type, old, new) not in _ALLOWED:
+        raise InvalidTransition(_("A %(type)s can't go from %(old)s to %(new)s.") % {
+            "type": type, "old": old, "new": new})
+
+def check_initial(type, status):
+    if status not in INITIAL_STATUSES:
+        raise InvalidTransition(_("A %(type)s can't start as %(status)s.") % {
+            "type": type, "status": status})
+
+def initial_choices():
+    return tuple((value, label) for value, label in TASK_STATUS if value in INITIAL_STATUSES)
+
+def status_choices(type, status):
+    """
+    Returns the status choices a task of the given type and status can
+    be changed to, itself included.
+    """
+    return _CHOICES.get((type, status), TASK_STATUS)
@@ -0,0 +1,73 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from projecter.apps.projects.bulk import bulk_delete, bulk_insert
+from projecter.apps.projects.models import Task, TaskChange, TaskChangeSet
+from projecter.apps.search.models import Posting, HISTORY_FIELDS, SOURCE_TASK, WEIGHTS, tokenize, weigh
+
+class Command(NoArgsCommand):
+    help = "Rebuilds the task search index from tasks, changesets and changes."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option("--chunk-size", dest="chunk_size", type="int", default=5000,
+            help="Number of task ids reindexed per transaction."),
+    )
+
+    def handle_noargs(self, **options):
+        self.verbosity = int(options.get("verbosity", 1))
+        chunk_size = options["chunk_size"]
+
+        # The index is rebuilt in place one task id range at a time, each
+        # range in its own transaction, so searches keep finding the tasks
+        # that are not reindexed yet instead of nothing.
+        last = Task.objects.order_by("-id").values_list("id", flat=True)[:1]
+        last = last and last[0] or 0
+        for start in xrange(0, last + 1, chunk_size):
+            self.reindex(start, start + chunk_size)
+            self.log("Indexed tasks below %d." % (start + chunk_size), 2)
+
+        self.log("Indexed %d tasks with their history." % Task.objects.count())
+
+    def log(self, message, verbosity=1):
+        if self.verbosity >= verbosity:
+            print message
+
+    @transaction.commit_on_success
+    def reindex(self, start, end):
+        bulk_delete(Posting.objects.filter(task__gte=start, task__lt=end))
+
+        tasks = Task.objects.filter(id__gte=start, id__lt=end)
+        self.index_tasks(tasks.values_list("id", "project", "name", "description"))
+
+        changesets = TaskChangeSet.objects.filter(task__gte=start, task__lt=end).exclude(
+            comment=None).exclude(comment="")
+        Posting.objects.add_history(list(changesets.values_list("task", "task__project", "comment")))
+
+        changes = TaskChange.objects.filter(task__gte=start, task__lt=end, field__in=HISTORY_FIELDS)
+        Posting.objects.add_history(list(changes.values_list("task", "task__project", "new_value")))
+
+    def index_tasks(self, rows):
+        postings = []
+        for task_id, project_id, name, description in rows:
+            weights = {}
+            weigh(tokenize(name), weights, WEIGHTS["name"])
+            weigh(tokenize(description), weights, WEIGHTS["description"])
+            postings.extend(Posting(term=term, task_id=task_id, project_id=project_id,
+                source=SOURCE_TASK, weight=weight) for term, weight in weights.items())
+        bulk_insert(Posting, postings)
@@ -0,0 +1,200 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+
+from django.db import connection, models
+
+from projecter.apps.projects import permissions, signals
+from projecter.apps.projects.bulk import bulk_insert
+from projecter.apps.projects.models import Project, Task
+
+TERM_LENGTH = 40
+
+SOURCE_TASK = 1
+SOURCE_HISTORY = 2
+
+SOURCES = (
+    (SOURCE_TASK, "task"),
+    (SOURCE_HISTORY, "history"),
+)
+
+# Weight of one occurrence of a term, by where it was found.
+WEIGHTS = {
+    "name": 5,
+    "description": 2,
+    "history": 1,
+}
+
+# TaskChange fields whose new values are indexed along with the comments.
+HISTORY_FIELDS = ("comment", "name", "status", "priority", "type")
+
+_words = re.compile(r"\w+", re.UNICODE)
+
+def tokenize(text):
+    """
+    Splits text into lowercased index terms, dropping one letter words.
+    """
+    if not text:
+        return []
+    return [word[:TERM_LENGTH] for word in _words.findall(unicode(text).lower()) if len(word) > 1]
+
+def weigh(terms, weights, weight):
+    for term in terms:
+        weights[term] = weights.get(term, 0) + weight
+
+##### Managers
+
+class PostingManager(models.Manager):
+    def index_task(self, task):
+        """
+        Replaces the postings of the task's name and description.
+        """
+        weights = {}
+        weigh(tokenize(task.name), weights, WEIGHTS["name"])
+        weigh(tokenize(task.description), weights, WEIGHTS["description"])
+
+        self.filter(task=task, source=SOURCE_TASK).delete()
+        bulk_insert(Posting, [
+            Posting(term=term, task_id=task.id, project_id=task.project_id, source=SOURCE_TASK, weight=weight)
+            for term, weight in weights.items()
+        ])
+
+        # History postings follow the task if it moved to another project.
+        self.filter(task=task, source=SOURCE_HISTORY).exclude(project=task.project_id).update(project=task.project_id)
+
+    def add_history(self, entries):
+        """
+        Adds (task_id, project_id, text) entries to the history postings,
+        adding to the weight of terms the task already has.
+        """
+        weights = {}
+        for task_id, project_id, text in entries:
+            for term in tokenize(text):
+                key = (term, task_id)
+                if key in weights:
+                    weights[key][1] += WEIGHTS["history"]
+                else:
+                    weights[key] = [project_id, WEIGHTS["history"]]
+
+        if not weights:
+            return
+
+        rows = self.filter(
+            source=SOURCE_HISTORY,
+            task__in=set(task_id for term, task_id in weights),
+            term__in=set(term for term, task_id in weights)
+        ).values_list("id", "term", "task")
+
+        increments = {}
+        for id, term, task_id in rows:
+            key = (term, task_id)
+            if key in weights:
+                increments.setdefault(weights.pop(key)[1], []).append(id)
+
+        for weight, ids in increments.items():
+            self.filter(id__in=ids).update(weight=models.F("weight") + weight)
+
+        bulk_insert(Posting, [
+            Posting(term=term, task_id=task_id, project_id=project_id, source=SOURCE_HISTORY, weight=weight)
+            for (term, task_id), (project_id, weight) in weights.items()
+        ])
+
+    def search(self, query, user, limit=200):
+        """
+        Returns [(task_id, score)] for the tasks that contain every term of
+        the query, best first. A term ending in * matches as a prefix.
+        Only projects where the user is one of the people or managers are
+        searched, unless the user is a superuser.
+        """
+        words = []
+        for word in query.split():
+            prefix = word.endswith("*")
+            for term in tokenize(word):
+                words.append((term, prefix))
+        if not words:
+            return []
+
+        postings = self.all()
+        projects = permissions.visible_projects(user)
+        if projects is not None:
+            # An empty IN can't be compiled into the subqueries below.
+            if not projects:
+                return []
+            postings = postings.filter(project__in=projects)
+
+        # One subquery per term, numbered so a task has to match all of
+        # them; the database intersects, scores and cuts to the limit, so
+        # common terms never come back to Python posting by posting. The
+        # compiled subqueries keep their %s placeholders, hence the joins.
+        parts = []
+        params = []
+        for position, (term, prefix) in enumerate(words):
+            if prefix:
+                matches = postings.filter(term__startswith=term)
+            else:
+                matches = postings.filter(term=term)
+            sql, sql_params = matches.values_list("task", "weight").query.get_compiler(self.db).as_sql()
+            parts.append("SELECT %d AS k, m.task_id, m.weight FROM (" % position + sql + ") m")
+            params.extend(sql_params)
+
+        sql = ("SELECT task_id, SUM(weight) AS score FROM (" + " UNION ALL ".join(parts) + ") matches"
+            " GROUP BY task_id HAVING COUNT(DISTINCT k) = %d" % len(words) +
+            " ORDER BY score DESC, task_id DESC LIMIT %d" % int(limit))
+        cursor = connection.cursor()
+        cursor.execute(sql, params)
+        return [(task_id, int(score)) for task_id, score in cursor.fetchall()]
+
+##### Models
+
+class Posting(models.Model):
+    """
+    One entry of the inverted index: term appears in task with the given
+    weight, either in its name and description or in its change history.
+    """
+    term = models.CharField(max_length=TERM_LENGTH)
+    task = models.ForeignKey(Task)
+    project = models.ForeignKey(Project, null=True)
+    source = models.PositiveSmallIntegerField(choices=SOURCES)
+    weight = models.PositiveIntegerField(default=1)
+
+    objects = PostingManager()
+
+    class Meta:
+        db_table = "search_posting"
+        unique_together = (("term", "task", "source"),)
+
+    def __unicode__(self):
+        return u"%s" % self.term
+
+##### Signals
+
+def task_loaded(sender, instance, **kwargs):
+    instance._indexed = (instance.name, instance.description, instance.project_id)
+
+def task_saved(sender, instance, created, **kwargs):
+    if created or instance._indexed != (instance.name, instance.description, instance.project_id):
+        Posting.objects.index_task(instance)
+        task_loaded(sender, instance)
+
+def history_logged(sender, changesets, **kwargs):
+    entries = []
+    for changeset in changesets:
+        texts = [changeset.comment] + [change.new_value for change in changeset.fields if change.field in HISTORY_FIELDS]
+        entries.append((changeset.task_id, changeset.task.project_id, u" ".join([text for text in texts if text])))
+    Posting.objects.add_history(entries)
+
+models.signals.post_init.connect(task_loaded, sender=Task)
+models.signals.post_save.connect(task_saved, sender=Task)
+signals.history_logged.connect(history_logged)
@@ -0,0 +1,2 @@
+-- Prefix lookups are range scans over term, narrowed to a project.
+CREATE INDEX search_posting_term_project ON search_posting (term, project_id);
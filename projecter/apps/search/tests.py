@@ -0,0 +1,72 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+
+from projecter.apps.projects.models import Task
+from projecter.apps.projects.tests import ProjectFixture
+from projecter.apps.search.models import Posting, tokenize
+
+class SearchTest(ProjectFixture, TestCase):
+    def setUp(self):
+        super(SearchTest, self).setUp()
+        self.both = self.task(name="Alpha beta", description="")
+        self.alpha = self.task(name="alphabet soup", description="")
+        self.described = self.task(name="gamma", description="alpha and beta, alpha")
+
+    def search(self, query, user=None, limit=200):
+        return Posting.objects.search(query, user or self.user, limit)
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize(u"A fix, for caf\xe9 FIX-42!"), [u"fix", u"for", u"caf\xe9", u"fix", u"42"])
+        self.assertEqual(tokenize(None), [])
+
+    def test_all_terms(self):
+        self.assertEqual(self.search("alpha beta"), [(self.both.id, 10), (self.described.id, 6)])
+        self.assertEqual(self.search("beta alpha delta"), [])
+        self.assertEqual(self.search("a *"), [])
+
+    def test_prefix(self):
+        self.assertEqual(self.search("alpha*"), [(self.alpha.id, 5), (self.both.id, 5), (self.described.id, 4)])
+        self.assertEqual(self.search("alp* soup"), [(self.alpha.id, 10)])
+        self.assertEqual(self.search("alpha*", limit=1), [(self.alpha.id, 5)])
+
+    def test_history(self):
+        task = Task.objects.get(id=self.alpha.id)
+        task.name = "renamed"
+        Task.objects.save_changed([task], self.user, "soup of the day")
+
+        self.assertEqual(self.search("soup"), [(task.id, 1)])
+        self.assertEqual(self.search("renamed"), [(task.id, 6)])
+        self.assertEqual(self.search("alphabet"), [])
+
+    def test_visible_projects(self):
+        stranger = User.objects.create_user("stranger", "stranger@example.com", "pw")
+        self.assertEqual(self.search("gamma", stranger), [])
+
+        stranger.is_superuser = True
+        stranger.save()
+        self.assertEqual(self.search("gamma", stranger), [(self.described.id, 5)])
+
+    def test_rebuild(self):
+        task = Task.objects.get(id=self.both.id)
+        Task.objects.save_changed([task], self.user, "alpha again")
+        expected = self.search("alpha*")
+
+        Posting.objects.all().delete()
+        call_command("rebuild_search_index", chunk_size=2, verbosity=0)
+        self.assertEqual(self.search("alpha*"), expected)
+        self.assertEqual(self.search("again"), [(task.id, 1)])
@@ -0,0 +1,5 @@
+from django.conf.urls.defaults import *
+
+urlpatterns = patterns('projecter.apps.search.views',
+    (r'^search/$', 'search_results'),
+)
@@ -0,0 +1,46 @@
+# Copyright 2010 Podcaster SA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django import http
+from django.conf import settings
+from django.template import RequestContext
+
+from django.shortcuts import render_to_response
+from django.core.paginator import Paginator, InvalidPage
+from django.contrib.auth.decorators import login_required
+
+from projecter.apps.projects.models import Task
+from projecter.apps.search.models import Posting
+
+SEARCH_PER_PAGE = getattr(settings, "SEARCH_RESULTS_PER_PAGE", 25)
+SEARCH_MAX_RESULTS = getattr(settings, "SEARCH_MAX_RESULTS", 200)
+
+@login_required
+def search_results(request, template="templates/search/results.html"):
+    query = request.GET.get("q", "").strip()
+
+    paginator = Paginator(Posting.objects.search(query, request.user, SEARCH_MAX_RESULTS), SEARCH_PER_PAGE)
+    try:
+        results = paginator.page(request.GET.get("page", 1))
+    except InvalidPage, err:
+        raise http.Http404()
+
+    # Only the tasks of the current page are loaded, in ranking order.
+    tasks = Task.objects.select_related("project", "milestone").in_bulk([task_id for task_id, score in results.object_list])
+    results.object_list = [tasks[task_id] for task_id, score in results.object_list if task_id in tasks]
+
+    return render_to_response(template, RequestContext(request, {
+        "query": query,
+        "results": results
+    }))
@@ -73,7 +73,52 @@ INTERNAL_IPS = ('127.0.0.1',)
 
 LOGIN_URL = '/login/'
 
+# Sessions, users, permissions and the versions every other cache entry
+# hangs from live in this cache, so all the web processes must share it:
+# run memcached, with python-memcached installed. On a per-process cache
+# (locmem, Django's default) sessions stay in the database and users and
+# permissions are read on every request, see projects.permissions.
+CACHE_BACKEND = 'memcached://127.0.0.1:11211/'
+
+# Sessions are read from the cache and only written to the session table
+# when they change. 'django.contrib.sessions.backends.cache' drops the
+# table altogether, at the price of logging everyone out when the cache
+# is flushed. Run manage.py purge_sessions from cron either way.
+if CACHE_BACKEND.split(':', 1)[0] in ('locmem', 'dummy'):
+    SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+else:
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# The default storage reads auth_message on every authenticated request.
+MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
+
+AUTHENTICATION_BACKENDS = (
+    'projecter.apps.projects.permissions.CachedModelBackend',
+)
+
+# Where events wait for the worker: "database" (run manage.py events_worker)
+# or "local" (a thread in the web process, for development).
+EVENTS_QUEUE_BACKEND = 'database'
+
+# What wakes up /api/projects/<id>/wait/ requests: "database" (polls the
+# task versions, works across processes) or "local" (same process only).
+PROJECTER_NOTIFIER_BACKEND = 'database'
+
+# Most queries a view may run, checked by the instrumentation middleware
+# ("view" or "view:METHOD"). Over budget is a warning in the log, or an
+# error when INSTRUMENTATION_STRICT is on. Aggregates are at /stats/.
+INSTRUMENTATION_BUDGETS = {
+    'projecter.apps.projects.views.projects_index': 6,
+    'projecter.apps.projects.views.projects_project': 12,
+    'projecter.apps.projects.views.projects_milestone': 8,
+    'projecter.apps.projects.views.projects_task': 12,
+    'projecter.apps.projects.views.projects_task:POST': 36,
+    'projecter.apps.projects.views.projects_task_add:POST': 36,
+    'projecter.apps.projects.views.projects_task_bulk:POST': 40,
+}
+
 MIDDLEWARE_CLASSES = (
+    'projecter.apps.instrumentation.middleware.InstrumentationMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -98,5 +143,8 @@ INSTALLED_APPS = (
     'django.contrib.messages',
     'projecter.apps.accounts',
     'projecter.apps.projects',
+    'projecter.apps.events',
+    'projecter.apps.search',
+    'projecter.apps.instrumentation',
 #    'debug_toolbar',
 )
@@ -8,6 +8,9 @@ urlpatterns = patterns('',
     # Example:
     (r'^', include('projecter.apps.projects.urls')),
     (r'^', include('projecter.apps.accounts.urls')),
+    (r'^', include('projecter.apps.events.urls')),
+    (r'^', include('projecter.apps.search.urls')),
+    (r'^', include('projecter.apps.instrumentation.urls')),
 
     # Uncomment the admin/doc line below and add 'django.contrib.admindocs' 
     # to INSTALLED_APPS to enable admin documentation: